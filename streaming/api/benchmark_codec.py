@@ -0,0 +1,104 @@
+"""Trip codec benchmark: per-request CPU of each stage, Pydantic path vs TripCodec
+
+Takes the same API request bodies through the original hot path (FastAPI's
+json.loads + TripEvent validation, model_dump + isoformat, then json.dumps
+or the Avro encoder) and through TripCodec (one validating decode, one
+encode), and prints microseconds per trip per stage. For comparison it also
+times appending the encoded value to a Kafka record batch, the client-side
+part of the send itself.
+
+    python benchmark_codec.py --rows 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+from kafka.record.memory_records import MemoryRecordsBuilder
+
+from schemas import TripEvent
+from trip_codec import TripCodec, utc_now
+from wire_format import AvroTripEncoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'spark'))
+from benchmark_wire import generate_messages  # noqa: E402
+
+SERVER_FIELDS = ('trip_id', 'received_at')
+
+
+def timed(stage, inputs: list, repeat: int):
+    """(outputs, best seconds) of stage over all inputs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [stage(item) for item in inputs]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return outputs, best
+
+
+def trip_message(trip: TripEvent) -> dict:
+    """The original main.trip_message"""
+    message = trip.model_dump()
+    message['trip_id'] = str(uuid.uuid4())
+    message['received_at'] = utc_now().isoformat()
+    message['tpep_pickup_datetime'] = trip.tpep_pickup_datetime.isoformat()
+    message['tpep_dropoff_datetime'] = trip.tpep_dropoff_datetime.isoformat()
+    return message
+
+
+def append_records(values: list):
+    builder = MemoryRecordsBuilder(2, 0, 16384)
+    for value in values:
+        if builder.append(None, None, value) is None:
+            builder = MemoryRecordsBuilder(2, 0, 16384)
+            builder.append(None, None, value)
+
+
+def run(bodies: list, wire_format: str, repeat: int):
+    rows = len(bodies)
+    serialize = (lambda message: json.dumps(message).encode('utf-8')) if wire_format == 'json' else AvroTripEncoder()
+    codec = TripCodec(wire_format)
+
+    def report(name: str, seconds: float):
+        print(f"   {name:<36} {seconds / rows * 1e6:>7.2f} µs/trip")
+
+    print(f" {wire_format}, before (Pydantic):")
+    trips, validate = timed(lambda body: TripEvent.model_validate(json.loads(body)), bodies, repeat)
+    messages, dump = timed(trip_message, trips, repeat)
+    values, encode = timed(serialize, messages, repeat)
+    report('json.loads + TripEvent validation', validate)
+    report('model_dump + isoformat', dump)
+    report('json.dumps' if wire_format == 'json' else 'AvroTripEncoder', encode)
+    report('total', validate + dump + encode)
+
+    print(f" {wire_format}, TripCodec:")
+    structs, decode = timed(codec.decode, bodies, repeat)
+    values, encode = timed(lambda trip: codec.encode(trip, str(uuid.uuid4()), utc_now().isoformat()),
+                           structs, repeat)
+    report('decode + validate', decode)
+    report('encode (incl. trip_id, received_at)', encode)
+    report('total', decode + encode)
+
+    _, append = timed(append_records, [values], repeat)
+    report('for comparison: record batch append', append)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trip codec benchmark')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of synthetic trips')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (best is reported)')
+    args = parser.parse_args()
+
+    bodies = [json.dumps({k: v for k, v in message.items() if k not in SERVER_FIELDS}).encode('utf-8')
+              for message in generate_messages(args.rows)]
+    print(f"Handling {args.rows:,} trip request bodies")
+    for wire_format in ('json', 'avro'):
+        run(bodies, wire_format, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
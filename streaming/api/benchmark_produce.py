@@ -0,0 +1,98 @@
+"""Producer profile benchmark: batching and compression per KAFKA_PRODUCER_PROFILE
+
+Runs the same API-shaped trip messages through each profile's client-side
+produce path - serializer, key partitioning and the v2 record batches the
+producer builds and compresses before sending - and prints bytes per message
+on the wire, batches (produce requests per partition) and messages/sec.
+Batches are filled completely, as they are under sustained load; at low
+rates linger_ms decides how full they get. With --bootstrap it also produces
+to a real broker with each profile and times send + flush.
+
+    python benchmark_produce.py --rows 200000
+    python benchmark_produce.py --rows 200000 --bootstrap localhost:9092 --topic bench.trips
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from kafka import KafkaProducer
+from kafka.partitioner.default import murmur2
+from kafka.record.memory_records import MemoryRecordsBuilder
+
+from kafka_producer import PRODUCER_PROFILES
+from wire_format import get_serializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'spark'))
+from benchmark_wire import generate_messages  # noqa: E402
+
+
+def build_batches(messages: list, serializer, settings: dict, partitions: int):
+    """Serialize, partition by key and close full record batches like the producer's accumulator"""
+    codec = KafkaProducer._COMPRESSORS[settings['compression_type']][1]
+    open_batches, closed = {}, []
+    for message in messages:
+        key = str(message['PULocationID']).encode('utf-8')
+        value = serializer(message)
+        partition = (murmur2(key) & 0x7fffffff) % partitions
+        builder = open_batches.get(partition)
+        if builder is None or builder.append(None, key, value) is None:
+            if builder is not None:
+                builder.close()
+                closed.append(builder)
+            builder = open_batches[partition] = MemoryRecordsBuilder(2, codec, settings['batch_size'])
+            builder.append(None, key, value)
+    for builder in open_batches.values():
+        builder.close()
+        closed.append(builder)
+    return closed
+
+
+def run_offline(messages: list, wire_format: str, partitions: int, repeat: int):
+    serializer = get_serializer(wire_format)
+    print(f"   {'profile':<11} {'codec':<6} {'B/msg':>7} {'batches':>8} {'msgs/sec':>12}")
+    for profile, settings in PRODUCER_PROFILES.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            batches = build_batches(messages, serializer, settings, partitions)
+            timings.append(time.perf_counter() - start)
+        wire = sum(batch.size_in_bytes() for batch in batches)
+        print(f"   {profile:<11} {settings['compression_type'] or 'none':<6} {wire / len(messages):>7.1f} "
+              f"{len(batches):>8,} {len(messages) / min(timings):>12,.0f}")
+
+
+def run_broker(messages: list, wire_format: str, bootstrap: str, topic: str):
+    for profile, settings in PRODUCER_PROFILES.items():
+        producer = KafkaProducer(bootstrap_servers=bootstrap.split(','), value_serializer=get_serializer(wire_format),
+                                 key_serializer=lambda x: x.encode('utf-8'), acks='all', **settings)
+        producer.partitions_for(topic)
+        start = time.perf_counter()
+        for message in messages:
+            producer.send(topic, key=str(message['PULocationID']), value=message)
+        producer.flush()
+        seconds = time.perf_counter() - start
+        producer.close()
+        print(f"   {profile:<11} {len(messages) / seconds:>12,.0f} msgs/sec to {bootstrap} ({seconds:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Producer profile benchmark')
+    parser.add_argument('--rows', type=int, default=200_000, help='Number of synthetic trips')
+    parser.add_argument('--format', default='json', choices=['json', 'avro'], help='Wire format (KAFKA_WIRE_FORMAT)')
+    parser.add_argument('--partitions', type=int, default=1, help='Partitions of the trips topic')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per profile (best is reported)')
+    parser.add_argument('--bootstrap', help='Also produce to this broker with each profile')
+    parser.add_argument('--topic', default='bench.trips', help='Topic for --bootstrap runs')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.rows)
+    print(f"Producing {args.rows:,} {args.format} trip messages over {args.partitions} partition(s)")
+    run_offline(messages, args.format, args.partitions, args.repeat)
+    if args.bootstrap:
+        run_broker(messages, args.format, args.bootstrap, args.topic)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""Idempotency-Key deduplication for webhook retries
+
+A partner that retries a timed-out POST /api/v1/trips sends the same
+Idempotency-Key again. The key is claimed with the request's trip_id before
+anything is produced, so a retry gets the original trip_id back and nothing
+is produced twice. A retry that arrives while the first request is still
+producing waits for it. If that produce fails, the key is released and the
+retry produces instead.
+
+Keys live in an in-process cache, bounded to IDEMPOTENCY_MAX_KEYS with
+least-recently-used eviction and expiring after IDEMPOTENCY_TTL_S. With
+IDEMPOTENCY_REDIS=true they are also claimed in Redis (SET NX with the same
+TTL), so retries landing on another API instance are caught too; one that
+arrives there while the first request is still producing is refused with
+IdempotencyInProgress, as it cannot be waited for. If Redis is unreachable,
+the in-process cache alone decides.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import msgspec
+import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', '100000'))
+IDEMPOTENCY_TTL_S = int(os.getenv('IDEMPOTENCY_TTL_S', '86400'))
+IDEMPOTENCY_REDIS = os.getenv('IDEMPOTENCY_REDIS', 'false').lower() == 'true'
+IDEMPOTENCY_KEY_PREFIX = 'idempotency:'
+
+# Claims are stored as "<trip_id> <fingerprint> <pending|done>". Both scripts
+# only touch a claim that is still this request's: it may have expired and been
+# claimed again since.
+COMPLETE_SCRIPT = """
+local claimed = redis.call('GET', KEYS[1])
+if claimed and string.sub(claimed, 1, #ARGV[1]) == ARGV[1] then
+    return redis.call('SET', KEYS[1], (string.gsub(claimed, ' pending$', ' done')), 'KEEPTTL')
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+local claimed = redis.call('GET', KEYS[1])
+if claimed and string.sub(claimed, 1, #ARGV[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different trip"""
+
+
+class IdempotencyInProgress(Exception):
+    """The key's first request is still producing on another API instance"""
+
+
+def fingerprint(trip) -> str:
+    """Digest of a decoded trip; equal for retries whatever their whitespace or key order"""
+    return hashlib.blake2b(msgspec.json.encode(trip), digest_size=16).hexdigest()
+
+
+class IdempotencyEntry:
+    __slots__ = ('trip_id', 'fingerprint', 'expires_at', 'done')
+
+    def __init__(self, trip_id: str, fingerprint: str, expires_at: float, done: asyncio.Future):
+        self.trip_id = trip_id
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        # True once the trip is produced, False if that failed and the key was released
+        self.done = done
+
+
+class IdempotencyStore:
+    """Idempotency-Key -> the trip it was first used for; LRU/TTL in process, optionally shared via Redis"""
+
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS, ttl_s: int = IDEMPOTENCY_TTL_S,
+                 redis_client: redis.Redis = None, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.ttl_s = ttl_s
+        self.redis = redis_client
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._complete = redis_client.register_script(COMPLETE_SCRIPT) if redis_client is not None else None
+        self._release = redis_client.register_script(RELEASE_SCRIPT) if redis_client is not None else None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.conflicts = 0
+        self.in_progress = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.redis_errors = 0
+
+    def _get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, entry: IdempotencyEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        # Expired keys at the cold end go first, then least recently used ones past the bound
+        now = self.clock()
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest.expires_at > now:
+                break
+            self._entries.popitem(last=False)
+            self.expirations += 1
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _forget(self, key: str, entry: IdempotencyEntry):
+        """Drop a pending entry; whoever waits on it tries to claim the key again"""
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        if not entry.done.done():
+            entry.done.set_result(False)
+
+    async def _claim_shared(self, key: str, trip_id: str, digest: str):
+        """None if this instance claimed the key in Redis, else (trip_id, fingerprint, state) of the earlier claim"""
+        name = IDEMPOTENCY_KEY_PREFIX + key
+        try:
+            if await self.redis.set(name, f"{trip_id} {digest} pending", nx=True, ex=self.ttl_s):
+                return None
+            claimed = await self.redis.get(name)
+        except redis.RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"⚠️ Idempotency tier unavailable, deduplicating in process only: {e}")
+            return None
+        if claimed is None:  # expired in between
+            return await self._claim_shared(key, trip_id, digest)
+        return tuple(claimed.decode().split(' ', 2))
+
+    async def claim(self, key: str, trip_id: str, digest: str):
+        """Claim key for trip_id; returns None if it is new, otherwise the trip_id it was first used for.
+
+        Raises IdempotencyConflict if the key came with a different trip, and
+        IdempotencyInProgress if another instance is still producing it.
+        Every None must be followed by complete() or release().
+        """
+        while True:
+            entry = self._get(key)
+            if entry is None:
+                break
+            if entry.fingerprint != digest:
+                self.conflicts += 1
+                raise IdempotencyConflict(key)
+            if not entry.done.done():
+                self.waits += 1
+            if await asyncio.shield(entry.done):
+                self.hits += 1
+                return entry.trip_id
+            # The first request failed and released the key; try to claim it again
+
+        # Pending locally before Redis is asked, so concurrent retries here wait for this claim
+        entry = IdempotencyEntry(trip_id, digest, self.clock() + self.ttl_s, asyncio.get_running_loop().create_future())
+        self._put(key, entry)
+        if self.redis is not None:
+            try:
+                claimed = await self._claim_shared(key, trip_id, digest)
+            except BaseException:
+                self._forget(key, entry)
+                raise
+            if claimed is not None:
+                original_id, original_digest, state = claimed
+                if original_digest != digest:
+                    self._forget(key, entry)
+                    self.conflicts += 1
+                    raise IdempotencyConflict(key)
+                if state != 'done':
+                    self._forget(key, entry)
+                    self.in_progress += 1
+                    raise IdempotencyInProgress(key)
+                self.redis_hits += 1
+                entry.trip_id = original_id
+                entry.done.set_result(True)
+                return original_id
+        self.misses += 1
+        return None
+
+    async def complete(self, key: str, trip_id: str):
+        """The claimed trip was produced: retries get its trip_id from now on"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.trip_id == trip_id and not entry.done.done():
+            entry.done.set_result(True)
+        if self._complete is not None:
+            try:
+                await self._complete(keys=[IDEMPOTENCY_KEY_PREFIX + key], args=[f"{trip_id} "])
+            except redis.RedisError as e:
+                self.redis_errors += 1
+                logger.warning(f"⚠️ Could not complete idempotency key {key}: {e}")
+
+    async def release(self, key: str, trip_id: str):
+        """The claimed trip was not produced: forget the key so that a retry produces it"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.trip_id == trip_id:
+            self._forget(key, entry)
+        if self._release is not None:
+            try:
+                await self._release(keys=[IDEMPOTENCY_KEY_PREFIX + key], args=[f"{trip_id} "])
+            except redis.RedisError as e:
+                self.redis_errors += 1
+                logger.warning(f"⚠️ Could not release idempotency key {key}: {e}")
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "tier": "memory+redis" if self.redis is not None else "memory",
+            "keys": len(self._entries),
+            "max_keys": self.max_keys,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "in_flight_waits": self.waits,
+            "conflicts": self.conflicts,
+            "in_progress": self.in_progress,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "redis_errors": self.redis_errors,
+        }
+
+
+def create_store() -> IdempotencyStore:
+    """The store configured by the environment; the Redis tier uses REDIS_HOST / REDIS_PORT"""
+    client = None
+    if IDEMPOTENCY_REDIS:
+        # Short timeouts and one immediate retry: a slow or missing Redis must not hold up trip requests
+        client = redis.Redis(host=os.getenv('REDIS_HOST', 'localhost'), port=int(os.getenv('REDIS_PORT', 6379)),
+                             socket_connect_timeout=0.5, socket_timeout=0.5, retry=Retry(NoBackoff(), 1))
+    return IdempotencyStore(redis_client=client)
@@ -0,0 +1,417 @@
+"""Streaming bulk ingest: NDJSON (optionally gzip), Arrow IPC and Parquet uploads
+
+The body is decoded while it arrives, in chunks of INGEST_CHUNK_ROWS records.
+Each chunk is checked against TripEvent's field constraints with Arrow
+compute, one vectorized pass per field instead of one Pydantic object per
+trip, and its valid trips go to the producer before the next chunk is read.
+Memory therefore stays at about one chunk plus the producer's buffer, however
+many trips the upload has; a full producer buffer slows reading the body down.
+
+The vectorized check covers the encodings feeds actually use (numbers, ISO
+8601 date-times). Records it rejects, such as numeric strings in NDJSON or
+Unix timestamps, get a second pass through TripEvent itself, so an upload
+accepts exactly the trips /api/v1/trips accepts.
+
+Parquet and Arrow IPC files keep their footer at the end, so those uploads
+are spooled (to disk past INGEST_SPOOL_BYTES) and then read chunk by chunk.
+"""
+
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from typing import get_args
+
+import annotated_types
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+import msgspec
+from kafka.errors import KafkaTimeoutError
+
+from kafka_producer import DELIVERY_TIMEOUT_S
+from schemas import TripEvent
+from trip_codec import DATETIME_FIELDS, utc_now, validate_trip
+
+logger = logging.getLogger(__name__)
+
+INGEST_CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', '10000'))
+INGEST_SPOOL_BYTES = int(os.getenv('INGEST_SPOOL_BYTES', str(16 * 1024 * 1024)))
+# Rejected or failed records reported back individually; the rest are only counted
+MAX_ERROR_SAMPLES = 100
+
+# A corrupt or truncated body; what was decoded before it still counts
+UPLOAD_ERRORS = (OSError, EOFError, zlib.error, pa.ArrowException)
+
+# Content-Type -> upload format
+CONTENT_ENCODINGS = ('identity', 'gzip')
+INGEST_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/vnd.apache.arrow.stream': 'arrow',
+    'application/vnd.apache.arrow.file': 'arrow-file',
+    'application/vnd.apache.parquet': 'parquet',
+    'application/x-parquet': 'parquet',
+}
+
+TIMESTAMP = pa.timestamp('us')
+_ARROW_TYPES = {int: pa.int64(), float: pa.float64(), str: pa.string(), datetime: TIMESTAMP}
+# Strings shaped like ISO 8601 date-times and decimal numbers, which TripEvent
+# and Arrow's casts read alike; other strings are left to TripEvent (see rescue)
+ISO_DATETIME = r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?(Z|[+-]\d{2}:\d{2})?)?$'
+UTC_OFFSET = r'(Z|[+-]\d{2}:\d{2})$'
+DECIMAL = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+# Field constraint -> (attribute, comparison that finds violations, operator shown)
+_BOUNDS = {
+    annotated_types.Ge: ('ge', pc.less, '>='),
+    annotated_types.Gt: ('gt', pc.less_equal, '>'),
+    annotated_types.Le: ('le', pc.greater, '<='),
+    annotated_types.Lt: ('lt', pc.greater_equal, '<'),
+}
+# TripEvent.validate_store_fwd, which the Field constraints cannot express
+CHOICES = {'store_and_fwd_flag': ('Y', 'N')}
+
+
+def _trip_fields() -> list:
+    """(name, arrow type, default or None if required, [(violated, message, bound)]) per TripEvent field"""
+    fields = []
+    for name, field in TripEvent.model_fields.items():
+        python_type = next(t for t in (*get_args(field.annotation), field.annotation) if t in _ARROW_TYPES)
+        bounds = []
+        for constraint in field.metadata:
+            attribute, violated, op = _BOUNDS[type(constraint)]
+            bound = getattr(constraint, attribute)
+            bounds.append((violated, f"must be {op} {bound}", bound))
+        fields.append((name, _ARROW_TYPES[python_type], None if field.is_required() else field.default, bounds))
+    return fields
+
+
+TRIP_FIELDS = _trip_fields()
+# JSON numbers are read as doubles so that 3.0 is accepted for an int field, as
+# Pydantic does, and timestamps as strings, which validate_chunk parses
+NDJSON_SCHEMA = pa.schema([(name, pa.float64() if arrow_type == pa.int64()
+                            else pa.string() if name in DATETIME_FIELDS else arrow_type)
+                           for name, arrow_type, _, _ in TRIP_FIELDS])
+
+
+def ingest_format(content_type: str):
+    return INGEST_FORMATS.get((content_type or '').split(';')[0].strip().lower())
+
+
+class BodyStream(io.RawIOBase):
+    """Blocking, read-only file object over an ASGI request body.
+
+    For decoders running in a worker thread: every read pulls the next chunk
+    from the event loop, so the upload is only received as fast as it is decoded.
+    """
+
+    def __init__(self, chunks, loop: asyncio.AbstractEventLoop):
+        self._chunks = chunks.__aiter__()
+        self._loop = loop
+        self._pending = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    async def _next_chunk(self):
+        try:
+            return await anext(self._chunks)
+        except StopAsyncIteration:
+            return None
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = asyncio.run_coroutine_threadsafe(self._next_chunk(), self._loop).result()
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def open_upload(body: BodyStream, encoding: str = 'identity'):
+    """Buffered (and, for Content-Encoding: gzip, decompressing) reader over an upload"""
+    stream = io.BufferedReader(body, 1024 * 1024)
+    return gzip.GzipFile(fileobj=stream) if encoding == 'gzip' else stream
+
+
+def _read_ndjson_lines(lines: list, first: int):
+    """One chunk of NDJSON lines -> (table, record index per row, [(index, error, line)] for unreadable lines)"""
+    options = pa_json.ParseOptions(explicit_schema=NDJSON_SCHEMA, unexpected_field_behavior='ignore')
+    try:
+        table = pa_json.read_json(io.BytesIO(b''.join(lines)), parse_options=options)
+        return table, range(first, first + len(lines)), []
+    except pa.ArrowInvalid:
+        pass
+    # Something in the chunk does not parse: find it line by line
+    tables, records, rejects = [], [], []
+    for index, line in enumerate(lines, first):
+        try:
+            tables.append(pa_json.read_json(io.BytesIO(line), parse_options=options))
+            records.append(index)
+        except pa.ArrowInvalid as e:
+            rejects.append((index, str(e), line))
+    table = pa.concat_tables(tables) if tables else NDJSON_SCHEMA.empty_table()
+    return table, records, rejects
+
+
+def read_ndjson(stream):
+    lines, first = [], 0
+    for line in stream:
+        if not line.strip():
+            continue
+        lines.append(line if line.endswith(b'\n') else line + b'\n')
+        if len(lines) == INGEST_CHUNK_ROWS:
+            yield _read_ndjson_lines(lines, first)
+            first += len(lines)
+            lines = []
+    if lines:
+        yield _read_ndjson_lines(lines, first)
+
+
+def read_record_batches(batches):
+    first = 0
+    for batch in batches:
+        for offset in range(0, batch.num_rows, INGEST_CHUNK_ROWS):
+            chunk = batch.slice(offset, INGEST_CHUNK_ROWS)
+            yield pa.Table.from_batches([chunk]), range(first, first + chunk.num_rows), []
+            first += chunk.num_rows
+
+
+def _spool(stream):
+    spool = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+    shutil.copyfileobj(stream, spool, 1024 * 1024)
+    spool.seek(0)
+    return spool
+
+
+def read_chunks(stream, fmt: str):
+    """(table, record index per row, [(index, error, raw record)]) chunks of an upload"""
+    if fmt == 'ndjson':
+        yield from read_ndjson(stream)
+    elif fmt == 'arrow':
+        yield from read_record_batches(ipc.open_stream(stream))
+    elif fmt == 'arrow-file':
+        with _spool(stream) as spool:
+            reader = ipc.open_file(spool)
+            yield from read_record_batches(reader.get_batch(i) for i in range(reader.num_record_batches))
+    elif fmt == 'parquet':
+        with _spool(stream) as spool:
+            parquet = pq.ParquetFile(spool)
+            columns = [name for name, _, _, _ in TRIP_FIELDS if name in parquet.schema_arrow.names]
+            yield from read_record_batches(parquet.iter_batches(batch_size=INGEST_CHUNK_ROWS, columns=columns))
+    else:
+        raise ValueError(f"Unknown ingest format '{fmt}'")
+
+
+def _cast_timestamps(strings: pa.ChunkedArray) -> pa.ChunkedArray:
+    shaped = pc.fill_null(pc.match_substring_regex(strings, ISO_DATETIME), False)
+    aware = pc.fill_null(pc.match_substring_regex(strings, UTC_OFFSET), False)
+    naive = pc.if_else(pc.and_not(shaped, aware), strings, pa.scalar(None, pa.string()))
+    offset = pc.if_else(pc.and_(shaped, aware), strings, pa.scalar(None, pa.string()))
+    return pc.coalesce(pc.cast(naive, TIMESTAMP), pc.cast(pc.cast(offset, pa.timestamp('us', 'UTC')), TIMESTAMP))
+
+
+def parse_timestamps(strings: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Naive UTC timestamps for ISO 8601 strings; null for other strings and impossible dates"""
+    try:
+        return _cast_timestamps(strings)
+    except pa.ArrowInvalid:
+        pass
+    # Shaped like a date-time but not one (2026-02-30): parse the strings one at a time
+    values = []
+    for i in range(len(strings)):
+        try:
+            values.append(_cast_timestamps(strings.slice(i, 1))[0].as_py())
+        except pa.ArrowInvalid:
+            values.append(None)
+    return pa.chunked_array([pa.array(values, TIMESTAMP)])
+
+
+def validate_chunk(table: pa.Table):
+    """Check a chunk against TripEvent like Pydantic would, one vectorized pass per field.
+
+    Returns (valid trips as a table of TripEvent's fields, with optional
+    fields defaulted, their row positions in the chunk, [(row, error)] for the
+    others; the error is the first failing field).
+    """
+    rows = table.num_rows
+    if rows == 0:
+        # Every line of the chunk was unreadable; compute kernels crash on columns without chunks
+        return pa.table({name: pa.array([], arrow_type) for name, arrow_type, _, _ in TRIP_FIELDS}), [], []
+    errors = pa.nulls(rows, pa.string())
+
+    def reject(mask, message: str):
+        nonlocal errors
+        mask = pc.fill_null(mask, False)
+        errors = pc.if_else(pc.and_(mask, pc.is_null(errors)), pa.scalar(message), errors)
+
+    columns = {}
+    for name, arrow_type, default, bounds in TRIP_FIELDS:
+        column = table.column(name) if name in table.column_names else pa.nulls(rows, arrow_type)
+        if pa.types.is_timestamp(arrow_type) and not pa.types.is_timestamp(column.type):
+            # Numbers are Unix timestamps to TripEvent, but a cast would read them in microseconds
+            parsed = parse_timestamps(column) if pa.types.is_string(column.type) else pa.nulls(rows, arrow_type)
+            reject(pc.and_(pc.is_valid(column), pc.is_null(parsed)), f"{name}: must be an ISO 8601 date-time")
+            column = parsed
+        elif pa.types.is_string(column.type) and arrow_type in (pa.int64(), pa.float64()):
+            # Read as doubles, so "3.0" is an int like 3.0 is
+            parsed = pc.cast(pc.if_else(pc.fill_null(pc.match_substring_regex(column, DECIMAL), False), column,
+                                        pa.scalar(None, pa.string())), pa.float64())
+            reject(pc.and_(pc.is_valid(column), pc.is_null(parsed)), f"{name}: must be a number")
+            column = parsed
+        if pa.types.is_floating(column.type) and pa.types.is_integer(arrow_type):
+            reject(pc.not_equal(column, pc.floor(column)), f"{name}: must be an integer")
+            column = pc.cast(pc.floor(column), arrow_type, safe=False)
+        try:
+            column = pc.cast(column, arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            reject(pa.repeat(True, rows), f"{name}: cannot be read as {arrow_type} from {column.type}")
+            column = pa.nulls(rows, arrow_type)
+        if default is None:
+            reject(pc.is_null(column), f"{name}: field required")
+        else:
+            column = pc.fill_null(column, pa.scalar(default, arrow_type))
+        for violated, message, bound in bounds:
+            reject(violated(column, pa.scalar(bound, arrow_type)), f"{name}: {message}")
+        if name in CHOICES:
+            reject(pc.invert(pc.is_in(column, pa.array(CHOICES[name]))),
+                   f"{name}: must be {' or '.join(CHOICES[name])}")
+        columns[name] = column
+
+    valid = pc.is_null(errors)
+    trips = pa.table(columns).filter(valid)
+    positions = pc.indices_nonzero(valid).to_pylist()
+    invalid = pc.indices_nonzero(pc.invert(valid))
+    return trips, positions, list(zip(invalid.to_pylist(), pc.take(errors, invalid).to_pylist()))
+
+
+def rescue(candidates: list):
+    """Second pass through TripEvent for records the vectorized check rejected.
+
+    candidates are (index, error, record), the record being a raw NDJSON line
+    or a row of the chunk. Returns ([(index, trip)] for the records TripEvent
+    accepts, [(index, error)] for those it rejects too). Like validate_chunk,
+    a null optional field takes its default.
+    """
+    rescued, rejected = [], []
+    for index, error, record in candidates:
+        if isinstance(record, bytes):
+            try:
+                record = json.loads(record)
+            except ValueError:
+                record = None
+        trip = None
+        if isinstance(record, dict):
+            trip = validate_trip({name: value for name, value in record.items() if value is not None})
+        if trip is None:
+            rejected.append((index, error))
+        else:
+            rescued.append((index, msgspec.structs.asdict(trip)))
+    return rescued, rejected
+
+
+def trip_messages(trips: list) -> list:
+    """Producer messages for validated trips (dicts of TripEvent's fields), shaped like the single-trip endpoint's"""
+    received_at = utc_now().isoformat()
+    for message in trips:
+        message['tpep_pickup_datetime'] = message['tpep_pickup_datetime'].isoformat()
+        message['tpep_dropoff_datetime'] = message['tpep_dropoff_datetime'].isoformat()
+        message['trip_id'] = str(uuid.uuid4())
+        message['received_at'] = received_at
+    return trips
+
+
+class IngestTally:
+    """Outcome counts of one upload; delivery callbacks update it from the producer's I/O thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.rejected = 0
+        self.queued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.nacked = 0
+        self.errors = []
+        self.aborted = None
+
+    def _sample(self, index: int, error: str):
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append({'index': index, 'error': error})
+
+    def reject(self, index: int, error: str):
+        with self._lock:
+            self.rejected += 1
+            self._sample(index, error)
+
+    def fail(self, index: int, error, nacked: bool = False):
+        with self._lock:
+            self.failed += 1
+            self.nacked += nacked
+            self._sample(index, str(error) or type(error).__name__)
+
+    def deliver(self, _metadata=None):
+        with self._lock:
+            self.delivered += 1
+
+    def summary(self, wait: bool) -> dict:
+        """Counts as of now; with wait, queued trips without an ack yet count as failed"""
+        with self._lock:
+            failed = self.failed + (self.queued - self.delivered - self.nacked if wait else 0)
+            return {'total': self.total, 'successful': self.total - self.rejected - failed,
+                    'rejected': self.rejected, 'failed': failed, 'errors': sorted(self.errors, key=lambda error: error['index']),
+                    'aborted': self.aborted}
+
+
+def ingest(stream, fmt: str, client, wait: bool) -> dict:
+    """Decode, validate and produce an upload chunk by chunk; blocks, so run it in a worker thread.
+
+    With wait, the producer is flushed at the end and the summary counts
+    broker acks; otherwise it counts trips handed to the producer. An
+    unreadable body stops the upload where it breaks (summary 'aborted').
+    """
+    tally = IngestTally()
+    try:
+        for table, records, rejects in read_chunks(stream, fmt):
+            tally.total += table.num_rows + len(rejects)
+            trips, positions, invalid = validate_chunk(table)
+            invalid_rows = table.take([row for row, _ in invalid]).to_pylist() if invalid else []
+            rescued, rejected = rescue(rejects + [(records[row], error, record)
+                                                  for (row, error), record in zip(invalid, invalid_rows)])
+            for index, error in rejected:
+                tally.reject(index, error)
+            indices = [records[row] for row in positions] + [index for index, _ in rescued]
+            for index, message in zip(indices, trip_messages(trips.to_pylist() + [trip for _, trip in rescued])):
+                try:
+                    future = client.enqueue(message)
+                except Exception as e:
+                    client._delivery_failed(message['trip_id'], e)
+                    tally.fail(index, e)
+                    continue
+                tally.queued += 1
+                if wait:
+                    future.add_callback(tally.deliver)
+                    future.add_errback(lambda error, index=index: tally.fail(index, error, nacked=True))
+                future.add_errback(lambda error, trip_id=message['trip_id']: client._delivery_failed(trip_id, error))
+    except UPLOAD_ERRORS as e:
+        logger.error(f"❌ Ingest aborted after {tally.total} records: {e}")
+        tally.aborted = str(e) or type(e).__name__
+    if wait:
+        try:
+            client.producer.flush(DELIVERY_TIMEOUT_S)
+        except KafkaTimeoutError:
+            logger.error(f"❌ Ingest: no ack within {DELIVERY_TIMEOUT_S}s for part of the upload")
+    return tally.summary(wait)
@@ -2,31 +2,104 @@
 
 from kafka import KafkaProducer
 from kafka.errors import KafkaError
-import json
+import asyncio
 import logging
 import os
 
+from trip_codec import TripCodec
+from wire_format import get_serializer
+
 logger = logging.getLogger(__name__)
 
+# broker: answer once the broker has acknowledged the write (acks=all),
+# enqueued: answer as soon as the message is in the producer's buffer
+ACK_MODES = ('broker', 'enqueued')
+DELIVERY_TIMEOUT_S = 10
+
+# Producer batching and compression per deployment (KAFKA_PRODUCER_PROFILE);
+# KAFKA_COMPRESSION, KAFKA_LINGER_MS and KAFKA_BATCH_SIZE override one setting.
+# See benchmark_produce.py for what each costs and saves.
+PRODUCER_PROFILES = {
+    # Every send goes out at once, uncompressed (the client's defaults)
+    'latency': {'compression_type': None, 'linger_ms': 0, 'batch_size': 16384},
+    'balanced': {'compression_type': 'lz4', 'linger_ms': 5, 'batch_size': 65536},
+    # Fewest bytes and requests per trip, for bulk loads over slow links
+    'throughput': {'compression_type': 'zstd', 'linger_ms': 20, 'batch_size': 262144},
+}
+
+
+def producer_settings(profile: str, compression: str = None, linger_ms: str = None, batch_size: str = None) -> dict:
+    """KafkaProducer batching/compression settings for a profile, with optional overrides"""
+    if profile not in PRODUCER_PROFILES:
+        raise ValueError(f"Unknown KAFKA_PRODUCER_PROFILE '{profile}' (expected {', '.join(PRODUCER_PROFILES)})")
+    settings = dict(PRODUCER_PROFILES[profile])
+    if compression:
+        settings['compression_type'] = None if compression == 'none' else compression
+    if linger_ms:
+        settings['linger_ms'] = int(linger_ms)
+    if batch_size:
+        settings['batch_size'] = int(batch_size)
+    return settings
+
+
+def delivery(future) -> asyncio.Future:
+    """Awaitable for a kafka-python send future, resolved on the running event loop.
+
+    The producer's I/O thread completes send futures; their callbacks hand
+    the outcome to the loop, so awaiting it never blocks other requests.
+    """
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+
+    def resolve(setter, value):
+        if not waiter.done():
+            setter(value)
+
+    future.add_callback(lambda metadata: loop.call_soon_threadsafe(resolve, waiter.set_result, metadata))
+    future.add_errback(lambda error: loop.call_soon_threadsafe(resolve, waiter.set_exception, error))
+    return waiter
+
+
 class KafkaProducerClient:
     def __init__(self):
         self.bootstrap_servers = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
         self.topic = os.getenv('KAFKA_TOPIC', 'nyc.taxi.trips.raw')
+        # json or avro; the consumer tells them apart per message
+        self.wire_format = os.getenv('KAFKA_WIRE_FORMAT', 'json')
+        # Default for requests that do not pick one with ?ack=
+        self.ack_mode = os.getenv('KAFKA_ACK_MODE', 'broker')
+        if self.ack_mode not in ACK_MODES:
+            raise ValueError(f"Unknown KAFKA_ACK_MODE '{self.ack_mode}' (expected broker or enqueued)")
+        self.profile = os.getenv('KAFKA_PRODUCER_PROFILE', 'latency')
+        self.settings = producer_settings(self.profile, os.getenv('KAFKA_COMPRESSION'),
+                                          os.getenv('KAFKA_LINGER_MS'), os.getenv('KAFKA_BATCH_SIZE'))
+        self.serialize = get_serializer(self.wire_format)
+        # Validates request bodies and encodes them to the wire in one pass
+        self.codec = TripCodec(self.wire_format)
         self.producer = None
         self._connected = False
+        # Sends that failed after the request was answered (or while it waited)
+        self.delivery_failures = 0
+        # on_delivery callbacks of answered trips still waiting for the broker
+        self._deliveries = set()
     
     def connect(self) -> bool:
         try:
             self.producer = KafkaProducer(
                 bootstrap_servers=self.bootstrap_servers.split(','),
-                value_serializer=lambda x: json.dumps(x).encode('utf-8'),
+                value_serializer=self._serialize_value,
                 key_serializer=lambda x: x.encode('utf-8') if x else None,
                 acks='all',
                 retries=3,
-                max_block_ms=10000
+                max_block_ms=10000,
+                **self.settings
             )
+            # send() blocks until it knows the topic's partitions; learn them now,
+            # not on the first request
+            self.producer.partitions_for(self.topic)
             self._connected = True
-            logger.info(f"✅ Connected to Kafka at {self.bootstrap_servers}")
+            logger.info(f"✅ Connected to Kafka at {self.bootstrap_servers} ({self.wire_format} messages, "
+                        f"ack mode {self.ack_mode}, {self.profile} profile {self.settings})")
             return True
         except KafkaError as e:
             logger.error(f"❌ Failed to connect: {str(e)}")
@@ -36,18 +109,117 @@ class KafkaProducerClient:
     def is_connected(self) -> bool:
         return self._connected and self.producer is not None
     
-    def send_trip(self, trip_data: dict) -> bool:
+    def _serialize_value(self, value) -> bytes:
+        # Trips encoded ahead by TripCodec are already in the wire format
+        return value if isinstance(value, bytes) else self.serialize(value)
+    
+    def enqueue(self, trip_data: dict, value: bytes = None):
+        """Append a trip to the producer's buffer and return its send future.
+
+        value is the trip's wire encoding if the caller has it already; only
+        the key and trip_id are read from trip_data then. Only blocks (up to
+        max_block_ms) while the buffer is full.
+        """
+        key = str(trip_data.get('PULocationID', 'unknown'))
+        return self.producer.send(topic=self.topic, key=key, value=trip_data if value is None else value)
+    
+    def _delivery_failed(self, trip_id, error):
+        self.delivery_failures += 1
+        logger.error(f"❌ Failed to deliver {trip_id}: {error!r}")
+    
+    async def send_trip(self, trip_data: dict, wait: bool = True, value: bytes = None, on_delivery=None) -> bool:
+        """Produce a trip without blocking the event loop.
+
+        With wait, returns once the broker acknowledged it; otherwise as soon as
+        it is enqueued, and a later delivery failure is only logged and counted.
+        on_delivery (without wait) is a coroutine function run on the event loop
+        with whether the broker acknowledged the trip, once it has answered.
+        """
         if not self.is_connected():
-            if not self.connect():
+            if not await asyncio.to_thread(self.connect):
                 return False
         try:
-            key = str(trip_data.get('PULocationID', 'unknown'))
-            future = self.producer.send(topic=self.topic, key=key, value=trip_data)
-            future.get(timeout=10)
-            return True
+            future = self.enqueue(trip_data, value)
         except Exception as e:
             logger.error(f"❌ Failed to send: {str(e)}")
             return False
+        if not wait:
+            future.add_errback(lambda error: self._delivery_failed(trip_data.get('trip_id'), error))
+            if on_delivery is not None:
+                self._after_delivery(delivery(future), on_delivery)
+            return True
+        try:
+            await asyncio.wait_for(delivery(future), DELIVERY_TIMEOUT_S)
+            return True
+        except Exception as e:
+            self._delivery_failed(trip_data.get('trip_id'), e)
+            return False
+    
+    async def send_trips(self, trips: list, wait: bool = True, values: list = None) -> list:
+        """Produce a batch of trips: enqueue them all, flush once and collect the outcomes together.
+
+        Returns one (RecordMetadata or None, error or None) per trip, in order;
+        without wait the metadata is None for every enqueued trip. values are
+        the trips' wire encodings, as for enqueue.
+        """
+        if not self.is_connected():
+            if not await asyncio.to_thread(self.connect):
+                return [(None, "Kafka unavailable")] * len(trips)
+        futures = []
+        for trip_data, value in zip(trips, values or [None] * len(trips)):
+            try:
+                futures.append(self.enqueue(trip_data, value))
+            except Exception as e:
+                futures.append(e)
+        if not wait:
+            for trip_data, future in zip(trips, futures):
+                if not isinstance(future, Exception):
+                    future.add_errback(lambda error, trip_id=trip_data.get('trip_id'):
+                                       self._delivery_failed(trip_id, error))
+            return [(None, str(future) if isinstance(future, Exception) else None) for future in futures]
+        
+        waiters = [None if isinstance(future, Exception) else delivery(future) for future in futures]
+        pending = [waiter for waiter in waiters if waiter is not None]
+        # The batch is complete: send it now rather than after linger_ms. flush()
+        # blocks, so it runs in a thread while the acks are collected here
+        flush = asyncio.create_task(asyncio.to_thread(self.producer.flush, DELIVERY_TIMEOUT_S))
+        if pending:
+            await asyncio.wait(pending, timeout=DELIVERY_TIMEOUT_S)
+        await asyncio.gather(flush, return_exceptions=True)
+        
+        results = []
+        for trip_data, future, waiter in zip(trips, futures, waiters):
+            if waiter is None:
+                error = future
+            elif not waiter.done():
+                waiter.cancel()
+                error = TimeoutError(f"no ack within {DELIVERY_TIMEOUT_S}s")
+            else:
+                error = waiter.exception()
+            if error is not None:
+                self._delivery_failed(trip_data.get('trip_id'), error)
+                results.append((None, str(error) or type(error).__name__))
+            else:
+                results.append((waiter.result(), None))
+        return results
+    
+    def _after_delivery(self, waiter: asyncio.Future, on_delivery):
+        async def report():
+            try:
+                await waiter
+            except Exception:
+                acknowledged = False
+            else:
+                acknowledged = True
+            await on_delivery(acknowledged)
+        
+        task = asyncio.create_task(report())
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+    
+    async def settle(self):
+        """Wait for the on_delivery callbacks of trips still in flight, e.g. after close() flushed them"""
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
     
     def close(self):
         if self.producer:
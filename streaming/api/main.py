@@ -3,32 +3,46 @@ FastAPI Webhook Server
 Receives taxi trip data and produces to Kafka
 """
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
-from datetime import datetime
+from functools import partial
+from typing import Literal, Optional
 import uuid
 
-from schemas import TripEvent, TripResponse
+import msgspec
+
+from schemas import BatchItemResult, BatchResponse, IngestResponse, TripEvent, TripResponse
 from kafka_producer import KafkaProducerClient
+from ingest import CONTENT_ENCODINGS, INGEST_FORMATS, BodyStream, ingest, ingest_format, open_upload
+from trip_codec import utc_now, validation_detail
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, create_store, fingerprint
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 kafka_producer: KafkaProducerClient = None
+idempotency: IdempotencyStore = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global kafka_producer
+    global kafka_producer, idempotency
     logger.info("🚀 Starting FastAPI server...")
     kafka_producer = KafkaProducerClient()
     kafka_producer.connect()
     logger.info("✅ Connected to Kafka")
+    idempotency = create_store()
     yield
     logger.info("🛑 Shutting down...")
     if kafka_producer:
         kafka_producer.close()
+        # Keys of queued trips are settled by their (now flushed) deliveries
+        await kafka_producer.settle()
+    if idempotency:
+        await idempotency.close()
 
 app = FastAPI(
     title="NYC Taxi Real-Time API",
@@ -50,7 +64,7 @@ async def root():
     return {
         "status": "healthy",
         "service": "NYC Taxi Real-Time API",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": utc_now().isoformat()
     }
 
 @app.get("/health")
@@ -58,32 +72,117 @@ async def health_check():
     kafka_healthy = kafka_producer.is_connected() if kafka_producer else False
     return {
         "status": "healthy" if kafka_healthy else "degraded",
-        "kafka": "connected" if kafka_healthy else "disconnected"
+        "kafka": "connected" if kafka_healthy else "disconnected",
+        "ack_mode": kafka_producer.ack_mode if kafka_producer else None,
+        "producer_profile": kafka_producer.profile if kafka_producer else None,
+        "delivery_failures": kafka_producer.delivery_failures if kafka_producer else 0,
+        "idempotency": idempotency.stats() if idempotency else None
     }
 
-@app.post("/api/v1/trips", response_model=TripResponse, status_code=status.HTTP_201_CREATED)
-async def receive_trip(trip: TripEvent):
+# broker: 201 once Kafka acknowledged the trip, enqueued: 202 once it is buffered
+AckMode = Optional[Literal['broker', 'enqueued']]
+ACK_QUERY = Query(None, description="Wait for the broker ack (201) or only for enqueueing (202); "
+                                    "defaults to KAFKA_ACK_MODE")
+
+# A retry with the same key gets the first request's trip_id back (200, Idempotent-Replayed) instead of
+# producing the trip again
+IDEMPOTENCY_KEY = Header(None, alias="Idempotency-Key", max_length=255,
+                         description="Client-chosen key that makes retries of this trip safe")
+
+def waits_for_broker(ack: AckMode) -> bool:
+    return (ack or kafka_producer.ack_mode) == 'broker'
+
+# Trip bodies are validated by the producer's TripCodec, not by FastAPI; the
+# docs still show TripEvent
+TRIP_BODY = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": TripEvent.model_json_schema()}}}}
+BATCH_BODY = {"requestBody": {"required": True, "content": {
+    "application/json": {"schema": {"type": "array", "items": TripEvent.model_json_schema()}}}}}
+
+async def read_trips(request: Request, batch: bool = False):
+    """Decode and validate a trip (or list of trips) body; errors are 422s like FastAPI's own"""
+    body = await request.body()
     try:
-        trip_id = str(uuid.uuid4())
-        message = trip.model_dump()
-        message['trip_id'] = trip_id
-        message['received_at'] = datetime.utcnow().isoformat()
-        message['tpep_pickup_datetime'] = trip.tpep_pickup_datetime.isoformat()
-        message['tpep_dropoff_datetime'] = trip.tpep_dropoff_datetime.isoformat()
-        
-        success = kafka_producer.send_trip(message)
+        if batch:
+            return kafka_producer.codec.decode_batch(body)
+        return kafka_producer.codec.decode(body)
+    except msgspec.ValidationError as e:
+        raise RequestValidationError(validation_detail(e))
+    except msgspec.DecodeError as e:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ["body"], "msg": str(e)}])
+
+async def settle_key(key: str, trip_id: str, produced: bool):
+    """Complete the Idempotency-Key of a produced trip, or release it so that a retry produces the trip"""
+    if produced:
+        await idempotency.complete(key, trip_id)
+    else:
+        await idempotency.release(key, trip_id)
+
+def trip_head(trip, trip_id: str) -> dict:
+    """What the producer reads besides the encoded value: the key and the id it logs"""
+    return {"trip_id": trip_id, "PULocationID": trip.PULocationID}
+
+@app.post("/api/v1/trips", response_model=TripResponse, status_code=status.HTTP_201_CREATED,
+          responses={status.HTTP_202_ACCEPTED: {"model": TripResponse, "description": "Trip queued for Kafka"},
+                     status.HTTP_200_OK: {"model": TripResponse, "description": "Retry of an Idempotency-Key already used"}},
+          openapi_extra=TRIP_BODY)
+async def receive_trip(request: Request, response: Response, ack: AckMode = ACK_QUERY,
+                       idempotency_key: Optional[str] = IDEMPOTENCY_KEY):
+    trip = await read_trips(request)
+    trip_id = str(uuid.uuid4())
+    if idempotency_key:
+        try:
+            original_id = await idempotency.claim(idempotency_key, trip_id, fingerprint(trip))
+        except IdempotencyConflict:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used for a different trip"
+            )
+        except IdempotencyInProgress:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress"
+            )
+        if original_id is not None:
+            response.status_code = status.HTTP_200_OK
+            response.headers["Idempotent-Replayed"] = "true"
+            return TripResponse(
+                status="duplicate",
+                message="Trip already received",
+                trip_id=original_id,
+                timestamp=utc_now()
+            )
+    
+    success = False
+    wait = waits_for_broker(ack)
+    # A queued trip's key is settled when the broker answers, not with the 202
+    on_delivery = None
+    if idempotency_key and not wait:
+        on_delivery = partial(settle_key, idempotency_key, trip_id)
+    try:
+        value = kafka_producer.codec.encode(trip, trip_id, utc_now().isoformat())
+        success = await kafka_producer.send_trip(trip_head(trip, trip_id), wait=wait, value=value,
+                                                 on_delivery=on_delivery)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="Failed to produce to Kafka"
             )
         
+        if not wait:
+            response.status_code = status.HTTP_202_ACCEPTED
+            return TripResponse(
+                status="accepted",
+                message="Trip queued",
+                trip_id=trip_id,
+                timestamp=utc_now()
+            )
         logger.info(f"✅ Trip received: {trip_id}")
         return TripResponse(
             status="success",
             message="Trip received",
             trip_id=trip_id,
-            timestamp=datetime.utcnow()
+            timestamp=utc_now()
         )
     except HTTPException:
         raise
@@ -93,27 +192,73 @@ async def receive_trip(trip: TripEvent):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+    finally:
+        # Also on cancellation, so that retries waiting on the key are never left hanging
+        if idempotency_key and not (success and on_delivery is not None):
+            await settle_key(idempotency_key, trip_id, success)
 
-@app.post("/api/v1/trips/batch", status_code=status.HTTP_201_CREATED)
-async def receive_trips_batch(trips: list[TripEvent]):
+@app.post("/api/v1/trips/batch", response_model=BatchResponse, status_code=status.HTTP_201_CREATED,
+          openapi_extra=BATCH_BODY)
+async def receive_trips_batch(request: Request, response: Response, ack: AckMode = ACK_QUERY):
+    trips = await read_trips(request, batch=True)
+    wait = waits_for_broker(ack)
+    received_at = utc_now().isoformat()
+    messages = [trip_head(trip, str(uuid.uuid4())) for trip in trips]
+    values = [kafka_producer.codec.encode(trip, message['trip_id'], received_at)
+              for trip, message in zip(trips, messages)]
+    # Enqueued together and flushed once, so the batch costs one round trip
+    outcomes = await kafka_producer.send_trips(messages, wait=wait, values=values)
+    
     results = []
-    for trip in trips:
-        try:
-            trip_id = str(uuid.uuid4())
-            message = trip.model_dump()
-            message['trip_id'] = trip_id
-            message['received_at'] = datetime.utcnow().isoformat()
-            message['tpep_pickup_datetime'] = trip.tpep_pickup_datetime.isoformat()
-            message['tpep_dropoff_datetime'] = trip.tpep_dropoff_datetime.isoformat()
-            success = kafka_producer.send_trip(message)
-            results.append({"trip_id": trip_id, "status": "success" if success else "failed"})
-        except Exception as e:
-            results.append({"trip_id": None, "status": "failed", "error": str(e)})
+    for index, (message, (metadata, error)) in enumerate(zip(messages, outcomes)):
+        results.append(BatchItemResult(
+            index=index,
+            trip_id=message['trip_id'],
+            status="failed" if error else ("success" if wait else "queued"),
+            partition=metadata.partition if metadata else None,
+            offset=metadata.offset if metadata else None,
+            error=error
+        ))
+    failed = sum(1 for result in results if result.error)
+    if not wait:
+        response.status_code = status.HTTP_202_ACCEPTED
+    return BatchResponse(
+        status="completed" if wait else "accepted",
+        total=len(trips),
+        successful=len(trips) - failed,
+        failed=failed,
+        results=results
+    )
+
+@app.post("/api/v1/trips/ingest", response_model=IngestResponse, status_code=status.HTTP_201_CREATED,
+          openapi_extra={"requestBody": {"required": True, "content": {
+              content_type: {"schema": {"type": "string", "format": "binary"}} for content_type in INGEST_FORMATS}}})
+async def ingest_trips(request: Request, response: Response, ack: AckMode = ACK_QUERY):
+    """Bulk upload of NDJSON (gzip with Content-Encoding), Arrow IPC or Parquet, produced while it is read"""
+    fmt = ingest_format(request.headers.get('content-type'))
+    encoding = request.headers.get('content-encoding', 'identity').lower()
+    if fmt is None or encoding not in CONTENT_ENCODINGS:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Expected Content-Type {', '.join(INGEST_FORMATS)} and Content-Encoding {' or '.join(CONTENT_ENCODINGS)}"
+        )
+    if not kafka_producer.is_connected() and not await asyncio.to_thread(kafka_producer.connect):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Failed to produce to Kafka"
+        )
     
-    successful = sum(1 for r in results if r['status'] == 'success')
-    return {
-        "status": "completed",
-        "total": len(trips),
-        "successful": successful,
-        "failed": len(trips) - successful
-    }
+    wait = waits_for_broker(ack)
+    stream = open_upload(BodyStream(request.stream(), asyncio.get_running_loop()), encoding)
+    summary = await asyncio.to_thread(ingest, stream, fmt, kafka_producer, wait)
+    logger.info(f"✅ Ingested {fmt}: {summary['successful']}/{summary['total']} trips")
+    
+    aborted = summary.pop('aborted')
+    if aborted:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"error": f"Unreadable upload: {aborted}", "format": fmt, **summary}
+        )
+    if not wait:
+        response.status_code = status.HTTP_202_ACCEPTED
+    return IngestResponse(status="completed" if wait else "accepted", format=fmt, **summary)
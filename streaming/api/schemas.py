@@ -38,3 +38,31 @@ class TripResponse(BaseModel):
     message: str
     trip_id: str
     timestamp: datetime
+
+class BatchItemResult(BaseModel):
+    index: int
+    trip_id: str
+    status: str
+    partition: Optional[int] = None
+    offset: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    status: str
+    total: int
+    successful: int
+    failed: int
+    results: list[BatchItemResult]
+
+class IngestError(BaseModel):
+    index: int
+    error: str
+
+class IngestResponse(BaseModel):
+    status: str
+    format: str
+    total: int
+    successful: int
+    rejected: int
+    failed: int
+    errors: list[IngestError]
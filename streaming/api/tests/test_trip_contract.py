@@ -0,0 +1,153 @@
+"""/api/v1/trips and /api/v1/trips/ingest accept exactly the trips TripEvent accepts
+
+Each case changes one field of a valid trip to an encoding Pydantic accepts
+or rejects. TripCodec and every ingest format must reach the same verdict and,
+when they accept the trip, send the values TripEvent validates it to.
+"""
+
+import io
+import json
+from datetime import datetime, timezone
+
+import msgspec
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pydantic
+import pytest
+
+import ingest
+from schemas import TripEvent
+from trip_codec import TripCodec
+
+TRIP = {"VendorID": 2, "tpep_pickup_datetime": "2026-01-01T10:00:00", "tpep_dropoff_datetime": "2026-01-01T10:20:00",
+        "passenger_count": 1, "trip_distance": 2.5, "RatecodeID": 1, "store_and_fwd_flag": "N", "PULocationID": 161,
+        "DOLocationID": 230, "payment_type": 1, "fare_amount": 12.5, "tip_amount": 2.0, "total_amount": 18.0}
+
+CASES = [
+    ("tpep_pickup_datetime", "2026-01-01"),
+    ("tpep_pickup_datetime", "2026-01-01T10:00"),
+    ("tpep_pickup_datetime", "2026-01-01 10:00:00"),
+    ("tpep_pickup_datetime", "2026-01-01t10:00:00"),
+    ("tpep_pickup_datetime", "2026-01-01T10:00:00Z"),
+    ("tpep_pickup_datetime", "2026-01-01T10:00:00+02:00"),
+    ("tpep_pickup_datetime", "2026-01-01T10:00:00.123456"),
+    ("tpep_pickup_datetime", 1767261600),
+    ("tpep_pickup_datetime", 1767261600.5),
+    ("tpep_pickup_datetime", "1767261600"),
+    ("tpep_pickup_datetime", "2026-01-01T10"),
+    ("tpep_pickup_datetime", "2026-1-1"),
+    ("tpep_pickup_datetime", "2026-02-30"),
+    ("tpep_pickup_datetime", "garbage"),
+    ("tpep_pickup_datetime", ""),
+    ("VendorID", "2"),
+    ("VendorID", "2.0"),
+    ("VendorID", " 2"),
+    ("VendorID", "+2"),
+    ("VendorID", 2.0),
+    ("VendorID", True),
+    ("VendorID", 2.5),
+    ("VendorID", "0x2"),
+    ("VendorID", "9"),
+    ("trip_distance", "2.5"),
+    ("trip_distance", "1e1"),
+    ("trip_distance", " 2.5 "),
+    ("trip_distance", "2,5"),
+    ("trip_distance", "nan"),
+    ("passenger_count", "1"),
+    ("PULocationID", "161"),
+    ("fare_amount", "12"),
+    ("mta_tax", "0.5"),
+    ("total_amount", True),
+    ("store_and_fwd_flag", None),
+    ("store_and_fwd_flag", "y"),
+]
+
+
+def expected(trip: dict):
+    """What TripEvent makes of a trip: None if it rejects it, else its values with naive UTC timestamps"""
+    try:
+        values = TripEvent(**trip).model_dump()
+    except pydantic.ValidationError:
+        return None
+    for name in ('tpep_pickup_datetime', 'tpep_dropoff_datetime'):
+        if values[name].tzinfo is not None:
+            values[name] = values[name].astimezone(timezone.utc).replace(tzinfo=None)
+    return values
+
+
+def codec_result(trip: dict):
+    try:
+        return msgspec.structs.asdict(TripCodec().decode(json.dumps(trip).encode()))
+    except msgspec.ValidationError:
+        return None
+
+
+class Future:
+    def add_callback(self, callback):
+        pass
+
+    def add_errback(self, errback):
+        pass
+
+
+class Producer:
+    """Stands in for KafkaTripProducer, keeping what is enqueued"""
+
+    def __init__(self):
+        self.messages = []
+
+    def enqueue(self, message: dict, value: bytes = None):
+        self.messages.append(message)
+        return Future()
+
+
+def ingest_result(trip: dict, fmt: str):
+    if fmt == 'ndjson':
+        body = json.dumps(trip).encode() + b'\n'
+    else:
+        sink = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist([trip]), sink)
+        body = sink.getvalue()
+    producer = Producer()
+    summary = ingest.ingest(io.BytesIO(body), fmt, producer, wait=False)
+    assert summary['total'] == 1
+    if not producer.messages:
+        return None
+    values = {name: value for name, value in producer.messages[0].items() if name not in ('trip_id', 'received_at')}
+    for name in ('tpep_pickup_datetime', 'tpep_dropoff_datetime'):
+        values[name] = datetime.fromisoformat(values[name])
+    return values
+
+
+@pytest.mark.parametrize('field, value', CASES)
+def test_codec_matches_trip_event(field, value):
+    trip = {**TRIP, field: value}
+    assert codec_result(trip) == expected(trip)
+
+
+@pytest.mark.parametrize('fmt', ['ndjson', 'parquet'])
+@pytest.mark.parametrize('field, value', CASES)
+def test_ingest_matches_trip_event(field, value, fmt):
+    trip = {**TRIP, field: value}
+    assert ingest_result(trip, fmt) == expected(trip)
+
+
+def test_batch_accepts_what_trip_event_accepts():
+    trips = [{**TRIP, "tpep_pickup_datetime": "2026-01-01"}, {**TRIP, "VendorID": " 2"}, TRIP]
+    decoded = TripCodec().decode_batch(json.dumps(trips).encode())
+    assert [msgspec.structs.asdict(trip) for trip in decoded] == [expected(trip) for trip in trips]
+
+
+def test_rejections_keep_the_codec_error():
+    with pytest.raises(msgspec.ValidationError, match=r"Expected `int` <= 7 - at `\$\[1\].VendorID`"):
+        TripCodec().decode_batch(json.dumps([TRIP, {**TRIP, "VendorID": 9}]).encode())
+
+
+def test_ingest_keeps_the_vectorized_error():
+    producer = Producer()
+    lines = b''.join(json.dumps({**TRIP, **change}).encode() + b'\n'
+                     for change in ({}, {"VendorID": 9}, {"VendorID": "9"}, {"tpep_pickup_datetime": "2026-01-01T10"}))
+    summary = ingest.ingest(io.BytesIO(lines), 'ndjson', producer, wait=False)
+    assert (summary['successful'], summary['rejected']) == (1, 3)
+    assert [error['error'].split(':')[0] for error in summary['errors']] == \
+        ['VendorID', 'JSON parse error', 'tpep_pickup_datetime']
@@ -0,0 +1,151 @@
+"""Compiled trip codec: request bytes to Kafka wire bytes in one validating pass
+
+The original hot path validated the body with Pydantic, then ran
+model_dump() and isoformat() on both timestamps, and finally json.dumps in
+the producer. TripCodec instead compiles TripEvent once into a msgspec
+Struct with the same constraints. It decodes and validates request bytes
+straight into that Struct, in C and without an intermediate dict, and
+encodes the Kafka value from it:
+
+- json: the Struct encoded by msgspec, with trip_id and received_at appended
+  to the object. Its fields and values match the message the Pydantic path
+  built.
+- avro: AvroTripEncoder fed the decoded datetimes, instead of ISO strings
+  that it would have to parse again.
+
+Timestamps sent with a UTC offset are converted to UTC and carry no offset in
+either format, like the naive timestamps every other producer sends.
+
+msgspec's lax mode covers the encodings producers actually send, but Pydantic
+accepts a few more (date-only and Unix timestamps, " 2" or true for an int).
+A body the Struct rejects is therefore validated again by TripEvent, and only
+rejected if TripEvent rejects it too, so the endpoints accept exactly the
+trips they accepted before; only invalid bodies pay for the second pass.
+
+TripEvent stays the definition (and what /docs shows); see benchmark_codec.py
+for what each stage costs.
+"""
+
+from datetime import datetime, timezone
+from typing import Annotated, Literal, Optional, get_args
+
+import annotated_types
+import msgspec
+import pydantic
+
+from schemas import TripEvent
+from wire_format import get_serializer
+
+_CONSTRAINTS = {annotated_types.Ge: 'ge', annotated_types.Gt: 'gt', annotated_types.Le: 'le', annotated_types.Lt: 'lt'}
+# TripEvent.validate_store_fwd: Y or N, with null meaning N
+STORE_AND_FWD = Literal['Y', 'N']
+
+
+DATETIME_FIELDS = tuple(name for name, field in TripEvent.model_fields.items()
+                        if datetime in (*get_args(field.annotation), field.annotation))
+
+
+def naive_utc(value: datetime) -> datetime:
+    """A timestamp with a UTC offset as naive UTC; naive ones are left as they are"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _post_init(trip):
+    if trip.store_and_fwd_flag is None:
+        trip.store_and_fwd_flag = 'N'
+    for name in DATETIME_FIELDS:
+        setattr(trip, name, naive_utc(getattr(trip, name)))
+
+
+def compile_trip_struct():
+    """msgspec Struct with TripEvent's fields, types, defaults and Field constraints"""
+    fields = []
+    for name, field in TripEvent.model_fields.items():
+        python_type = next(t for t in (*get_args(field.annotation), field.annotation) if t in (int, float, str, datetime))
+        if name == 'store_and_fwd_flag':
+            python_type = STORE_AND_FWD
+        constraints = {_CONSTRAINTS[type(c)]: getattr(c, _CONSTRAINTS[type(c)]) for c in field.metadata}
+        if constraints:
+            python_type = Annotated[python_type, msgspec.Meta(**constraints)]
+        if field.is_required():
+            fields.append((name, python_type))
+        else:
+            fields.append((name, Optional[python_type], field.default))
+    return msgspec.defstruct('TripStruct', fields, kw_only=True, namespace={'__post_init__': _post_init})
+
+
+TripStruct = compile_trip_struct()
+
+
+def validate_trip(record):
+    """TripEvent's verdict on one decoded trip: the TripStruct it validates to, or None if it rejects it"""
+    try:
+        return TripStruct(**TripEvent.model_validate(record).model_dump())
+    except pydantic.ValidationError:
+        return None
+
+
+def utc_now() -> datetime:
+    """The current UTC time, naive like the received_at and response timestamps the API writes"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def validation_detail(error: msgspec.ValidationError) -> list:
+    """FastAPI-style 422 detail for a decode error ("Expected ... - at `$[0].field`")"""
+    message, _, path = str(error).partition(' - at `$')
+    location = ['body'] + [int(part) if part.isdigit() else part
+                           for part in path.rstrip('`').replace('[', '.').replace(']', '').split('.') if part]
+    if message.startswith('Object missing required field `'):
+        location.append(message.split('`')[1])
+        message = 'Field required'
+    return [{'type': 'value_error', 'loc': location, 'msg': message}]
+
+
+class TripCodec:
+    """Validates a trip (or list of trips) request body and encodes it for KAFKA_WIRE_FORMAT.
+
+    decode raises msgspec.ValidationError (and msgspec.DecodeError for
+    malformed JSON) for a body TripEvent rejects as well; every body TripEvent
+    accepts decodes, lax coercions included ("2" or 2.0 for an int).
+    """
+
+    def __init__(self, wire_format: str = 'json'):
+        if wire_format not in ('json', 'avro'):
+            raise ValueError(f"Unknown wire format '{wire_format}' (expected json or avro)")
+        self.wire_format = wire_format
+        self._decode_trip = msgspec.json.Decoder(TripStruct, strict=False).decode
+        self._decode_batch = msgspec.json.Decoder(list[TripStruct], strict=False).decode
+        self._encode_json = msgspec.json.Encoder().encode
+        self._encode_avro = get_serializer('avro') if wire_format == 'avro' else None
+
+    def decode(self, body: bytes):
+        try:
+            return self._decode_trip(body)
+        except msgspec.ValidationError as error:
+            trip = validate_trip(msgspec.json.decode(body))
+            if trip is None:
+                raise error
+            return trip
+
+    def decode_batch(self, body: bytes) -> list:
+        try:
+            return self._decode_batch(body)
+        except msgspec.ValidationError as error:
+            records = msgspec.json.decode(body)
+            trips = [validate_trip(record) for record in records] if isinstance(records, list) else [None]
+            if None in trips:
+                raise error
+            return trips
+
+    def encode(self, trip, trip_id: str, received_at: str) -> bytes:
+        """The trip's Kafka value, with the server-assigned trip_id and received_at"""
+        if self._encode_avro is not None:
+            message = msgspec.structs.asdict(trip)
+            message['trip_id'] = trip_id
+            message['received_at'] = received_at
+            return self._encode_avro(message)
+        # '{...}' -> '{..., "trip_id": ..., "received_at": ...}'; both are plain ASCII
+        return b'%s,"trip_id":"%s","received_at":"%s"}' % (
+            self._encode_json(trip)[:-1], trip_id.encode(), received_at.encode())
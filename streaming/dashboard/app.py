@@ -190,7 +190,7 @@ elif page == "📊 Live Analytics":
     with col1:
         if top_pickup:
             df = pd.DataFrame(top_pickup, columns=['Zone ID', 'Trips'])
-            df['Zone'] = df['Zone ID'].apply(lambda x: zone_lookup.get_zone_name(int(x)))
+            df['Zone'] = zone_lookup.get_zone_names(df['Zone ID'])
             df['Trips'] = df['Trips'].astype(int)
             df = df.sort_values('Trips', ascending=True).tail(10)
             fig = px.bar(df, x='Trips', y='Zone', orientation='h', color='Trips', color_continuous_scale='Reds')
@@ -200,7 +200,7 @@ elif page == "📊 Live Analytics":
     with col2:
         if top_dropoff:
             df = pd.DataFrame(top_dropoff, columns=['Zone ID', 'Trips'])
-            df['Zone'] = df['Zone ID'].apply(lambda x: zone_lookup.get_zone_name(int(x)))
+            df['Zone'] = zone_lookup.get_zone_names(df['Zone ID'])
             df['Trips'] = df['Trips'].astype(int)
             df = df.sort_values('Trips', ascending=True).tail(10)
             fig = px.bar(df, x='Trips', y='Zone', orientation='h', color='Trips', color_continuous_scale='Oranges')
@@ -218,7 +218,8 @@ elif page == "🔍 Fraud Monitor":
     import plotly.express as px
     import plotly.graph_objects as go
     from datetime import datetime
-    from utils.redis_client import RedisClient
+    from utils.redis_client import RedisClient, ALERT_SCORE_BAND
+    from utils.alert_feed import AlertFeed
     from utils.zone_lookup import ZoneLookup
     
     # Back button
@@ -233,23 +234,21 @@ elif page == "🔍 Fraud Monitor":
     refresh_rate = st.sidebar.slider("Refresh Rate (sec)", 1, 30, 3)
     auto_refresh = st.sidebar.checkbox("Auto Refresh", value=True)
     
-    alerts = redis_client.get_fraud_alerts()
+    bands = redis_client.get_alert_bands()
     top_zones = redis_client.get_top_fraud_zones(10)
+    df = AlertFeed.for_session(st.session_state).refresh(redis_client)
     
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Total Alerts", len(alerts))
-    col2.metric("High Risk (70+)", sum(1 for a in alerts if a.get('fraud_score', 0) >= 70))
-    col3.metric("Medium Risk", sum(1 for a in alerts if 50 <= a.get('fraud_score', 0) < 70))
-    col4.metric("Low Risk", sum(1 for a in alerts if a.get('fraud_score', 0) < 50))
+    col1.metric("Total Alerts", sum(bands.values()))
+    col2.metric("High Risk (70+)", sum(n for b, n in bands.items() if b * ALERT_SCORE_BAND >= 70))
+    col3.metric("Medium Risk", sum(n for b, n in bands.items() if 50 <= b * ALERT_SCORE_BAND < 70))
+    col4.metric("Low Risk", sum(n for b, n in bands.items() if b * ALERT_SCORE_BAND < 50))
     
     st.markdown("---")
     col1, col2 = st.columns(2)
     
     with col1:
-        if alerts:
-            df = pd.DataFrame(alerts)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df = df.sort_values('timestamp')
+        if len(df):
             fig = go.Figure()
             fig.add_trace(go.Scatter(x=df['timestamp'], y=df['fraud_score'], mode='lines+markers',
                 line=dict(color='#ff6b6b', width=2),
@@ -264,7 +263,7 @@ elif page == "🔍 Fraud Monitor":
     with col2:
         if top_zones:
             df = pd.DataFrame(top_zones, columns=['Zone ID', 'Count'])
-            df['Zone'] = df['Zone ID'].apply(lambda x: zone_lookup.get_zone_name(int(x)))
+            df['Zone'] = zone_lookup.get_zone_names(df['Zone ID'])
             df['Count'] = df['Count'].astype(int)
             df = df.sort_values('Count', ascending=True)
             fig = px.bar(df, x='Count', y='Zone', orientation='h', color='Count', color_continuous_scale='Reds')
@@ -341,17 +340,10 @@ elif page == "🗺️ Maps":
                 st_autorefresh(interval=500, key='dashboard_deck_autorefresh')
         if animated:
             st.subheader("🚖 Animated Trip Routes (PyDeck)")
-            if zone_stats:
-                pickup_zones = zone_stats.get('pickup', {})
-                dropoff_zones = zone_stats.get('dropoff', {})
-                top_pickups = sorted(pickup_zones.items(), key=lambda x: int(x[1]), reverse=True)[:20]
-                top_dropoffs = sorted(dropoff_zones.items(), key=lambda x: int(x[1]), reverse=True)[:20]
-                trips_data = []
-                for ((pu_zone, _), (do_zone, _)) in zip(top_pickups, top_dropoffs):
-                    pu_lat, pu_lon = get_coord(int(pu_zone))
-                    do_lat, do_lon = get_coord(int(do_zone))
-                    trip = generate_path((pu_lat, pu_lon), (do_lat, do_lon), duration=150)
-                    trips_data.append(trip)
+            routes = redis_client.get_top_routes(20)
+            if routes:
+                trips_data = [generate_path(get_coord(pu_zone), get_coord(do_zone), duration=150)
+                              for pu_zone, do_zone, _ in routes]
                 if trips_data:
                     try:
                         layer = pdk.Layer(
@@ -379,20 +371,17 @@ elif page == "🗺️ Maps":
                 else:
                     st.info("No trips to animate yet")
         else:
-            if zone_stats:
+            routes = redis_client.get_top_routes(10)
+            if routes:
                 fig = go.Figure()
-                pickup_zones = zone_stats.get('pickup', {})
-                dropoff_zones = zone_stats.get('dropoff', {})
-                top_pickups = sorted(pickup_zones.items(), key=lambda x: int(x[1]), reverse=True)[:10]
-                top_dropoffs = sorted(dropoff_zones.items(), key=lambda x: int(x[1]), reverse=True)[:10]
-                max_count = max([int(x[1]) for x in top_pickups + top_dropoffs] or [1])
-                for i, ((pu_zone, pu_count), (do_zone, do_count)) in enumerate(zip(top_pickups, top_dropoffs)):
-                    pu_coord, do_coord = get_coord(int(pu_zone)), get_coord(int(do_zone))
-                    width_px = int(2 + (min(int(pu_count), int(do_count)) / max_count) * 10)
-                    fig.add_trace(go.Scattermapbox(mode='lines', lon=[pu_coord[1], do_coord[1]], lat=[pu_coord[0], do_coord[0]], line=dict(width=width_px, color='#ff4444'), showlegend=False))
+                max_count = routes[0][2]
+                for pu_zone, do_zone, count in routes:
+                    pu_coord, do_coord = get_coord(pu_zone), get_coord(do_zone)
+                    width_px = int(2 + count / max_count * 10)
+                    fig.add_trace(go.Scattermapbox(mode='lines', lon=[pu_coord[1], do_coord[1]], lat=[pu_coord[0], do_coord[0]], line=dict(width=width_px, color='#ff4444'), hovertext=f"{zone_lookup.get_zone_name(pu_zone)} → {zone_lookup.get_zone_name(do_zone)}: {count:,} trips", showlegend=False))
                     # add endpoints: start (green) and end (red)
-                    fig.add_trace(go.Scattermapbox(mode='markers', lon=[pu_coord[1]], lat=[pu_coord[0]], marker=dict(size=8, color='#00ff00'), hovertext=[f"Start: {pu_zone} ({pu_count})"]))
-                    fig.add_trace(go.Scattermapbox(mode='markers', lon=[do_coord[1]], lat=[do_coord[0]], marker=dict(size=8, color='#ff4444'), hovertext=[f"End: {do_zone} ({do_count})"]))
+                    fig.add_trace(go.Scattermapbox(mode='markers', lon=[pu_coord[1]], lat=[pu_coord[0]], marker=dict(size=8, color='#00ff00'), hovertext=[f"Start: {zone_lookup.get_zone_name(pu_zone)}"]))
+                    fig.add_trace(go.Scattermapbox(mode='markers', lon=[do_coord[1]], lat=[do_coord[0]], marker=dict(size=8, color='#ff4444'), hovertext=[f"End: {zone_lookup.get_zone_name(do_zone)}"]))
                 fig.update_layout(mapbox=dict(style='carto-darkmatter', center=dict(lat=40.7580, lon=-73.9855), zoom=10), height=600, margin={"r":0,"t":0,"l":0,"b":0})
                 st.plotly_chart(fig, width='stretch', config=config)
             else:
@@ -11,7 +11,7 @@ import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.redis_client import RedisClient
+from utils.redis_client import RedisClient, LEADERBOARD_WINDOWS, SKETCH_METRICS
 from utils.zone_lookup import ZoneLookup
 
 st.set_page_config(page_title="Live Analytics", page_icon="📊", layout="wide")
@@ -22,6 +22,8 @@ zone_lookup = ZoneLookup()
 
 refresh_rate = st.sidebar.slider("Refresh Rate (sec)", 1, 30, 3)
 auto_refresh = st.session_state.get('realtime', False) or st.sidebar.checkbox("Auto Refresh", value=False)
+window = st.sidebar.selectbox("Leaderboard Window", list(LEADERBOARD_WINDOWS),
+                              format_func=LEADERBOARD_WINDOWS.get)
 
 placeholder = st.empty()
 
@@ -29,8 +31,8 @@ def render():
     metrics = redis_client.get_today_metrics()
     hourly = redis_client.get_hourly_stats()
     # payment_stats and vendor_stats charts were removed per user request
-    top_pickup = redis_client.get_top_pickup_zones(10)
-    top_dropoff = redis_client.get_top_dropoff_zones(10)
+    top_pickup = redis_client.get_top_pickup_zones(10, window)
+    top_dropoff = redis_client.get_top_dropoff_zones(10, window)
     
     trips = metrics.get('trips', 0)
     revenue = metrics.get('revenue', 0)
@@ -92,6 +94,25 @@ def render():
         
         # Vendor chart removed for cleaner UI (left for future dashboards if needed)
         
+        # Borough counters are kept by the Spark job from its zone join
+        boroughs = redis_client.get_borough_stats()
+        if boroughs:
+            df = pd.DataFrame.from_dict(boroughs, orient='index').rename_axis('Borough').reset_index()
+            df = df.sort_values('trips', ascending=True)
+            with col1:
+                fig = px.bar(df, x='trips', y='Borough', orientation='h', color='revenue',
+                           color_continuous_scale='Blues', title="Trips by Pickup Borough (today)",
+                           hover_data={'revenue': ':$,.2f'})
+                fig.update_layout(template="plotly_dark", height=300, yaxis_title="", xaxis_title="Trips")
+                st.plotly_chart(fig, width='stretch')
+            with col2:
+                df['fraud_rate'] = df['fraud_alerts'] / df['trips'] * 100
+                fig = px.bar(df, x='fraud_alerts', y='Borough', orientation='h', color='fraud_rate',
+                           color_continuous_scale='Reds', title="Fraud Alerts by Pickup Borough (today)",
+                           labels={'fraud_rate': 'Alerts %'})
+                fig.update_layout(template="plotly_dark", height=300, yaxis_title="", xaxis_title="Alerts")
+                st.plotly_chart(fig, width='stretch')
+        
         st.markdown("---")
         
         col1, col2 = st.columns(2)
@@ -99,7 +120,7 @@ def render():
         with col1:
             if top_pickup:
                 df = pd.DataFrame(top_pickup, columns=['Zone ID', 'Trips'])
-                df['Zone'] = df['Zone ID'].apply(lambda x: zone_lookup.get_zone_name(int(x)))
+                df['Zone'] = zone_lookup.get_zone_names(df['Zone ID'])
                 df['Trips'] = df['Trips'].astype(int)
                 df = df.sort_values('Trips', ascending=True).tail(10)
                 
@@ -111,7 +132,7 @@ def render():
         with col2:
             if top_dropoff:
                 df = pd.DataFrame(top_dropoff, columns=['Zone ID', 'Trips'])
-                df['Zone'] = df['Zone ID'].apply(lambda x: zone_lookup.get_zone_name(int(x)))
+                df['Zone'] = zone_lookup.get_zone_names(df['Zone ID'])
                 df['Trips'] = df['Trips'].astype(int)
                 df = df.sort_values('Trips', ascending=True).tail(10)
                 
@@ -120,6 +141,20 @@ def render():
                 fig.update_layout(template="plotly_dark", height=300, showlegend=False, yaxis_title="")
                 st.plotly_chart(fig, width='stretch')
         
+        st.markdown("---")
+        st.markdown("### 📐 Trip Percentiles (today)")
+        units = {'fare': '$', 'distance': 'mi', 'duration': 'min', 'speed': 'mph'}
+        rows = []
+        for metric in SKETCH_METRICS:
+            p50, p95, p99 = redis_client.get_percentiles(metric)
+            if p50 is not None:
+                rows.append({'Metric': f"{metric.title()} ({units[metric]})",
+                             'p50': round(p50, 2), 'p95': round(p95, 2), 'p99': round(p99, 2)})
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, width='stretch')
+        else:
+            st.info("No percentile data")
+        
         st.caption(f"Updated: {datetime.now().strftime('%H:%M:%S')}")
 
         # --------------------------- RUSH HOURS HEATMAP ---------------------------
@@ -11,18 +11,26 @@ import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.redis_client import RedisClient
+from utils.redis_client import RedisClient, LEADERBOARD_WINDOWS, ALERT_SCORE_BAND, decode_flags
 from utils.zone_lookup import ZoneLookup
+from utils.alert_feed import AlertFeed
 
 st.set_page_config(page_title="Fraud Monitor", page_icon="🔍", layout="wide")
 st.title("🔍 Fraud Monitor")
 
 redis_client = RedisClient()
 zone_lookup = ZoneLookup()
+alert_feed = AlertFeed.for_session(st.session_state)
 
 refresh_rate = st.sidebar.slider("Refresh Rate (sec)", 1, 30, 3)
 auto_refresh = st.session_state.get('realtime', False) or st.sidebar.checkbox("Auto Refresh", value=False)
-min_score = st.sidebar.slider("Min Fraud Score", 0, 100, 30)
+window = st.sidebar.selectbox("Leaderboard Window", list(LEADERBOARD_WINDOWS),
+                              format_func=LEADERBOARD_WINDOWS.get)
+min_score = st.sidebar.slider("Min Fraud Score", 0, 100, 30, step=ALERT_SCORE_BAND)
+zone_filter = st.sidebar.number_input("Pickup Zone (0 = any)", 0, 265, 0)
+flag_names = redis_client.get_flag_names()
+flag_filter = st.sidebar.selectbox("Flag", ['Any'] + sorted(flag_names.values()))
+page_size = st.sidebar.selectbox("Alerts per Page", [25, 50, 100], index=1)
 
 ZONE_COORDS = {
     132: (40.6413, -73.7781), 138: (40.7769, -73.8740), 161: (40.7580, -73.9855),
@@ -50,22 +58,30 @@ def get_coord(zone_id):
 
 placeholder = st.empty()
 
+page = st.sidebar.number_input("Page", 1, value=1)
+
 def render():
-    alerts = redis_client.get_fraud_alerts()
-    top_zones = redis_client.get_top_fraud_zones(10)
+    # Filtering and paging happen in Redis, over the alert indexes
+    alerts, matching = redis_client.query_alerts(
+        zone=zone_filter or None, flag=None if flag_filter == 'Any' else flag_filter,
+        min_score=min_score, window=window, offset=(page - 1) * page_size, limit=page_size)
+    bands = redis_client.get_alert_bands(window)
+    top_zones = redis_client.get_top_fraud_zones(10, window)
+    # Only alerts streamed since the last refresh are read and parsed
+    feed = alert_feed.refresh(redis_client)
     
     with placeholder.container():
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Total Alerts", len(alerts))
+            st.metric("Total Alerts", sum(bands.values()))
         with col2:
-            high = sum(1 for a in alerts if a.get('fraud_score', 0) >= 70)
+            high = sum(n for band, n in bands.items() if band * ALERT_SCORE_BAND >= 70)
             st.metric("High Risk (70+)", high)
         with col3:
-            med = sum(1 for a in alerts if 50 <= a.get('fraud_score', 0) < 70)
+            med = sum(n for band, n in bands.items() if 50 <= band * ALERT_SCORE_BAND < 70)
             st.metric("Medium Risk", med)
         with col4:
-            low = sum(1 for a in alerts if a.get('fraud_score', 0) < 50)
+            low = sum(n for band, n in bands.items() if band * ALERT_SCORE_BAND < 50)
             st.metric("Low Risk", low)
         
         st.markdown("---")
@@ -73,11 +89,8 @@ def render():
         col1, col2 = st.columns(2)
         
         with col1:
-            if alerts:
-                df = pd.DataFrame(alerts)
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-                df = df.sort_values('timestamp')
-                
+            df = feed[feed['fraud_score'] >= min_score] if len(feed) else feed
+            if len(df):
                 fig = go.Figure()
                 fig.add_trace(go.Scatter(
                     x=df['timestamp'], y=df['fraud_score'],
@@ -95,7 +108,7 @@ def render():
         with col2:
             if top_zones:
                 df = pd.DataFrame(top_zones, columns=['Zone ID', 'Count'])
-                df['Zone'] = df['Zone ID'].apply(lambda x: zone_lookup.get_zone_name(int(x)))
+                df['Zone'] = zone_lookup.get_zone_names(df['Zone ID'])
                 df['Count'] = df['Count'].astype(int)
                 df = df.sort_values('Count', ascending=True)
                 
@@ -108,26 +121,39 @@ def render():
         
         st.markdown("---")
         
+        pages = max(1, -(-matching // page_size))
+        st.subheader(f"Alerts ({matching:,} matching, page {min(page, pages)} of {pages})")
+        if alerts:
+            df = pd.DataFrame(alerts)
+            df['fraud_flags'] = df['fraud_flags'].apply(lambda m: ', '.join(decode_flags(m, flag_names)))
+            # Names come with the alert (joined in the stream); older alerts only carry ids
+            for side, ids in (('pickup', 'PULocationID'), ('dropoff', 'DOLocationID')):
+                names = df[f'{side}_zone'] if f'{side}_zone' in df.columns else pd.Series(None, index=df.index, dtype=object)
+                df[side] = names.fillna(zone_lookup.get_zone_names(df[ids]))
+            columns = ['pickup_time', 'trip_id', 'fraud_score', 'fraud_flags', 'pickup', 'pickup_borough', 'dropoff',
+                       'fare_amount', 'trip_distance']
+            st.dataframe(df[[c for c in columns if c in df.columns]], width='stretch', hide_index=True)
+        else:
+            st.info("No alerts match these filters")
+        
+        st.markdown("---")
+        
         # Link to Maps page
         st.info("🗺️ For detailed fraud route maps, go to **Maps** page and select **Fraud Routes**")
         
         st.markdown("---")
         
-        if alerts:
-            flags = {}
-            for a in alerts:
-                for f in a.get('fraud_flags', []):
-                    flags[f] = flags.get(f, 0) + 1
+        # Per-flag counters kept by the Spark job, named from the flag bit registry
+        flags = redis_client.get_flag_counts()
+        if flags:
+            df = pd.DataFrame(list(flags.items()), columns=['Flag', 'Count'])
+            df['Flag'] = df['Flag'].apply(lambda x: x.replace('_', ' ').title())
+            df = df.sort_values('Count', ascending=True)
             
-            if flags:
-                df = pd.DataFrame(list(flags.items()), columns=['Flag', 'Count'])
-                df['Flag'] = df['Flag'].apply(lambda x: x.replace('_', ' ').title())
-                df = df.sort_values('Count', ascending=True)
-                
-                fig = px.bar(df, x='Count', y='Flag', orientation='h', color='Count',
-                           color_continuous_scale='Reds', title="Fraud Indicators")
-                fig.update_layout(template="plotly_dark", height=250, showlegend=False, yaxis_title="")
-                st.plotly_chart(fig, width='stretch')
+            fig = px.bar(df, x='Count', y='Flag', orientation='h', color='Count',
+                       color_continuous_scale='Reds', title="Fraud Indicators (today)")
+            fig.update_layout(template="plotly_dark", height=250, showlegend=False, yaxis_title="")
+            st.plotly_chart(fig, width='stretch')
         
         st.caption(f"Updated: {datetime.now().strftime('%H:%M:%S')}")
 
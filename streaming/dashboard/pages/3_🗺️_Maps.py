@@ -13,7 +13,7 @@ import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.redis_client import RedisClient
+from utils.redis_client import RedisClient, LEADERBOARD_WINDOWS, decode_flags
 from utils.zone_lookup import ZoneLookup
 
 st.set_page_config(page_title="Maps", page_icon="🗺️", layout="wide")
@@ -99,11 +99,13 @@ auto_refresh = st.session_state.get('realtime', False) or st.sidebar.checkbox("A
 placeholder = st.empty()
 
 def render_trip_routes():
-    """Show recent trip routes on map"""
-    st.subheader("🚗 Recent Trip Routes")
+    """Show the busiest real pickup -> dropoff routes on map"""
+    st.subheader("🚗 Top Trip Routes")
     
-    metrics = redis_client.get_metrics()
-    zone_stats = redis_client.get_zone_stats()
+    window = st.sidebar.selectbox("Route Window", list(LEADERBOARD_WINDOWS), format_func=LEADERBOARD_WINDOWS.get,
+                                  key="route_window")
+    top_n = st.sidebar.slider("Routes", 5, 50, 15, key="route_count")
+    routes = redis_client.get_top_routes(top_n, window)
     # Toggle for animated PyDeck layer
     animated = st.sidebar.checkbox("Animated Trip Routes (PyDeck)", value=False, key="animated_trip_routes")
     if animated:
@@ -115,112 +117,82 @@ def render_trip_routes():
             # trigger rerun at a higher frequency when autoplay is enabled so the deck animation updates
             realtime_interval = 250 if st.session_state.get('realtime', False) else 500
             st_autorefresh(interval=realtime_interval, key='deck_autorefresh')
-        if zone_stats:
-            pickup_zones = zone_stats.get('pickup', {})
-            dropoff_zones = zone_stats.get('dropoff', {})
-            top_pickups = sorted(pickup_zones.items(), key=lambda x: int(x[1]), reverse=True)[:20]
-            top_dropoffs = sorted(dropoff_zones.items(), key=lambda x: int(x[1]), reverse=True)[:20]
-            trips_data = []
-            for ((pu_zone, _), (do_zone, _)) in zip(top_pickups, top_dropoffs):
-                pu_lat, pu_lon = get_coord(int(pu_zone))
-                do_lat, do_lon = get_coord(int(do_zone))
-                trip = generate_path((pu_lat, pu_lon), (do_lat, do_lon), duration=duration)
-                trips_data.append(trip)
-            if trips_data:
-                try:
-                    # choose current_time based on autoplay or user control
-                    if autoplay:
-                        current_time = int(time.time()) % duration
-                    else:
-                        current_time = st.sidebar.slider('Current Time', 0, duration - 1, 0)
-                    layer = pdk.Layer(
-                        "TripsLayer",
-                        trips_data,
-                        get_path="path",
-                        get_timestamps="timestamps",
-                        get_color=[255, 80, 80],
-                        opacity=0.8,
-                        width_min_pixels=6,
-                        rounded=True,
-                        trail_length=trail_length,
+        trips_data = [generate_path(get_coord(pu_zone), get_coord(do_zone), duration=duration)
+                      for pu_zone, do_zone, _ in routes]
+        if trips_data:
+            try:
+                # choose current_time based on autoplay or user control
+                if autoplay:
+                    current_time = int(time.time()) % duration
+                else:
+                    current_time = st.sidebar.slider('Current Time', 0, duration - 1, 0)
+                layer = pdk.Layer(
+                    "TripsLayer",
+                    trips_data,
+                    get_path="path",
+                    get_timestamps="timestamps",
+                    get_color=[255, 80, 80],
+                    opacity=0.8,
+                    width_min_pixels=6,
+                    rounded=True,
+                    trail_length=trail_length,
                     current_time=current_time,
-                    )
-                    # add start and end scatter layers
-                    start_points = [{'lon': p['path'][0][0], 'lat': p['path'][0][1]} for p in trips_data]
-                    end_points = [{'lon': p['path'][-1][0], 'lat': p['path'][-1][1]} for p in trips_data]
-                    start_layer = pdk.Layer("ScatterplotLayer", start_points, get_position=['lon', 'lat'], get_radius=200, get_fill_color=[0,255,0])
-                    end_layer = pdk.Layer("ScatterplotLayer", end_points, get_position=['lon', 'lat'], get_radius=200, get_fill_color=[255,0,0])
-                    view_state = pdk.ViewState(latitude=40.7580, longitude=-73.9855, zoom=11, pitch=45, bearing=0)
-                    r = pdk.Deck(layers=[layer, start_layer, end_layer], initial_view_state=view_state, map_style="carto-darkmatter", tooltip={"text": "Moving Taxi"})
-                    st.pydeck_chart(r, width='stretch')
-                except Exception as e:
-                    st.error(f"Could not render animated routes: {e}")
-            else:
-                st.info("No trips to animate yet")
+                )
+                # add start and end scatter layers
+                start_points = [{'lon': p['path'][0][0], 'lat': p['path'][0][1]} for p in trips_data]
+                end_points = [{'lon': p['path'][-1][0], 'lat': p['path'][-1][1]} for p in trips_data]
+                start_layer = pdk.Layer("ScatterplotLayer", start_points, get_position=['lon', 'lat'], get_radius=200, get_fill_color=[0,255,0])
+                end_layer = pdk.Layer("ScatterplotLayer", end_points, get_position=['lon', 'lat'], get_radius=200, get_fill_color=[255,0,0])
+                view_state = pdk.ViewState(latitude=40.7580, longitude=-73.9855, zoom=11, pitch=45, bearing=0)
+                r = pdk.Deck(layers=[layer, start_layer, end_layer], initial_view_state=view_state, map_style="carto-darkmatter", tooltip={"text": "Moving Taxi"})
+                st.pydeck_chart(r, width='stretch')
+            except Exception as e:
+                st.error(f"Could not render animated routes: {e}")
         else:
-            st.info("No trip data yet")
+            st.info("No trips to animate yet")
         return
     
-    if zone_stats:
-        fig = go.Figure()
-        
-        # Get top pickup-dropoff pairs
-        pickup_zones = zone_stats.get('pickup', {})
-        dropoff_zones = zone_stats.get('dropoff', {})
-        
-        # Draw routes between top zones
-        top_pickups = sorted(pickup_zones.items(), key=lambda x: int(x[1]), reverse=True)[:15]
-        top_dropoffs = sorted(dropoff_zones.items(), key=lambda x: int(x[1]), reverse=True)[:15]
-        
-        colors = px.colors.qualitative.Set2
-
-        max_count = max([int(x[1]) for x in top_pickups + top_dropoffs] or [1])
-        for i, ((pu_zone, pu_count), (do_zone, do_count)) in enumerate(zip(top_pickups, top_dropoffs)):
-            pu_coord = get_coord(int(pu_zone))
-            do_coord = get_coord(int(do_zone))
-            width_px = int(2 + (min(int(pu_count), int(do_count)) / max_count) * 12)
-            fig.add_trace(go.Scattermapbox(
-                mode='lines',
-                lon=[pu_coord[1], do_coord[1]],
-                lat=[pu_coord[0], do_coord[0]],
-                line=dict(width=width_px, color='#ff4444'),
-                opacity=0.8,
-                name=f"Route {i+1}",
-                showlegend=False
-            ))
-            # Add markers for start and end
-            fig.add_trace(go.Scattermapbox(mode='markers', lon=[pu_coord[1]], lat=[pu_coord[0]], marker=dict(size=8, color='#00ff00'), hovertext=[f"Start: {zone_lookup.get_zone_name(int(pu_zone))} ({pu_count})"]))
-            fig.add_trace(go.Scattermapbox(mode='markers', lon=[do_coord[1]], lat=[do_coord[0]], marker=dict(size=8, color='#ff4444'), hovertext=[f"End: {zone_lookup.get_zone_name(int(do_zone))} ({do_count})"]))
-        
-        # Add pickup markers
-        pu_lats = [get_coord(int(z))[0] for z, _ in top_pickups]
-        pu_lons = [get_coord(int(z))[1] for z, _ in top_pickups]
-        pu_texts = [f"{zone_lookup.get_zone_name(int(z))}: {c} pickups" for z, c in top_pickups]
-        
-        fig.add_trace(go.Scattermapbox(
-            mode='markers+text',
-            lon=pu_lons, lat=pu_lats,
-            marker=dict(size=15, color='#ff4444', symbol='circle'),
-            text=[zone_lookup.get_zone_name(int(z)) for z, _ in top_pickups],
-            textposition="top center",
-            textfont=dict(size=10, color='white'),
-            hovertext=pu_texts,
-            name='Pickups'
-        ))
-        
-        # Add dropoff markers
-        do_lats = [get_coord(int(z))[0] for z, _ in top_dropoffs]
-        do_lons = [get_coord(int(z))[1] for z, _ in top_dropoffs]
-        do_texts = [f"{zone_lookup.get_zone_name(int(z))}: {c} dropoffs" for z, c in top_dropoffs]
-        
+    if not routes:
+        st.info("📊 No trip data yet. Start sending trips to see routes!")
+        return
+    
+    fig = go.Figure()
+    max_count = routes[0][2]
+    for i, (pu_zone, do_zone, count) in enumerate(routes):
+        pu_coord, do_coord = get_coord(pu_zone), get_coord(do_zone)
+        width_px = int(2 + count / max_count * 12)
+        route_name = f"{zone_lookup.get_zone_name(pu_zone)} → {zone_lookup.get_zone_name(do_zone)}"
         fig.add_trace(go.Scattermapbox(
-            mode='markers',
-            lon=do_lons, lat=do_lats,
-            marker=dict(size=12, color='#ff4444', symbol='circle'),
-            hovertext=do_texts,
-            name='Dropoffs'
+            mode='lines',
+            lon=[pu_coord[1], do_coord[1]],
+            lat=[pu_coord[0], do_coord[0]],
+            line=dict(width=width_px, color='#ff4444'),
+            opacity=0.8,
+            name=f"Route {i+1}",
+            hovertext=f"{route_name}: {count:,} trips",
+            showlegend=False
         ))
-        
+    
+    # Pickup (green) and dropoff (red) ends of the routes
+    pickups = sorted({pu_zone for pu_zone, _, _ in routes})
+    dropoffs = sorted({do_zone for _, do_zone, _ in routes})
+    fig.add_trace(go.Scattermapbox(
+        mode='markers+text',
+        lon=[get_coord(z)[1] for z in pickups], lat=[get_coord(z)[0] for z in pickups],
+        marker=dict(size=12, color='#00ff00', symbol='circle'),
+        text=[zone_lookup.get_zone_name(z) for z in pickups],
+        textposition="top center",
+        textfont=dict(size=10, color='white'),
+        name='Pickups'
+    ))
+    fig.add_trace(go.Scattermapbox(
+        mode='markers',
+        lon=[get_coord(z)[1] for z in dropoffs], lat=[get_coord(z)[0] for z in dropoffs],
+        marker=dict(size=10, color='#ff4444', symbol='circle'),
+        hovertext=[zone_lookup.get_zone_name(z) for z in dropoffs],
+        name='Dropoffs'
+    ))
+    
     fig.update_layout(
         mapbox=dict(style='carto-darkmatter', center=dict(lat=40.7580, lon=-73.9855), zoom=10),
         height=700, margin={"r":0,"t":0,"l":0,"b":0},
@@ -245,29 +217,20 @@ def render_trip_routes():
     ))
     config = {'scrollZoom': True, 'displayModeBar': True}
     st.plotly_chart(fig, width='stretch', config=config)
-        # Add a small table for top estimated routes (approx min pickup/dropoff count)
-        route_estimates = []
-        for (pu_zone, pu_count), (do_zone, do_count) in zip(top_pickups, top_dropoffs):
-            route_estimates.append({
-                'pickup_zone': zone_lookup.get_zone_name(int(pu_zone)),
-                'dropoff_zone': zone_lookup.get_zone_name(int(do_zone)),
-                'pickup_count': int(pu_count),
-                'dropoff_count': int(do_count),
-                'est_trips': int(min(int(pu_count), int(do_count)))
-            })
-        df_routes = pd.DataFrame(route_estimates).sort_values('est_trips', ascending=False).head(10)
-        if not df_routes.empty:
-            st.markdown('### Top Estimated Routes')
-            st.table(df_routes)
-        
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown("🟢 **Green** = Pickup locations")
-        with col2:
-            st.markdown("🔴 **Red** = Dropoff locations")
-    else:
-        st.info("📊 No trip data yet. Start sending trips to see routes!")
+    
+    df_routes = pd.DataFrame([{
+        'pickup_zone': zone_lookup.get_zone_name(pu_zone),
+        'dropoff_zone': zone_lookup.get_zone_name(do_zone),
+        'trips': count
+    } for pu_zone, do_zone, count in routes])
+    st.markdown('### Top Routes')
+    st.table(df_routes)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("🟢 **Green** = Pickup locations")
+    with col2:
+        st.markdown("🔴 **Red** = Dropoff locations")
 
 def render_pickup_hotspots():
     """Show pickup hotspots on map"""
@@ -361,12 +324,14 @@ def render_fraud_routes():
     
     if alerts:
         fig = go.Figure()
+        flag_names = redis_client.get_flag_names()
         
         # Draw routes
         for alert in alerts:
             pu = alert.get('PULocationID', 1)
             do = alert.get('DOLocationID', 1)
             score = alert.get('fraud_score', 0)
+            flags = ', '.join(decode_flags(alert.get('fraud_flags', 0), flag_names))
             
             pu_coord = get_coord(pu)
             do_coord = get_coord(do)
@@ -380,7 +345,7 @@ def render_fraud_routes():
                 line=dict(width=3, color=color),
                 opacity=0.7,
                 showlegend=False,
-                hovertext=f"Score: {score}"
+                hovertext=f"Score: {score} ({flags})" if flags else f"Score: {score}"
             ))
         
         # Add markers
@@ -0,0 +1,38 @@
+"""Incremental Fraud Alert Feed"""
+
+import pandas as pd
+
+# Alerts kept in a session's frame; older ones are still in the indexes
+FEED_ROWS = 2000
+# Most alerts read per refresh, so a long pause catches up over a few refreshes
+FEED_READ_COUNT = 1000
+
+
+class AlertFeed:
+    """Alerts tailed from the fraud alert stream, kept per Streamlit session.
+
+    Each refresh reads only the entries after the last id seen and appends
+    them to a cached DataFrame, so its cost follows the number of new alerts.
+    """
+
+    def __init__(self):
+        self.cursor = None
+        self.frame = pd.DataFrame()
+
+    @classmethod
+    def for_session(cls, session_state, key='alert_feed'):
+        if key not in session_state:
+            session_state[key] = cls()
+        return session_state[key]
+
+    def refresh(self, redis_client) -> pd.DataFrame:
+        alerts, cursor = redis_client.read_alert_stream(self.cursor, FEED_READ_COUNT)
+        if alerts:
+            new = pd.DataFrame(alerts)
+            new['timestamp'] = pd.to_datetime(new['timestamp'])
+            self.frame = pd.concat([self.frame, new], ignore_index=True).tail(FEED_ROWS)
+            self.cursor = cursor
+        elif self.cursor is not None and not redis_client.get_alert_stream_length():
+            # Redis was flushed: start over
+            self.cursor, self.frame = None, pd.DataFrame()
+        return self.frame
@@ -3,7 +3,67 @@
 import redis
 import json
 import os
-from datetime import datetime
+import numpy as np
+from datetime import datetime, timedelta
+
+# Leaderboard windows, read from the Space-Saving sketches the Spark job writes
+# per 10-minute event-time slot and per day (plus one all-time sketch)
+LEADERBOARD_WINDOWS = {'all': 'All time', 'week': 'Last 7 days', 'day': 'Today', 'hour': 'Last hour'}
+# Zone boards hold every zone (exact), so maps can read them whole
+ZONE_BOARD_SIZE = 300
+# Unioned window views are cached this long, so refreshes share one ZUNIONSTORE
+LEADERBOARD_VIEW_TTL = 5
+
+# Origin-destination matrices: OD_ZONES x OD_ZONES big-endian int32 trip counts
+# per pickup hour and day, row = pickup zone - 1, column = dropoff zone - 1
+OD_ZONES = 265
+
+# Fraud alerts live under fraud:alert:{trip_id}, indexed by sorted sets of
+# trip ids scored by pickup time: fraud:idx:all, :zone:{id}, :flag:{bit} and
+# :band:{score // ALERT_SCORE_BAND}
+ALERT_SCORE_BAND = 10
+MAX_ALERT_BAND = 100 // ALERT_SCORE_BAND
+# Capped stream of every alert, for tailing from a cursor
+ALERT_STREAM_KEY = "fraud:alerts:stream"
+
+# Metrics the Spark job keeps quantile sketches for
+SKETCH_METRICS = ('fare', 'distance', 'duration', 'speed')
+
+
+def decode_flags(mask: int, flag_names: dict) -> list:
+    """Names of the fraud flags set in an alert's fraud_flags bitmask"""
+    if isinstance(mask, list):
+        # Alerts written before fraud_flags became a bitmask carry the names
+        return mask
+    return [flag_names.get(bit, f"bit_{bit}") for bit in range(mask.bit_length()) if mask >> bit & 1]
+
+
+def sketch_quantiles(buckets: dict, quantiles, relative_accuracy: float) -> list:
+    """Read quantiles from merged log-histogram bucket counts (see spark/quantile_sketch.py)"""
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+    
+    def value(bucket):
+        if bucket == '0':
+            return 0.0
+        index = int(bucket.lstrip('-'))
+        # Midpoint (in relative terms) of (gamma^(i-1), gamma^i]
+        magnitude = 2 * gamma ** index / (gamma + 1)
+        return -magnitude if bucket.startswith('-') else magnitude
+    
+    ordered = sorted(((value(b), int(c)) for b, c in buckets.items()), key=lambda item: item[0])
+    total = sum(count for _, count in ordered)
+    if not total:
+        return [None] * len(quantiles)
+    results = []
+    for q in quantiles:
+        rank, seen = q * (total - 1), 0
+        for bucket_value, count in ordered:
+            seen += count
+            if seen > rank:
+                results.append(bucket_value)
+                break
+    return results
+
 
 class RedisClient:
     def __init__(self, clear_on_start=False):
@@ -12,6 +72,11 @@ class RedisClient:
             port=int(os.getenv('REDIS_PORT', 6379)),
             decode_responses=True
         )
+        # OD matrices are binary, so they are read without decoding
+        self.binary_client = redis.Redis(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=int(os.getenv('REDIS_PORT', 6379))
+        )
         if clear_on_start:
             self.clear_all_data()
     
@@ -37,25 +102,229 @@ class RedisClient:
         }
     
     def get_fraud_alerts(self, limit=100) -> list:
-        today = datetime.now().strftime("%Y-%m-%d")
-        alerts = self.client.lrange(f"fraud:alerts:{today}", 0, limit - 1)
-        return [json.loads(a) for a in alerts]
+        """The newest `limit` fraud alerts"""
+        return self.query_alerts(limit=limit)[0]
+    
+    def query_alerts(self, zone: int = None, flag: str = None, min_score: int = 0, window: str = 'all',
+                     offset: int = 0, limit: int = 50) -> tuple:
+        """A page of fraud alerts, newest pickup first, and how many match in total.
+
+        Filters combine: pickup zone, flag name, and min_score (rounded down to
+        its band of ALERT_SCORE_BAND points). Windows are anchored on the latest
+        pickup like the leaderboards. Filtered indexes are intersected in Redis
+        and cached for LEADERBOARD_VIEW_TTL, so paging does not redo the work.
+        """
+        keys = []
+        if zone is not None:
+            keys.append(f"fraud:idx:zone:{zone}")
+        bit = None
+        if flag is not None:
+            bits = {name: bit for bit, name in self.get_flag_names().items()}
+            if flag not in bits:
+                return [], 0
+            bit = bits[flag]
+            keys.append(f"fraud:idx:flag:{bit}")
+        min_band = max(0, min_score) // ALERT_SCORE_BAND
+        
+        if min_band:
+            index = f"fraud:idx:view:{zone}:{bit}:{min_band}"
+        elif len(keys) > 1:
+            index = f"fraud:idx:view:{zone}:{bit}:0"
+        else:
+            index = keys[0] if keys else "fraud:idx:all"
+        if index.startswith("fraud:idx:view:") and not self.client.exists(index):
+            pipe = self.client.pipeline()
+            if min_band:
+                bands = f"fraud:idx:view:band:{min_band}"
+                pipe.zunionstore(bands, [f"fraud:idx:band:{b}" for b in range(min_band, MAX_ALERT_BAND + 1)])
+                pipe.expire(bands, LEADERBOARD_VIEW_TTL)
+                keys.append(bands)
+            # Members of every index carry the same pickup-time score
+            pipe.zinterstore(index, keys, aggregate='MAX')
+            pipe.expire(index, LEADERBOARD_VIEW_TTL)
+            pipe.execute()
+        
+        since = self._window_start(window)
+        pipe = self.client.pipeline()
+        pipe.zcount(index, since, '+inf')
+        pipe.zrevrangebyscore(index, '+inf', since, start=offset, num=limit)
+        total, ids = pipe.execute()
+        if not ids:
+            return [], total
+        bodies = self.client.mget([f"fraud:alert:{trip_id}" for trip_id in ids])
+        return [json.loads(body) for body in bodies if body], total
+    
+    def read_alert_stream(self, after: str = None, count: int = 1000) -> tuple:
+        """Up to `count` alerts streamed after entry id `after`, oldest first, and the new cursor.
+
+        Without a cursor, the newest `count` alerts are returned. The cursor is
+        the last entry id read (or `after` when nothing is new).
+        """
+        if after is None:
+            entries = self.client.xrevrange(ALERT_STREAM_KEY, count=count)[::-1]
+        else:
+            entries = dict(self.client.xread({ALERT_STREAM_KEY: after}, count=count)).get(ALERT_STREAM_KEY, [])
+        if not entries:
+            return [], after
+        return [json.loads(fields['alert']) for _, fields in entries], entries[-1][0]
     
-    def get_top_fraud_zones(self, limit=10) -> list:
-        return self.client.zrevrange("fraud:by_zone", 0, limit - 1, withscores=True)
+    def get_alert_stream_length(self) -> int:
+        return self.client.xlen(ALERT_STREAM_KEY)
     
-    def get_top_fraud_routes(self, limit=10) -> list:
-        return self.client.zrevrange("fraud:by_route", 0, limit - 1, withscores=True)
+    def get_alert_bands(self, window: str = 'all') -> dict:
+        """Alerts per score band (score // ALERT_SCORE_BAND) over a window"""
+        since = self._window_start(window)
+        pipe = self.client.pipeline()
+        for band in range(MAX_ALERT_BAND + 1):
+            pipe.zcount(f"fraud:idx:band:{band}", since, '+inf')
+        return dict(enumerate(pipe.execute()))
+    
+    def _window_start(self, window: str):
+        """Epoch seconds a window starts at (or '-inf'), anchored on the latest pickup"""
+        if window not in LEADERBOARD_WINDOWS:
+            raise ValueError(f"Unknown window '{window}' (expected {', '.join(LEADERBOARD_WINDOWS)})")
+        if window == 'all':
+            return '-inf'
+        latest = self.client.hget("metrics:event_time", "max_event_time")
+        latest = datetime.fromisoformat(latest) if latest else datetime.now()
+        if window == 'hour':
+            return (latest - timedelta(hours=1)).timestamp()
+        midnight = latest.replace(hour=0, minute=0, second=0, microsecond=0)
+        return (midnight - timedelta(days=6 if window == 'week' else 0)).timestamp()
+    
+    def get_flag_names(self) -> dict:
+        """bit -> name of the fraud flags, as published by the Spark job"""
+        return {int(bit): name for bit, name in self.client.hgetall("fraud:flag_names").items()}
+    
+    def get_borough_stats(self, day: str = None) -> dict:
+        """Trips, revenue and fraud alerts per pickup borough for a day (default today)"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        pipe = self.client.pipeline()
+        for counter in ('trips', 'revenue', 'fraud_alerts'):
+            pipe.hgetall(f"metrics:{day}:borough:{counter}")
+        trips, revenue, fraud = pipe.execute()
+        return {borough: {'trips': int(count), 'revenue': float(revenue.get(borough, 0)),
+                          'fraud_alerts': int(fraud.get(borough, 0))}
+                for borough, count in trips.items()}
+    
+    def get_flag_counts(self, day: str = None) -> dict:
+        """Alerts per fraud flag name for a day (default today)"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        pipe = self.client.pipeline()
+        pipe.hgetall(f"fraud:flags:{day}")
+        pipe.hgetall("fraud:flag_names")
+        counts, names = pipe.execute()
+        return {names.get(bit, f"bit_{bit}"): int(count) for bit, count in counts.items()}
+    
+    def get_top_fraud_zones(self, limit=10, window='all') -> list:
+        return self.get_leaderboard('fraud_zone', window, limit)
+    
+    def get_top_fraud_routes(self, limit=10, window='all') -> list:
+        return self.get_leaderboard('fraud_route', window, limit)
     
     # ============ NEW AGGREGATIONS ============
     
-    def get_top_pickup_zones(self, limit=10) -> list:
+    def get_top_pickup_zones(self, limit=10, window='all') -> list:
         """Get top pickup zones by trip count"""
-        return self.client.zrevrange("stats:pickup_zones", 0, limit - 1, withscores=True)
+        return self.get_leaderboard('pickup_zone', window, limit)
     
-    def get_top_dropoff_zones(self, limit=10) -> list:
+    def get_top_dropoff_zones(self, limit=10, window='all') -> list:
         """Get top dropoff zones by trip count"""
-        return self.client.zrevrange("stats:dropoff_zones", 0, limit - 1, withscores=True)
+        return self.get_leaderboard('dropoff_zone', window, limit)
+    
+    def get_leaderboard(self, board: str, window: str = 'all', limit: int = 10) -> list:
+        """Top `limit` (member, count) of a leaderboard over a window.
+
+        hour: the six 10-minute slots up to the latest pickup seen, day: that
+        pickup's day, week: the 7 days ending on it, all: since the start.
+        Windows are anchored on event time, so a replay shows its own data.
+        """
+        if window == 'all':
+            return self.client.zrevrange(f"topk:{board}:all", 0, limit - 1, withscores=True)
+        if window not in LEADERBOARD_WINDOWS:
+            raise ValueError(f"Unknown leaderboard window '{window}' (expected {', '.join(LEADERBOARD_WINDOWS)})")
+        
+        latest = self.client.hget("metrics:event_time", "max_event_time")
+        latest = datetime.fromisoformat(latest) if latest else datetime.now()
+        if window == 'hour':
+            slot = latest.replace(minute=latest.minute // 10 * 10, second=0, microsecond=0)
+            keys = [f"topk:{board}:slot:{(slot - timedelta(minutes=10 * i)).strftime('%Y-%m-%dT%H:%M')}"
+                    for i in range(6)]
+        elif window == 'day':
+            return self.client.zrevrange(f"topk:{board}:day:{latest.strftime('%Y-%m-%d')}",
+                                         0, limit - 1, withscores=True)
+        else:
+            keys = [f"topk:{board}:day:{(latest - timedelta(days=i)).strftime('%Y-%m-%d')}" for i in range(7)]
+        
+        view = f"topk:{board}:view:{window}"
+        if not self.client.exists(view):
+            pipe = self.client.pipeline()
+            pipe.zunionstore(view, keys)
+            pipe.expire(view, LEADERBOARD_VIEW_TTL)
+            pipe.execute()
+        return self.client.zrevrange(view, 0, limit - 1, withscores=True)
+    
+    def get_od_matrix(self, window: str = 'all') -> np.ndarray:
+        """OD_ZONES x OD_ZONES trip counts (pickup zone - 1, dropoff zone - 1) over a window.
+
+        all and day are one GET of a ready matrix, hour is the latest pickup's
+        hour and week the sum of the 7 day matrices ending on it.
+        """
+        if window not in LEADERBOARD_WINDOWS:
+            raise ValueError(f"Unknown window '{window}' (expected {', '.join(LEADERBOARD_WINDOWS)})")
+        if window == 'all':
+            keys = ["od:all"]
+        else:
+            latest = self.client.hget("metrics:event_time", "max_event_time")
+            latest = datetime.fromisoformat(latest) if latest else datetime.now()
+            if window == 'hour':
+                keys = [f"od:{latest.strftime('%Y-%m-%d')}:{latest.hour}"]
+            elif window == 'day':
+                keys = [f"od:{latest.strftime('%Y-%m-%d')}"]
+            else:
+                keys = [f"od:{(latest - timedelta(days=i)).strftime('%Y-%m-%d')}" for i in range(7)]
+        
+        matrix = np.zeros(OD_ZONES * OD_ZONES, dtype=np.int64)
+        for blob in self.binary_client.mget(keys):
+            if blob:
+                # Cells past the highest one ever written are not stored yet
+                cells = np.frombuffer(blob, dtype='>i4')
+                matrix[:len(cells)] += cells
+        return matrix.reshape(OD_ZONES, OD_ZONES)
+    
+    def get_top_routes(self, limit: int = 10, window: str = 'all') -> list:
+        """Top `limit` (pickup zone, dropoff zone, trips) pairs over a window, busiest first"""
+        counts = self.get_od_matrix(window).ravel()
+        limit = min(limit, np.count_nonzero(counts))
+        if not limit:
+            return []
+        top = np.argpartition(counts, -limit)[-limit:]
+        top = top[np.argsort(counts[top])[::-1]]
+        return [(int(cell // OD_ZONES) + 1, int(cell % OD_ZONES) + 1, int(counts[cell])) for cell in top]
+    
+    def get_percentiles(self, metric: str, quantiles=(0.5, 0.95, 0.99), day: str = None,
+                        hour: int = None, zone: int = None) -> list:
+        """Quantiles of a trip metric for a day, one of its pickup hours or one pickup zone.
+
+        The day's sketch is the merge of its 24 hourly ones, read in one round trip.
+        """
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        if zone is not None:
+            keys = [f"sketch:{day}:zone:{zone}:{metric}"]
+        elif hour is not None:
+            keys = [f"sketch:{day}:hour:{hour}:{metric}"]
+        else:
+            keys = [f"sketch:{day}:hour:{h}:{metric}" for h in range(24)]
+        pipe = self.client.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        pipe.hget("sketch:config", "relative_accuracy")
+        *sketches, accuracy = pipe.execute()
+        merged = {}
+        for sketch in sketches:
+            for bucket, count in sketch.items():
+                merged[bucket] = merged.get(bucket, 0) + int(count)
+        return sketch_quantiles(merged, quantiles, float(accuracy or 0.02))
     
     def get_payment_type_stats(self) -> dict:
         """Get payment type distribution"""
@@ -84,19 +353,17 @@ class RedisClient:
         """Alias for get_today_metrics"""
         return self.get_today_metrics()
     
-    def get_zone_stats(self) -> dict:
+    def get_zone_stats(self, window='all') -> dict:
         """Get zone statistics for maps"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        
         # Get pickup zones
         pickup_zones = {}
-        pickup_data = self.client.zrevrange("stats:pickup_zones", 0, -1, withscores=True)
+        pickup_data = self.get_leaderboard('pickup_zone', window, ZONE_BOARD_SIZE)
         for zone, count in pickup_data:
             pickup_zones[zone] = int(count)
         
         # Get dropoff zones  
         dropoff_zones = {}
-        dropoff_data = self.client.zrevrange("stats:dropoff_zones", 0, -1, withscores=True)
+        dropoff_data = self.get_leaderboard('dropoff_zone', window, ZONE_BOARD_SIZE)
         for zone, count in dropoff_data:
             dropoff_zones[zone] = int(count)
         
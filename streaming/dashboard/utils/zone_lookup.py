@@ -17,5 +17,10 @@ class ZoneLookup:
     def get_zone_name(self, location_id: int) -> str:
         return self.zones.get(location_id, f"Zone {location_id}")
     
+    def get_zone_names(self, location_ids: pd.Series) -> pd.Series:
+        """Zone names for a column of ids, mapped in one pass"""
+        ids = location_ids.astype(int)
+        return ids.map(self.zones).fillna("Zone " + ids.astype(str))
+    
     def get_borough(self, location_id: int) -> str:
         return self.boroughs.get(location_id, "Unknown")
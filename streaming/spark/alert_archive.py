@@ -0,0 +1,141 @@
+"""Parquet archive of every fraud alert, and its query API
+
+The streaming job lands each alert through a BronzeSink (see bronze_sink.py)
+at ALERT_ARCHIVE_PATH, partitioned by pickup date and hour:
+
+    <path>/pickup_date=2026-01-15/pickup_hour=8/<query id>-c0000000000-0000000719.parquet
+
+Files are sorted by ARCHIVE_SORT_COLUMNS and written with small row groups, so
+the min/max statistics of a row group are narrow in pickup zone and score.
+Queries run on pyarrow datasets without Spark: partition filters skip whole
+hours, the remaining predicates are pushed into the Parquet reader to skip
+row groups, and matching rows are streamed in record batches so a query over
+months of alerts never holds more than one batch in memory.
+
+    python alert_archive.py /data/alerts --start 2026-01-15T08:00 --end 2026-01-15T09:00 --zone 161
+    python alert_archive.py /data/alerts --start 2026-01-01 --min-score 70 --flag fake_airport_fee --count
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+ARCHIVE_SORT_COLUMNS = ("PULocationID", "fraud_score", "pickup_time")
+ARCHIVE_PARTITIONING = ds.partitioning(
+    pa.schema([("pickup_date", pa.string()), ("pickup_hour", pa.int32())]), flavor="hive")
+
+
+def open_archive(path: str) -> ds.Dataset:
+    """The archive as a pyarrow dataset (files under '_staging' are ignored)"""
+    return ds.dataset(path, format="parquet", partitioning=ARCHIVE_PARTITIONING)
+
+
+def hour_filter(start: datetime = None, end: datetime = None):
+    """Partition filter keeping the pickup hours that overlap [start, end)"""
+    date, hour = ds.field("pickup_date"), ds.field("pickup_hour")
+    expression = None
+    if start is not None:
+        day = start.strftime('%Y-%m-%d')
+        expression = (date > day) | ((date == day) & (hour >= start.hour))
+    if end is not None:
+        last = end - timedelta(microseconds=1)
+        day = last.strftime('%Y-%m-%d')
+        before = (date < day) | ((date == day) & (hour <= last.hour))
+        expression = before if expression is None else expression & before
+    return expression
+
+
+def alert_filter(start: datetime = None, end: datetime = None, zone=None, min_score: int = None,
+                 max_score: int = None, flag_bit: int = None):
+    """Filter expression for alerts picked up in [start, end) matching every given predicate.
+
+    zone is a pickup zone id or a list of them. The flag test cannot use row
+    group statistics, so it is applied to the rows the other predicates keep.
+    """
+    predicates = []
+    partitions = hour_filter(start, end)
+    if partitions is not None:
+        predicates.append(partitions)
+    if start is not None:
+        predicates.append(ds.field("pickup_time") >= pa.scalar(start, pa.timestamp('us')))
+    if end is not None:
+        predicates.append(ds.field("pickup_time") < pa.scalar(end, pa.timestamp('us')))
+    if zone is not None:
+        zones = zone if isinstance(zone, (list, tuple, set)) else [zone]
+        predicates.append(ds.field("PULocationID").isin(list(zones)))
+    if min_score is not None:
+        predicates.append(ds.field("fraud_score") >= min_score)
+    if max_score is not None:
+        predicates.append(ds.field("fraud_score") <= max_score)
+    if flag_bit is not None:
+        predicates.append(pc.bit_wise_and(ds.field("fraud_flags"), pa.scalar(1 << flag_bit, pa.int64())) != 0)
+    expression = None
+    for predicate in predicates:
+        expression = predicate if expression is None else expression & predicate
+    return expression
+
+
+def alert_scanner(path: str, columns: list = None, batch_size: int = 65536, **filters) -> ds.Scanner:
+    """Scanner over the matching alerts; filters are those of alert_filter()"""
+    return open_archive(path).scanner(columns=columns, filter=alert_filter(**filters), batch_size=batch_size)
+
+
+def scan_alerts(path: str, columns: list = None, **filters):
+    """Stream the matching alerts as record batches"""
+    for batch in alert_scanner(path, columns, **filters).to_batches():
+        if batch.num_rows:
+            yield batch
+
+
+def query_alerts(path: str, columns: list = None, limit: int = None, **filters) -> pa.Table:
+    """Matching alerts as a table, stopping after `limit` rows (unordered across files)"""
+    scanner = alert_scanner(path, columns, **filters)
+    batches, rows = [], 0
+    for batch in scanner.to_batches():
+        if limit is not None and rows + batch.num_rows >= limit:
+            batches.append(batch.slice(0, limit - rows))
+            break
+        batches.append(batch)
+        rows += batch.num_rows
+    return pa.Table.from_batches(batches, schema=scanner.projected_schema)
+
+
+def count_alerts(path: str, **filters) -> int:
+    return open_archive(path).count_rows(filter=alert_filter(**filters))
+
+
+def main():
+    from fraud_rules import fraud_flag_bits, load_rules
+
+    parser = argparse.ArgumentParser(description='Query the fraud alert archive')
+    parser.add_argument('path', help='Archive root (ALERT_ARCHIVE_PATH of the streaming job)')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='Pickups from this ISO time')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='Pickups before this ISO time')
+    parser.add_argument('--zone', type=int, action='append', help='Pickup zone (repeatable)')
+    parser.add_argument('--min-score', type=int)
+    parser.add_argument('--max-score', type=int)
+    parser.add_argument('--flag', help='Flag name, as in fraud_rules.json')
+    parser.add_argument('--limit', type=int, default=100, help='Rows to print')
+    parser.add_argument('--count', action='store_true', help='Only count the matching alerts')
+    args = parser.parse_args()
+
+    flag_bit = None
+    if args.flag:
+        bits = {name: bit for bit, name in fraud_flag_bits(load_rules()[0]).items()}
+        if args.flag not in bits:
+            sys.exit(f"Unknown flag '{args.flag}' (known: {', '.join(sorted(bits))})")
+        flag_bit = bits[args.flag]
+    filters = dict(start=args.start, end=args.end, zone=args.zone, min_score=args.min_score,
+                   max_score=args.max_score, flag_bit=flag_bit)
+    if args.count:
+        print(count_alerts(args.path, **filters))
+        return
+    print(query_alerts(args.path, limit=args.limit, **filters).to_pandas().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
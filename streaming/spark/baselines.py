@@ -0,0 +1,143 @@
+"""Per-zone rolling baselines for anomaly scoring
+
+Each (PULocationID, pickup hour) group keeps the running count, mean and sum
+of squared deviations (M2) of a few trip metrics. A micro-batch is merged in
+with Chan's parallel update, so the baseline changes in O(1) per trip
+whatever the history length, and every trip gets a z-score per metric against
+the baseline as it stood *before* its batch, so a burst of odd trips cannot
+vouch for itself. The z-scores are ordinary scorer inputs ('<metric>_z') for
+the rule table.
+
+The baselines are small (at most 265 zones x 24 hours) and live on the driver
+as a ZoneBaselines, saved to Redis as one JSON hash field per group. The lite
+detector scores and merges a batch here with NumPy; the Spark job joins
+rows() onto the batch, computes the batch moments with a native aggregate and
+merges them here, so no trip goes through a Python worker.
+
+Scoring and merging only stage the updated groups, on copies. The caller
+saves them to Redis and commits them to memory once the write went through
+and was not a duplicate, so a failed or replayed write never leaves the
+in-memory baselines ahead of the stored ones.
+"""
+
+import json
+import math
+
+import numpy as np
+
+BASELINE_METRICS = ('fare_per_mile', 'speed_mph', 'tip_pct')
+# A group needs this many trips of a metric before its z-scores count
+MIN_BASELINE_TRIPS = 30
+# Standard deviation floors, so a near-constant baseline does not blow up z
+MIN_STD = {'fare_per_mile': 0.5, 'speed_mph': 1.0, 'tip_pct': 2.0}
+# Group key part for a missing zone or hour
+MISSING_KEY = -1
+
+
+def z_column(metric: str) -> str:
+    return f"{metric}_z"
+
+
+def group_key(zone, hour) -> str:
+    return f"{zone}:{hour}"
+
+
+def combine_moments(count: int, mean: float, m2: float, batch_count: int, batch_mean: float, batch_m2: float):
+    """Chan's parallel update: running (count, mean, m2) merged with a batch's"""
+    if batch_count == 0:
+        return count, mean, m2
+    total = count + batch_count
+    delta = batch_mean - mean
+    return total, mean + delta * batch_count / total, m2 + batch_m2 + delta * delta * count * batch_count / total
+
+
+def merge_moments(count: int, mean: float, m2: float, values: np.ndarray):
+    """Fold a batch of values (NaN = missing) into running (count, mean, m2)"""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return count, mean, m2
+    batch_mean = float(values.mean())
+    return combine_moments(count, mean, m2, len(values), batch_mean, float(((values - batch_mean) ** 2).sum()))
+
+
+def baseline_std(count: int, m2: float, min_std: float):
+    """Standard deviation z-scores divide by, or None while the baseline is too young"""
+    if count < MIN_BASELINE_TRIPS:
+        return None
+    return max(math.sqrt(m2 / (count - 1)), min_std)
+
+
+def z_scores(values: np.ndarray, count: int, mean: float, m2: float, min_std: float) -> np.ndarray:
+    """z-scores against a baseline; 0 while the baseline is too young or the value is missing"""
+    std = baseline_std(count, m2, min_std)
+    if std is None:
+        return np.zeros(len(values))
+    z = (values - mean) / std
+    return np.where(np.isnan(z), 0.0, z)
+
+
+class ZoneBaselines:
+    """Per-(PULocationID, pickup hour) moments, restored from their Redis hash fields"""
+
+    def __init__(self, state: dict = None):
+        # 'zone:hour' -> flat (count, mean, m2) per metric
+        self.moments = {group: json.loads(value) for group, value in (state or {}).items()}
+
+    def get(self, group: str) -> list:
+        """A copy of a group's moments, safe to update"""
+        return list(self.moments.get(group) or [0, 0.0, 0.0] * len(BASELINE_METRICS))
+
+    def score(self, df):
+        """Add <metric>_z columns to a pandas batch against the baselines before it.
+
+        Returns the scored batch and the groups with the batch folded in, staged
+        for commit().
+        """
+        z = {metric: np.zeros(len(df)) for metric in BASELINE_METRICS}
+        zones = df['PULocationID'].fillna(MISSING_KEY).astype(np.int64)
+        hours = df['pickup_hour'].fillna(MISSING_KEY).astype(np.int64)
+        staged = {}
+        for (zone, hour), index in df.groupby([zones, hours], sort=False).indices.items():
+            group = group_key(zone, hour)
+            flat = self.get(group)
+            for i, metric in enumerate(BASELINE_METRICS):
+                values = df[metric].to_numpy(dtype=np.float64, na_value=np.nan)[index]
+                moments = tuple(flat[i * 3:i * 3 + 3])
+                z[metric][index] = z_scores(values, *moments, MIN_STD[metric])
+                flat[i * 3:i * 3 + 3] = merge_moments(*moments, values)
+            staged[group] = flat
+        return df.assign(**{z_column(metric): values for metric, values in z.items()}), staged
+
+    def merge(self, batch: dict) -> dict:
+        """Fold in batch moments ('zone:hour' -> flat (count, mean, m2) per metric).
+
+        Returns the updated groups, staged for commit().
+        """
+        staged = {}
+        for group, batch_flat in batch.items():
+            flat = self.get(group)
+            for i in range(len(BASELINE_METRICS)):
+                flat[i * 3:i * 3 + 3] = combine_moments(*flat[i * 3:i * 3 + 3], *batch_flat[i * 3:i * 3 + 3])
+            staged[group] = flat
+        return staged
+
+    def commit(self, staged: dict):
+        """Adopt groups staged by score() or merge(), once they are saved"""
+        self.moments.update(staged)
+
+    @staticmethod
+    def state_fields(staged: dict) -> dict:
+        """Staged groups as the Redis hash fields they are saved to"""
+        return {group: json.dumps(flat) for group, flat in staged.items()}
+
+    def rows(self) -> list:
+        """(zone, hour, then mean and std per metric) per group; std is None while a metric's baseline is too young"""
+        rows = []
+        for group, flat in self.moments.items():
+            zone, hour = (int(part) for part in group.split(':'))
+            row = [zone, hour]
+            for i, metric in enumerate(BASELINE_METRICS):
+                count, mean, m2 = flat[i * 3:i * 3 + 3]
+                row += [float(mean), baseline_std(count, m2, MIN_STD[metric])]
+            rows.append(tuple(row))
+        return rows
@@ -0,0 +1,247 @@
+"""Fraud scoring parity check and throughput benchmark
+
+Scores the same synthetic trips with the original hard-coded scorer (plus the
+zone-baseline and route rules) and with
+every engine running the shipped fraud_rules.json, fails if any
+fraud_score/fraud_flags differ, and prints rows/sec for each engine.
+
+    python benchmark_scoring.py --rows 200000
+    python benchmark_scoring.py --rows 1000000 --spark   # also native/pandas/udf on local Spark
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from fraud_rules import SCORING_INPUTS, decode_flags, fraud_flag_bits, load_rules, score_record, score_arrays
+from route_norms import route_norms
+
+FRAUD_RULES, _ = load_rules()
+
+
+def legacy_score_trip(trip_distance, fare_amount, tip_amount, passenger_count,
+                      payment_type, PULocationID, DOLocationID, RatecodeID,
+                      airport_fee, duration_min, speed_mph, is_night):
+    """The original hard-coded calculate_fraud_udf; fraud_rules.json must reproduce it"""
+    score, flags = 0, []
+    trip_distance = trip_distance or 0
+    fare_amount = fare_amount or 0
+    tip_amount = tip_amount or 0
+    passenger_count = passenger_count or 0
+    payment_type = payment_type or 0
+    PULocationID = PULocationID or 0
+    DOLocationID = DOLocationID or 0
+    RatecodeID = RatecodeID or 1
+    airport_fee = airport_fee or 0
+    duration_min = duration_min or 0
+    speed_mph = speed_mph or 0
+    is_night = is_night or False
+
+    fare_per_mile = fare_amount / trip_distance if trip_distance > 0 else 0
+    tip_pct = (tip_amount / fare_amount * 100) if fare_amount > 0 else 0
+
+    if speed_mph > 100:
+        score += 30
+        flags.append("impossible_speed")
+    if speed_mph < 2 and duration_min > 10:
+        score += 25
+        flags.append("stationary_trip")
+    if trip_distance == 0 and fare_amount > 0:
+        score += 20
+        flags.append("zero_distance_with_fare")
+    if fare_per_mile > 10.5:
+        score += 20
+        flags.append("fare_too_high")
+    if fare_amount < 0:
+        score += 15
+        flags.append("negative_fare")
+    if payment_type == 1:
+        if tip_amount > fare_amount:
+            score += 25
+            flags.append("tip_exceeds_fare")
+        if tip_pct > 50:
+            score += 15
+            flags.append("excessive_tip")
+    if PULocationID == DOLocationID and fare_amount > 5:
+        score += 25
+        flags.append("same_location_high_fare")
+    if airport_fee > 0 and PULocationID not in [132, 138]:
+        score += 20
+        flags.append("fake_airport_fee")
+    if passenger_count > 6:
+        score += 15
+        flags.append("too_many_passengers")
+    if passenger_count == 0 and fare_amount > 0:
+        score += 10
+        flags.append("zero_passengers")
+    if is_night:
+        score += 5
+        if payment_type == 2:
+            score += 10
+            flags.append("night_cash_trip")
+        if tip_pct > 30:
+            score += 10
+            flags.append("night_high_tip")
+    if RatecodeID == 2 and PULocationID != 132 and DOLocationID != 132:
+        score += 20
+        flags.append("fake_jfk_rate")
+    if payment_type == 6:
+        score += 20
+        flags.append("voided_trip")
+    if payment_type == 4:
+        score += 10
+        flags.append("disputed_trip")
+
+    return (min(score, 100), flags)
+
+
+LEGACY_INPUTS = ['trip_distance', 'fare_amount', 'tip_amount', 'passenger_count', 'payment_type',
+                 'PULocationID', 'DOLocationID', 'RatecodeID', 'airport_fee', 'duration_min',
+                 'speed_mph', 'is_night']
+
+
+def reference_score_trip(trip: dict):
+    """legacy_score_trip plus the zone-baseline and route rules appended to fraud_rules.json"""
+    score, flags = legacy_score_trip(*[trip[name] for name in LEGACY_INPUTS])
+    for flag, weight, column, limit in (('zone_fare_outlier', 20, 'fare_per_mile_z', 3),
+                                        ('zone_speed_outlier', 15, 'speed_mph_z', 4),
+                                        ('zone_tip_outlier', 10, 'tip_pct_z', 4)):
+        if (trip[column] or 0) > limit:
+            score += weight
+            flags.append(flag)
+    if (trip['trip_distance'] or 0) < (trip['min_route_distance'] or 0):
+        score += 25
+        flags.append('route_distance_mismatch')
+    return (min(score, 100), flags)
+
+
+def generate_trips(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Synthetic scorer inputs that hit every rule, including nulls and zeros"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'trip_distance': np.round(rng.choice([0.0, 0.3, 2.5, 8.0, 40.0], rows) * rng.uniform(0.5, 1.5, rows), 2),
+        'fare_amount': np.round(rng.uniform(-5, 120, rows), 2),
+        'tip_amount': np.round(rng.uniform(0, 60, rows), 2),
+        'passenger_count': rng.integers(0, 9, rows),
+        'payment_type': rng.integers(0, 7, rows),
+        'PULocationID': rng.choice([132, 138, 161, 162, 230], rows),
+        'DOLocationID': rng.choice([132, 138, 161, 162, 230], rows),
+        'RatecodeID': rng.integers(0, 7, rows),
+        'airport_fee': rng.choice([0.0, 0.0, 1.75], rows),
+        'duration_min': np.round(rng.uniform(-2, 90, rows), 2),
+        'is_night': rng.random(rows) < 0.3,
+    })
+    df['speed_mph'] = np.where(df['duration_min'] > 0, df['trip_distance'] / df['duration_min'] * 60, 0.0)
+    for name in ('fare_per_mile_z', 'speed_mph_z', 'tip_pct_z'):
+        df[name] = np.round(rng.normal(0, 2.5, rows), 2)
+    for name, values in route_norms(df['PULocationID'], df['DOLocationID']).items():
+        df[name] = values
+
+    # Sprinkle nulls over every input so the fallback handling is exercised
+    for name in SCORING_INPUTS:
+        nulls = rng.random(rows) < 0.02
+        if df[name].dtype == bool:
+            df[name] = df[name].astype(object)
+        elif df[name].dtype.kind == 'i':
+            df[name] = df[name].astype('Int64')
+        df.loc[nulls, name] = None
+    return df[list(SCORING_INPUTS)]
+
+
+def reference_scores(df: pd.DataFrame):
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    return [reference_score_trip(record) for record in records]
+
+
+def check_parity(engine: str, expected, scores, flags):
+    """flags are fraud_flags masks; the reference names are compared in bit order"""
+    flag_bits = fraud_flag_bits(FRAUD_RULES)
+    bit_order = {flag: bit for bit, flag in flag_bits.items()}
+    mismatches = [i for i, (score, flag_list) in enumerate(expected)
+                  if score != scores[i]
+                  or sorted(flag_list, key=bit_order.get) != decode_flags(int(flags[i]), flag_bits)]
+    if mismatches:
+        i = mismatches[0]
+        print(f"❌ {engine}: {len(mismatches)} mismatches, first at row {i}: "
+              f"expected {expected[i]}, got ({scores[i]}, {decode_flags(int(flags[i]), flag_bits)})")
+        return False
+    print(f"✅ {engine}: identical fraud_score and fraud_flags on {len(expected):,} rows")
+    return True
+
+
+def report(engine: str, rows: int, seconds: float):
+    print(f"   {engine:<10} {rows / seconds:>14,.0f} rows/sec  ({seconds:.3f}s)")
+
+
+def run_spark(df: pd.DataFrame, expected, repeat: int = 3) -> bool:
+    from pyspark.sql import SparkSession
+    from pyspark.sql.types import StructType, StructField, DoubleType, IntegerType, BooleanType
+    import fraud_detector
+
+    spark = (SparkSession.builder
+        .appName("Fraud Scoring Benchmark")
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+        .getOrCreate())
+    spark.sparkContext.setLogLevel("WARN")
+
+    schema = StructType([
+        StructField(name, BooleanType() if isinstance(fallback, bool)
+                    else DoubleType() if isinstance(fallback, float) else IntegerType(), True)
+        for name, fallback in SCORING_INPUTS.items()
+    ])
+    records = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    sdf = spark.createDataFrame(list(records), schema).cache()
+    sdf.count()
+
+    ok = True
+    for engine in ('native', 'pandas', 'udf'):
+        scored = fraud_detector.score_fraud(sdf, FRAUD_RULES, engine)
+        # Best of a few runs so JIT warm-up and Python worker start-up don't skew the numbers
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            scored.select('fraud_score', 'fraud_flags').write.format('noop').mode('overwrite').save()
+            timings.append(time.perf_counter() - start)
+        report(engine, len(df), min(timings))
+
+        rows = scored.select('fraud_score', 'fraud_flags').collect()
+        ok &= check_parity(f"spark/{engine}", expected,
+                           [r.fraud_score for r in rows], [r.fraud_flags for r in rows])
+    spark.stop()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fraud scoring parity check and benchmark')
+    parser.add_argument('--rows', type=int, default=200_000, help='Number of synthetic trips')
+    parser.add_argument('--spark', action='store_true', help='Also benchmark the Spark engines locally')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per Spark engine (best is reported)')
+    args = parser.parse_args()
+
+    df = generate_trips(args.rows)
+    print(f"Scoring {args.rows:,} synthetic trips")
+
+    start = time.perf_counter()
+    expected = reference_scores(df)
+    report('reference', args.rows, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    records = df.astype(object).where(df.notna(), None).to_dict('records')
+    results = [score_record(record, FRAUD_RULES) for record in records]
+    report('record', args.rows, time.perf_counter() - start)
+    ok = check_parity('record', expected, [r[0] for r in results], [r[1] for r in results])
+
+    start = time.perf_counter()
+    scores, flags = score_arrays({name: df[name] for name in SCORING_INPUTS}, FRAUD_RULES)
+    report('numpy', args.rows, time.perf_counter() - start)
+    ok &= check_parity('numpy', expected, scores, flags)
+    if args.spark:
+        ok &= run_spark(df, expected, args.repeat)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Trip wire format benchmark: JSON vs header + Avro
+
+Encodes the same API-shaped trip messages in both formats with the producer's
+serializers and prints bytes per message (raw and gzip-compressed per Kafka
+batch) and encode throughput. With --spark it also times decoding on local
+Spark: the original full-schema from_json, decode_trips on JSON, and (with
+--avro, needs the spark-avro package) decode_trips on Avro.
+
+    python benchmark_wire.py --rows 200000
+    python benchmark_wire.py --rows 500000 --spark --avro
+"""
+
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+from wire_format import encode_json, AvroTripEncoder  # noqa: E402
+
+# Messages per producer batch when estimating compressed Kafka bytes
+KAFKA_BATCH = 500
+
+
+def generate_messages(rows: int, seed: int = 42) -> list:
+    """Trip dicts as the API hands them to the producer"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 15, 6, 0, 0)
+    messages = []
+    for _ in range(rows):
+        pickup = start + timedelta(seconds=rng.randint(0, 86400))
+        distance = round(rng.uniform(0.3, 20), 2)
+        fare = round(3 + distance * 2.5, 2)
+        tip = round(fare * rng.choice([0, 0.15, 0.2]), 2)
+        messages.append({
+            'VendorID': rng.choice([1, 2]),
+            'tpep_pickup_datetime': pickup.isoformat(),
+            'tpep_dropoff_datetime': (pickup + timedelta(minutes=rng.randint(3, 60))).isoformat(),
+            'passenger_count': rng.randint(1, 4),
+            'trip_distance': distance,
+            'RatecodeID': 1,
+            'store_and_fwd_flag': 'N',
+            'PULocationID': rng.randint(1, 265),
+            'DOLocationID': rng.randint(1, 265),
+            'payment_type': rng.choice([1, 2]),
+            'fare_amount': fare,
+            'extra': 1.0,
+            'mta_tax': 0.5,
+            'tip_amount': tip,
+            'tolls_amount': 0.0,
+            'improvement_surcharge': 1.0,
+            'total_amount': round(fare + tip + 2.5, 2),
+            'congestion_surcharge': 2.5,
+            'airport_fee': 0.0,
+            'cbd_congestion_fee': 0.75,
+            'trip_id': str(uuid.uuid4()),
+            'received_at': datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        })
+    return messages
+
+
+def encode_all(name: str, serializer, messages: list) -> list:
+    start = time.perf_counter()
+    values = [serializer(message) for message in messages]
+    seconds = time.perf_counter() - start
+    raw = sum(len(v) for v in values)
+    compressed = sum(len(gzip.compress(b''.join(values[i:i + KAFKA_BATCH])))
+                     for i in range(0, len(values), KAFKA_BATCH))
+    print(f"   {name:<6} {raw / len(values):>7.1f} B/msg  {compressed / len(values):>6.1f} B/msg gzip  "
+          f"{len(values) / seconds:>10,.0f} msgs/sec encode")
+    return values
+
+
+def run_spark(values_by_format: dict, avro: bool, repeat: int):
+    from pyspark.sql import SparkSession
+    from pyspark.sql.functions import col, from_json
+    import fraud_detector
+
+    builder = SparkSession.builder.appName("Wire Format Benchmark")
+    if avro:
+        builder = builder.config("spark.jars.packages", "org.apache.spark:spark-avro_2.13:4.0.1")
+    spark = builder.getOrCreate()
+    spark.sparkContext.setLogLevel("WARN")
+
+    frames = {name: spark.createDataFrame([(v,) for v in values], 'value binary').cache()
+              for name, values in values_by_format.items()}
+    for df in frames.values():
+        df.count()
+
+    cases = [
+        ('json/from_json (before)', frames['json'], lambda df: df
+            .selectExpr("CAST(value AS STRING) as json_str")
+            .select(from_json(col("json_str"), fraud_detector.trip_schema).alias("data"))
+            .select("data.*")),
+        ('json/decode_trips', frames['json'], lambda df: fraud_detector.decode_trips(df, ['json'])),
+    ]
+    if avro:
+        cases.append(('avro/decode_trips', frames['avro'], lambda df: fraud_detector.decode_trips(df, ['avro'])))
+
+    rows = len(values_by_format['json'])
+    for name, df, decode in cases:
+        decoded = decode(df)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decoded.write.format('noop').mode('overwrite').save()
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        print(f"   {name:<24} {rows / seconds:>12,.0f} rows/sec decode  ({seconds:.3f}s)")
+    spark.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trip wire format benchmark')
+    parser.add_argument('--rows', type=int, default=200_000, help='Number of synthetic trips')
+    parser.add_argument('--spark', action='store_true', help='Also time decoding on local Spark')
+    parser.add_argument('--avro', action='store_true', help='Include Avro decoding (pulls spark-avro)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per decoder (best is reported)')
+    args = parser.parse_args()
+
+    messages = generate_messages(args.rows)
+    print(f"Encoding {args.rows:,} trip messages")
+    values = {
+        'json': encode_all('json', encode_json, messages),
+        'avro': encode_all('avro', AvroTripEncoder(), messages),
+    }
+    if args.spark:
+        run_spark(values, args.avro, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Parquet bronze landing sink for scored trips (and the fraud alert archive)
+
+Every micro-batch lands as one Parquet file per pickup hour it touches:
+
+    <path>/pickup_date=2026-01-15/pickup_hour=8/<query id>-b0000001234-000.parquet
+
+Rows are first written to <path>/_staging (ignored by Spark, pyarrow and
+DuckDB, which skip '_' prefixed paths) and then renamed into place under a name
+derived from the streaming batch id, so a replayed batch replaces its own files
+instead of adding a second copy.
+
+Once an hour is behind the event-time watermark its small files are compacted
+into files of up to the target size, named after the batch range they cover
+(<query id>-c<first>-<last>.parquet). The compacted file is renamed into place
+before its inputs are deleted; a file whose batches are covered by a compacted
+file is a leftover of an interrupted compaction and is removed on the next
+pass, so readers may briefly see duplicates but never miss rows.
+
+Driver-side only: files are moved with the Hadoop FileSystem API so the same
+code works on local disk, HDFS and object stores.
+
+    python bronze_sink.py /data/bronze/trips            # compact every hour
+    python bronze_sink.py /data/bronze/trips --before 2026-01-15T00:00:00
+    python bronze_sink.py /data/alerts --sort PULocationID,fraud_score,pickup_time --row-group-mb 1
+"""
+
+import argparse
+import logging
+import re
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+PARTITION_COLUMNS = ("pickup_date", "pickup_hour")
+# Sort key inside each file, so zone filters can skip row groups
+SORT_COLUMNS = ("PULocationID", "tpep_pickup_datetime")
+STAGING_DIR = "_staging"
+FILE_PATTERN = re.compile(
+    r"^(?P<query>.+?)-(?:b(?P<batch>\d{10})-\d{3}|c(?P<first>\d{10})-(?P<last>\d{10}))\.parquet$")
+
+
+def batch_file_name(query_id: str, batch_id: int, index: int) -> str:
+    return f"{query_id}-b{batch_id:010d}-{index:03d}.parquet"
+
+
+def compacted_file_name(query_id: str, first: int, last: int) -> str:
+    return f"{query_id}-c{first:010d}-{last:010d}.parquet"
+
+
+def hour_end(date: str, hour: str):
+    """End of a partition's pickup hour, or None for the null-pickup partition"""
+    try:
+        return datetime.strptime(date, '%Y-%m-%d') + timedelta(hours=int(hour) + 1)
+    except ValueError:
+        return None
+
+
+class BronzeSink:
+    """Lands scored micro-batches as hour-partitioned Parquet and compacts closed hours"""
+
+    def __init__(self, spark, path: str, target_file_mb: int = 128, compact_min_files: int = 8,
+                 sort_columns=SORT_COLUMNS, row_group_mb: int = None):
+        self.spark = spark
+        self.path = path.rstrip('/')
+        self.target_bytes = target_file_mb * 1024 * 1024
+        self.compact_min_files = compact_min_files
+        self.sort_columns = list(sort_columns)
+        # Smaller row groups than Parquet's default let readers skip more of a file
+        self.write_options = {"parquet.block.size": str(row_group_mb * 1024 * 1024)} if row_group_mb else {}
+        jvm = spark.sparkContext._jvm
+        self._Path = jvm.org.apache.hadoop.fs.Path
+        self.fs = self._Path(self.path).getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+        # Partitions written since they were last compacted, and those compacted once already
+        self.pending = set()
+        self.compacted = set()
+        self._resumed = False
+
+    def _partition_dir(self, partition) -> str:
+        date, hour = partition
+        return f"{self.path}/pickup_date={date}/pickup_hour={hour}"
+
+    def _list(self, path: str):
+        p = self._Path(path)
+        return list(self.fs.listStatus(p)) if self.fs.exists(p) else []
+
+    def _parquet_files(self, partition) -> list:
+        """(name, size, query, first batch, last batch) of the sink's files in a partition"""
+        files = []
+        for status in self._list(self._partition_dir(partition)):
+            match = FILE_PATTERN.match(status.getPath().getName())
+            if not match or status.isDirectory():
+                continue
+            first = int(match['batch'] if match['batch'] else match['first'])
+            last = int(match['batch'] if match['batch'] else match['last'])
+            files.append((match.group(0), status.getLen(), match['query'], first, last))
+        return files
+
+    def _is_covered(self, partition, query_id: str, batch_id: int) -> bool:
+        return any(query == query_id and name.startswith(f"{query}-c") and first <= batch_id <= last
+                   for name, _, query, first, last in self._parquet_files(partition))
+
+    def _move(self, source, target: str):
+        target_path = self._Path(target)
+        self.fs.mkdirs(target_path.getParent())
+        if self.fs.exists(target_path):
+            self.fs.delete(target_path, False)
+        if not self.fs.rename(source, target_path):
+            raise IOError(f"Could not move {source} to {target}")
+
+    def write_batch(self, trips, batch_id: int, query_id: str) -> int:
+        """Land one micro-batch; returns the number of files written"""
+        staging = f"{self.path}/{STAGING_DIR}/{query_id}/batch-{batch_id}"
+        # One task per pickup hour, so each hour gets a single file per batch
+        (trips
+            .repartition(*PARTITION_COLUMNS)
+            .sortWithinPartitions(*self.sort_columns)
+            .write
+            .options(**self.write_options)
+            .mode("overwrite")
+            .partitionBy(*PARTITION_COLUMNS)
+            .parquet(staging))
+
+        written = 0
+        for date_dir in self._list(staging):
+            if not date_dir.isDirectory():
+                continue
+            for hour_dir in self._list(date_dir.getPath().toString()):
+                partition = (date_dir.getPath().getName().split('=', 1)[1],
+                             hour_dir.getPath().getName().split('=', 1)[1])
+                # A batch replayed after its hour was compacted is already in the table
+                if self._is_covered(partition, query_id, batch_id):
+                    continue
+                parts = sorted((s.getPath() for s in self._list(hour_dir.getPath().toString())
+                                if s.getPath().getName().endswith('.parquet')), key=lambda p: p.getName())
+                for index, source in enumerate(parts):
+                    self._move(source, f"{self._partition_dir(partition)}/"
+                                       f"{batch_file_name(query_id, batch_id, index)}")
+                written += len(parts)
+                self.pending.add(partition)
+        self.fs.delete(self._Path(staging), True)
+        return written
+
+    def compact_closed(self, watermark_ts) -> int:
+        """Compact the written partitions whose pickup hour ended before the watermark"""
+        if watermark_ts is None:
+            return 0
+        if not self._resumed:
+            # Hours that closed while the job was down still hold their batch files
+            since = (watermark_ts - timedelta(days=1)).strftime('%Y-%m-%d')
+            self.pending.update(p for p in self.partitions() if p[0] >= since)
+            self._resumed = True
+        compacted = 0
+        for partition in sorted(self.pending):
+            end = hour_end(*partition)
+            if end is None or end > watermark_ts:
+                continue
+            # Straggling late trips are batched up before an hour is rewritten again
+            min_files = self.compact_min_files if partition in self.compacted else 2
+            compacted += self.compact_partition(partition, min_files)
+            if not any(name.startswith(f"{query}-b") for name, _, query, _, _ in self._parquet_files(partition)):
+                self.pending.discard(partition)
+            self.compacted.add(partition)
+        return compacted
+
+    def compact_partition(self, partition, min_files: int = 2) -> int:
+        """Merge a partition's small files into files of up to the target size; returns files removed"""
+        files = self._parquet_files(partition)
+
+        # Leftovers of an interrupted compaction: covered by another compacted file
+        ranges = [(query, first, last, name) for name, _, query, first, last in files if name.startswith(f"{query}-c")]
+        leftovers = {name for name, _, query, first, last in files
+                     if any(q == query and f <= first and last <= l and n != name for q, f, l, n in ranges)}
+        for name in leftovers:
+            self.fs.delete(self._Path(f"{self._partition_dir(partition)}/{name}"), False)
+
+        removed = len(leftovers)
+        by_query = {}
+        for file in files:
+            if file[0] not in leftovers and file[1] < self.target_bytes:
+                by_query.setdefault(file[2], []).append(file)
+        for query_id, small in by_query.items():
+            if len(small) < min_files:
+                continue
+            small.sort(key=lambda file: file[3])
+            group, size = [], 0
+            for file in small + [None]:
+                if file is None or (group and size + file[1] > self.target_bytes):
+                    if len(group) > 1:
+                        self._rewrite(partition, query_id, group)
+                        removed += len(group)
+                    group, size = [], 0
+                if file is not None:
+                    group.append(file)
+                    size += file[1]
+        return removed
+
+    def _rewrite(self, partition, query_id: str, group: list):
+        directory = self._partition_dir(partition)
+        staging = f"{self.path}/{STAGING_DIR}/compact/{partition[0]}/{partition[1]}"
+        (self.spark.read
+            .option("mergeSchema", "true")
+            .parquet(*[f"{directory}/{file[0]}" for file in group])
+            .coalesce(1)
+            .sortWithinPartitions(*self.sort_columns)
+            .write
+            .options(**self.write_options)
+            .mode("overwrite")
+            .parquet(staging))
+        output = [s.getPath() for s in self._list(staging) if s.getPath().getName().endswith('.parquet')]
+        target = compacted_file_name(query_id, group[0][3], group[-1][4])
+        self._move(output[0], f"{directory}/{target}")
+        for file in group:
+            if file[0] != target:
+                self.fs.delete(self._Path(f"{directory}/{file[0]}"), False)
+        self.fs.delete(self._Path(staging), True)
+        logger.info(f"🗜️ Compacted {len(group)} files into {partition[0]} {partition[1]}h/{target}")
+
+    def partitions(self) -> list:
+        """Every (pickup_date, pickup_hour) partition in the table"""
+        found = []
+        for date_dir in self._list(self.path):
+            name = date_dir.getPath().getName()
+            if date_dir.isDirectory() and name.startswith("pickup_date="):
+                for hour_dir in self._list(date_dir.getPath().toString()):
+                    if hour_dir.isDirectory():
+                        found.append((name.split('=', 1)[1], hour_dir.getPath().getName().split('=', 1)[1]))
+        return found
+
+
+def main():
+    from pyspark.sql import SparkSession
+
+    parser = argparse.ArgumentParser(description='Compact the bronze trip table')
+    parser.add_argument('path', help='Bronze table root (BRONZE_PATH of the streaming job)')
+    parser.add_argument('--before', help='Only hours ending at or before this ISO timestamp')
+    parser.add_argument('--target-mb', type=int, default=128, help='Target file size')
+    parser.add_argument('--sort', default=','.join(SORT_COLUMNS), help='Comma-separated sort columns')
+    parser.add_argument('--row-group-mb', type=int, help='Parquet row group size (default: Parquet\'s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    spark = SparkSession.builder.appName("Bronze Compaction").getOrCreate()
+    sink = BronzeSink(spark, args.path, args.target_mb, sort_columns=args.sort.split(','),
+                      row_group_mb=args.row_group_mb)
+    before = datetime.fromisoformat(args.before) if args.before else None
+    removed = 0
+    for partition in sink.partitions():
+        end = hour_end(*partition)
+        if before is None or (end is not None and end <= before):
+            removed += sink.compact_partition(partition)
+    logger.info(f"✅ Compaction done, {removed} small files merged")
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
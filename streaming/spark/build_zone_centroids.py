@@ -0,0 +1,212 @@
+"""Build zone_centroids.csv from the TLC taxi zone shapefile
+
+The TLC publishes the zone polygons in NY State Plane (feet). For every zone
+this computes the area-weighted centroid of its polygons and the distance from
+that centroid to the zone's farthest vertex (radius_miles), then converts the
+centroid to WGS84:
+
+    LocationID,latitude,longitude,radius_miles
+
+Any point of a zone is within radius_miles of its centroid, which is what lets
+route_norms.py turn centroid distances into a minimum no trip can undercut.
+
+The output is only written when it passes these checks, so a Docker build
+running this script fails instead of shipping a partial or wrong file:
+
+- every zone of the zone lookup with a borough has a centroid;
+- the shapefile's borough and zone name for each id match the lookup;
+- each centroid lies within its borough's bounding box;
+- a few well-known zone pairs are the distance apart they should be.
+
+    python build_zone_centroids.py [--shapefile taxi_zones.zip] [--output zone_centroids.csv]
+
+Needs pyshp and pyproj, which the detectors themselves do not.
+"""
+
+import argparse
+import csv
+import io
+import math
+import os
+import sys
+import urllib.request
+import zipfile
+
+import shapefile
+from pyproj import CRS, Transformer
+
+from route_norms import EARTH_RADIUS_MILES, ZONE_CENTROIDS_PATH, build_route_norms
+from trip_events import ZONE_LOOKUP_PATH
+
+TAXI_ZONES_URL = 'https://d37ci6vzurychx.cloudfront.net/misc/taxi_zones.zip'
+FEET_PER_MILE = 5280
+# Lookup boroughs without polygons (264 Unknown, 265 Outside of NYC)
+NO_GEOMETRY_BOROUGHS = ('Unknown', 'N/A')
+# Generous (min latitude, max latitude, min longitude, max longitude) per borough
+BOROUGH_BOUNDS = {
+    'EWR': (40.66, 40.72, -74.20, -74.14),
+    'Manhattan': (40.68, 40.89, -74.03, -73.90),
+    'Bronx': (40.78, 40.92, -73.94, -73.76),
+    'Brooklyn': (40.56, 40.74, -74.05, -73.83),
+    'Queens': (40.54, 40.81, -73.97, -73.70),
+    'Staten Island': (40.49, 40.65, -74.26, -74.04),
+}
+# (pickup, dropoff, min miles, max miles) between centroids
+SPOT_CHECKS = [
+    (43, 161, 0.8, 2.0),     # Central Park -> Midtown Center
+    (4, 79, 0.2, 1.0),       # Alphabet City -> East Village
+    (236, 237, 0.4, 1.5),    # Upper East Side North -> South
+    (132, 161, 11.0, 14.5),  # JFK Airport -> Midtown Center
+    (138, 230, 5.0, 8.0),    # LaGuardia Airport -> Times Sq/Theatre District
+    (1, 230, 9.5, 13.0),     # Newark Airport -> Times Sq/Theatre District
+]
+# Neighbouring zones, whose minimum route distance must be 0
+ADJACENT_PAIRS = [(43, 236), (4, 79), (161, 230), (236, 237)]
+
+
+def read_shapefile(source: str):
+    """shapefile.Reader over the .shp/.dbf in a zip file (path or URL) and the CRS of its .prj"""
+    if source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(source, timeout=60) as response:
+            data = response.read()
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        members = {os.path.splitext(name)[1].lower(): name for name in archive.namelist()
+                   if not name.startswith('__MACOSX')}
+        missing = [ext for ext in ('.shp', '.dbf', '.prj') if ext not in members]
+        if missing:
+            raise ValueError(f"{source} has no {', '.join(missing)} file")
+        files = {ext: io.BytesIO(archive.read(members[ext])) for ext in ('.shp', '.dbf')}
+        crs = CRS.from_wkt(archive.read(members['.prj']).decode())
+    return shapefile.Reader(shp=files['.shp'], dbf=files['.dbf']), crs
+
+
+def ring_moments(points: list):
+    """Signed area and area-weighted centroid sums of a ring (shoelace)"""
+    area = cx = cy = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        cross = x0 * y1 - x1 * y0
+        area += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+    return area / 2, cx / 6, cy / 6
+
+
+def zone_geometry(shapes: list):
+    """(x, y, radius) in the shapefile's units for all the rings of a zone's shapes.
+
+    Holes wind the other way, so their signed areas subtract themselves.
+    """
+    area = cx = cy = 0.0
+    points = []
+    for shape in shapes:
+        bounds = list(shape.parts) + [len(shape.points)]
+        for start, end in zip(bounds, bounds[1:]):
+            ring = [tuple(point[:2]) for point in shape.points[start:end]]
+            a, x, y = ring_moments(ring)
+            area, cx, cy = area + a, cx + x, cy + y
+            points += ring
+    x, y = cx / area, cy / area
+    return x, y, max(math.hypot(px - x, py - y) for px, py in points)
+
+
+def normalize(name: str) -> str:
+    return ''.join(ch for ch in name.casefold() if ch.isalnum())
+
+
+def build_centroids(reader, crs: CRS) -> dict:
+    """LocationID -> (latitude, longitude, radius_miles, borough, zone name)"""
+    fields = [field[0] for field in reader.fields[1:]]
+    # The shapefile repeats LocationID 56 and 103 for split zones; OBJECTID is
+    # the id the zone lookup uses
+    id_field = 'OBJECTID' if 'OBJECTID' in fields else 'LocationID'
+    zones = {}
+    for record in reader.iterShapeRecords():
+        row = dict(zip(fields, record.record))
+        zones.setdefault(int(row[id_field]), []).append((record.shape, row['borough'], row['zone']))
+    feet = crs.axis_info[0].unit_conversion_factor / 0.3048
+    to_wgs84 = Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+    centroids = {}
+    for zone, parts in zones.items():
+        x, y, radius = zone_geometry([shape for shape, _, _ in parts])
+        longitude, latitude = to_wgs84.transform(x, y)
+        centroids[zone] = (latitude, longitude, radius * feet / FEET_PER_MILE, parts[0][1], parts[0][2])
+    return centroids
+
+
+def read_lookup(path: str) -> dict:
+    with open(path, newline='') as f:
+        return {int(row['LocationID']): (row['Borough'], row['Zone']) for row in csv.DictReader(f)}
+
+
+def great_circle_miles(a, b) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+
+
+def check_centroids(centroids: dict, lookup: dict) -> list:
+    """Problems that make the centroids unfit to ship; empty when they pass"""
+    problems = []
+    for zone, (borough, name) in sorted(lookup.items()):
+        if borough in NO_GEOMETRY_BOROUGHS:
+            continue
+        if zone not in centroids:
+            problems.append(f"zone {zone} ({name}, {borough}) has no polygon")
+            continue
+        latitude, longitude, _, shape_borough, shape_name = centroids[zone]
+        if shape_borough != borough:
+            problems.append(f"zone {zone} ({name}) is in {shape_borough} in the shapefile, {borough} in the lookup")
+        if normalize(shape_name) != normalize(name):
+            problems.append(f"zone {zone} is '{shape_name}' in the shapefile, '{name}' in the lookup")
+        lat_min, lat_max, lon_min, lon_max = BOROUGH_BOUNDS.get(borough, (0, 0, 0, 0))
+        if not (lat_min <= latitude <= lat_max and lon_min <= longitude <= lon_max):
+            problems.append(f"zone {zone} ({name}) centroid {latitude:.4f},{longitude:.4f} is outside {borough}")
+    for zone in sorted(set(centroids) - set(lookup)):
+        problems.append(f"zone {zone} ({centroids[zone][4]}) is not in the lookup")
+    if problems:
+        return problems
+
+    for pickup, dropoff, low, high in SPOT_CHECKS:
+        miles = great_circle_miles(centroids[pickup], centroids[dropoff])
+        if not low <= miles <= high:
+            problems.append(f"zones {pickup} -> {dropoff} are {miles:.2f} mi apart, expected {low}-{high}")
+    min_distance, _ = build_route_norms({zone: values[:3] for zone, values in centroids.items()})
+    for pickup, dropoff in ADJACENT_PAIRS:
+        if min_distance[pickup, dropoff] != 0:
+            problems.append(f"neighbouring zones {pickup} -> {dropoff} have a minimum route distance of "
+                            f"{min_distance[pickup, dropoff]:.2f} mi")
+    return problems
+
+
+def write_centroids(centroids: dict, path: str):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['LocationID', 'latitude', 'longitude', 'radius_miles'])
+        for zone, (latitude, longitude, radius, _, _) in sorted(centroids.items()):
+            writer.writerow([zone, f"{latitude:.6f}", f"{longitude:.6f}", f"{radius:.3f}"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shapefile', default=TAXI_ZONES_URL, help="taxi_zones.zip, as a path or URL")
+    parser.add_argument('--lookup', default=ZONE_LOOKUP_PATH, help="taxi_zone_lookup.csv to check against")
+    parser.add_argument('--output', default=ZONE_CENTROIDS_PATH)
+    args = parser.parse_args()
+
+    reader, crs = read_shapefile(args.shapefile)
+    centroids = build_centroids(reader, crs)
+    problems = check_centroids(centroids, read_lookup(args.lookup))
+    if problems:
+        print(f"❌ {len(problems)} problems with the zone centroids, {args.output} not written:", file=sys.stderr)
+        for problem in problems:
+            print(f"   {problem}", file=sys.stderr)
+        sys.exit(1)
+    write_centroids(centroids, args.output)
+    print(f"✅ Wrote {len(centroids)} zone centroids to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
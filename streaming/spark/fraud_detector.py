@@ -1,25 +1,84 @@
 """Spark Streaming Job for NYC Taxi Fraud Detection"""
 
+from pyspark import AccumulatorParam, TaskContext
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, from_json, when, hour, unix_timestamp, udf
+from pyspark.sql.functions import (
+    col, from_json, to_json, when, hour, unix_timestamp, udf, pandas_udf,
+    lit, coalesce, least, array, date_format, substring, expr,
+    struct, concat, broadcast, avg, count, var_pop, isnan, nanvl, sha2
+)
+from pyspark.sql.avro.functions import from_avro, to_avro
 from pyspark.sql.types import (
     StructType, StructField, StringType, IntegerType,
-    DoubleType, TimestampType, ArrayType
+    LongType, DoubleType, TimestampType
 )
 import pandas as pd
-import redis
 import json
 import logging
 import os
-from datetime import datetime
+from functools import reduce
+
+from fraud_rules import (
+    SCORING_INPUTS, COMPARISONS, MAX_FRAUD_SCORE, FRAUD_RULES_PATH,
+    RuleTable, fraud_flag_bits, score_record, score_arrays
+)
+from quantile_sketch import SKETCH_METRICS, bucket_sql
+from baselines import BASELINE_METRICS, MISSING_KEY, ZoneBaselines, group_key, z_column
+from stream_control import EventTimeWatermark, OffsetCapController, catchup_options, parse_delay
+from trip_events import (
+    CONSUMED_FIELDS, TIMESTAMP_FIELDS, TRIP_WIRE_VERSIONS, UNKNOWN_ZONE, WIRE_MAGIC, ZONE_FIELDS,
+    ZONE_LOOKUP_PATH, load_trip_avro_schema, read_zone_lookup
+)
+from bronze_sink import BronzeSink
+from alert_archive import ARCHIVE_SORT_COLUMNS
+from route_norms import ROUTE_NORM_COLUMNS, ZONE_CENTROIDS_PATH, known_route_pairs, load_route_norms
+from redis_sink import (
+    REDIS_HOST, REDIS_PORT, RedisClient, write_batch, group_alerts, aggregate_rows,
+    new_batch_metrics, day_metrics, add_to_leaderboard, add_to_od_matrix
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
 KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'nyc.taxi.trips.raw')
-REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
-REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+# Wire formats accepted on the topic; each message says which one it uses
+KAFKA_WIRE_FORMATS = os.getenv('KAFKA_WIRE_FORMATS', 'json,avro').split(',')
+# driver: aggregate in Spark and write from the driver, partition: each executor
+# task pre-aggregates its partition and writes to Redis itself
+REDIS_SINK_MODE = os.getenv('REDIS_SINK_MODE', 'driver')
+# native: Spark column expressions, pandas: Arrow-backed pandas UDF, udf: legacy row-at-a-time UDF
+FRAUD_ENGINE = os.getenv('FRAUD_ENGINE', 'native')
+# Declarative rule file, re-read between micro-batches when it changes
+FRAUD_RULES_FILE = os.getenv('FRAUD_RULES_PATH', FRAUD_RULES_PATH)
+# How far behind the latest pickup a trip may arrive and still update its windows.
+# Trips are sent when they end, so this covers the longest trip plus delivery delays.
+EVENT_TIME_WATERMARK = os.getenv('EVENT_TIME_WATERMARK', '3 hours')
+CHECKPOINT_DIR = os.getenv('CHECKPOINT_DIR', '/tmp/checkpoint/fraud_detector')
+TRIGGER_INTERVAL = os.getenv('TRIGGER_INTERVAL', '5 seconds')
+# Micro-batches are capped so one trigger stays within this budget; the cap
+# starts at INITIAL_OFFSETS_PER_TRIGGER and is tuned between the min and max
+BATCH_LATENCY_BUDGET = os.getenv('BATCH_LATENCY_BUDGET', TRIGGER_INTERVAL)
+INITIAL_OFFSETS_PER_TRIGGER = int(os.getenv('INITIAL_OFFSETS_PER_TRIGGER', 20000))
+MIN_OFFSETS_PER_TRIGGER = int(os.getenv('MIN_OFFSETS_PER_TRIGGER', 1000))
+MAX_OFFSETS_PER_TRIGGER = int(os.getenv('MAX_OFFSETS_PER_TRIGGER', 500000))
+# earliest, JSON offsets or an ISO timestamp: replay from there back-to-back
+# (no trigger interval) into a fresh CHECKPOINT_DIR, then continue live
+CATCHUP_FROM = os.getenv('CATCHUP_FROM', '')
+# Scored trips are published here, keyed by pickup zone (empty = off), as
+# json or avro (header + datum of schemas/trip_scored.v<version>.avsc)
+SCORED_KAFKA_TOPIC = os.getenv('SCORED_KAFKA_TOPIC', 'nyc.taxi.trips.scored')
+SCORED_WIRE_FORMAT = os.getenv('SCORED_WIRE_FORMAT', 'avro')
+# Every scored trip is also landed here as Parquet partitioned by pickup date
+# and hour (empty = off); closed hours are compacted towards the target size
+BRONZE_PATH = os.getenv('BRONZE_PATH', '')
+BRONZE_TARGET_FILE_MB = int(os.getenv('BRONZE_TARGET_FILE_MB', 128))
+BRONZE_COMPACT_MIN_FILES = int(os.getenv('BRONZE_COMPACT_MIN_FILES', 8))
+# Every fraud alert is archived here the same way (empty = off), in small
+# row groups so the query API in alert_archive.py can skip most of them
+ALERT_ARCHIVE_PATH = os.getenv('ALERT_ARCHIVE_PATH', '')
+ALERT_ARCHIVE_TARGET_FILE_MB = int(os.getenv('ALERT_ARCHIVE_TARGET_FILE_MB', 64))
+ALERT_ARCHIVE_ROW_GROUP_MB = int(os.getenv('ALERT_ARCHIVE_ROW_GROUP_MB', 1))
 
 trip_schema = StructType([
     StructField("trip_id", StringType(), True),
@@ -47,163 +106,476 @@ trip_schema = StructType([
 ])
 
 
-class RedisClient:
-    def __init__(self, host=REDIS_HOST, port=REDIS_PORT):
-        self.client = redis.Redis(host=host, port=port, decode_responses=True)
-    
-    def update_metrics(self, metrics: dict):
-        pipe = self.client.pipeline()
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        if 'trip_count' in metrics:
-            pipe.incrby(f"metrics:{today}:trips", int(metrics['trip_count']))
-        if 'total_revenue' in metrics:
-            pipe.incrbyfloat(f"metrics:{today}:revenue", float(metrics['total_revenue']))
-        if 'fraud_count' in metrics:
-            pipe.incrby(f"metrics:{today}:fraud_alerts", int(metrics['fraud_count']))
-        if 'day_trips' in metrics:
-            pipe.incrby(f"metrics:{today}:day_trips", int(metrics['day_trips']))
-        if 'night_trips' in metrics:
-            pipe.incrby(f"metrics:{today}:night_trips", int(metrics['night_trips']))
-        
-        for key in ['trips', 'revenue', 'fraud_alerts', 'day_trips', 'night_trips']:
-            pipe.expire(f"metrics:{today}:{key}", 7 * 24 * 3600)
-        
-        pipe.execute()
-    
-    def add_fraud_alert(self, alert: dict):
-        today = datetime.now().strftime("%Y-%m-%d")
-        self.client.lpush(f"fraud:alerts:{today}", json.dumps(alert))
-        self.client.ltrim(f"fraud:alerts:{today}", 0, 99)
-        self.client.expire(f"fraud:alerts:{today}", 7 * 24 * 3600)
-        
-        zone_id = alert.get('PULocationID', 0)
-        self.client.zincrby("fraud:by_zone", 1, str(zone_id))
-        
-        route = f"{alert.get('PULocationID', 0)}->{alert.get('DOLocationID', 0)}"
-        self.client.zincrby("fraud:by_route", 1, route)
-    
-    def update_hourly_stats(self, hour_val: int, count: int, revenue: float):
-        today = datetime.now().strftime("%Y-%m-%d")
-        self.client.hincrby(f"metrics:{today}:hourly:trips", str(hour_val), count)
-        self.client.hincrbyfloat(f"metrics:{today}:hourly:revenue", str(hour_val), revenue)
-        self.client.expire(f"metrics:{today}:hourly:trips", 7 * 24 * 3600)
-        self.client.expire(f"metrics:{today}:hourly:revenue", 7 * 24 * 3600)
-    
-    def update_zone_stats(self, pickup_zones: dict, dropoff_zones: dict):
-        """Update pickup/dropoff zone statistics"""
-        pipe = self.client.pipeline()
-        for zone_id, count in pickup_zones.items():
-            pipe.zincrby("stats:pickup_zones", count, str(zone_id))
-        for zone_id, count in dropoff_zones.items():
-            pipe.zincrby("stats:dropoff_zones", count, str(zone_id))
-        pipe.execute()
-    
-    def update_payment_stats(self, payment_types: dict):
-        """Update payment type statistics"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        pipe = self.client.pipeline()
-        for ptype, count in payment_types.items():
-            pipe.hincrby(f"stats:{today}:payment_types", str(ptype), count)
-        pipe.expire(f"stats:{today}:payment_types", 7 * 24 * 3600)
-        pipe.execute()
+SCORED_WIRE_VERSION = 2
+# Fields of a published scored trip, in trip_scored.v2.avsc order
+SCORED_FIELDS = CONSUMED_FIELDS + [
+    "duration_min", "speed_mph", "fare_per_mile", "tip_pct", "is_night",
+    "fare_per_mile_z", "speed_mph_z", "tip_pct_z", "fraud_score", "fraud_flags", "on_time"
+]
+
+
+fraud_result_schema = StructType([
+    StructField("fraud_score", IntegerType(), True),
+    StructField("fraud_flags", LongType(), True)
+])
+
+
+def fraud_input_columns() -> dict:
+    """Scorer inputs as Spark columns, with the same null/falsy fallbacks as score_record"""
+    columns = {}
+    for name, fallback in SCORING_INPUTS.items():
+        if fallback:
+            columns[name] = when(col(name).isNull() | (col(name) == 0), lit(fallback)).otherwise(col(name))
+        else:
+            columns[name] = coalesce(col(name), lit(fallback))
+    distance, fare = columns['trip_distance'], columns['fare_amount']
+    columns['fare_per_mile'] = when(distance > 0, fare / distance).otherwise(lit(0.0))
+    columns['tip_pct'] = when(fare > 0, columns['tip_amount'] / fare * 100).otherwise(lit(0.0))
+    return columns
+
+
+def fraud_rule_condition(columns: dict, conditions):
+    """Compile one rule's conditions into a single boolean Spark column"""
+    compiled = []
+    for column, op, value in conditions:
+        left = columns[column]
+        if isinstance(value, dict):
+            value = columns[value['col']]
+        if op == 'in':
+            compiled.append(left.isin(list(value)))
+        elif op == 'not in':
+            compiled.append(~left.isin(list(value)))
+        else:
+            compiled.append(COMPARISONS[op](left, value))
+    return reduce(lambda a, b: a & b, compiled, lit(True))
+
+
+def fraud_columns(rules):
+    """Compile a rule table into (fraud_score, fraud_flags) Spark column expressions"""
+    columns = fraud_input_columns()
+    conditions = [(flag, bit, weight, fraud_rule_condition(columns, conds)) for flag, bit, weight, conds in rules]
+    total = reduce(lambda a, b: a + b,
+                   [when(cond, lit(weight)).otherwise(lit(0)) for _, _, weight, cond in conditions], lit(0))
+    score = least(total, lit(MAX_FRAUD_SCORE)).cast(IntegerType())
+    flags = reduce(lambda a, b: a.bitwiseOR(b),
+                   [when(cond, lit(1 << bit)).otherwise(lit(0)).cast(LongType())
+                    for flag, bit, _, cond in conditions if flag], lit(0).cast(LongType()))
+    return score, flags
+
+
+def make_fraud_pandas_udf(rules):
+    """Arrow-backed pandas UDF scoring whole column batches with NumPy"""
+    names = list(SCORING_INPUTS)
     
-    def update_vendor_stats(self, vendors: dict):
-        """Update vendor statistics"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        pipe = self.client.pipeline()
-        for vendor, count in vendors.items():
-            pipe.hincrby(f"stats:{today}:vendors", str(vendor), count)
-        pipe.expire(f"stats:{today}:vendors", 7 * 24 * 3600)
-        pipe.execute()
+    @pandas_udf(fraud_result_schema)
+    def fraud_pandas_udf(*columns: pd.Series) -> pd.DataFrame:
+        scores, flags = score_arrays(dict(zip(names, columns)), rules)
+        return pd.DataFrame({'fraud_score': scores, 'fraud_flags': flags})
+    return fraud_pandas_udf
 
 
-def process_batch(batch_df, batch_id):
-    if batch_df.isEmpty():
-        return
+def make_fraud_row_udf(rules):
+    """Legacy row-at-a-time Python UDF"""
+    names = list(SCORING_INPUTS)
+    return udf(lambda *values: score_record(dict(zip(names, values)), rules), fraud_result_schema)
+
+
+def score_fraud(df, rules, engine=FRAUD_ENGINE):
+    """Add fraud_score and fraud_flags columns using the selected scoring engine"""
+    if engine == 'native':
+        score, flags = fraud_columns(rules)
+        return df.withColumns({'fraud_score': score, 'fraud_flags': flags})
+    if engine not in ('pandas', 'udf'):
+        raise ValueError(f"Unknown FRAUD_ENGINE '{engine}' (expected native, pandas or udf)")
+    scorer = make_fraud_pandas_udf(rules) if engine == 'pandas' else make_fraud_row_udf(rules)
+    return (df
+        .withColumn("fraud_result", scorer(*[col(name) for name in SCORING_INPUTS]))
+        .withColumn("fraud_score", col("fraud_result.fraud_score"))
+        .withColumn("fraud_flags", col("fraud_result.fraud_flags"))
+        .drop("fraud_result"))
+
+class SinkStatsParam(AccumulatorParam):
+    """Merges per-task sink stats: counters are summed, the latest pickup time is kept"""
     
-    logger.info(f"📦 Processing batch {batch_id} with {batch_df.count()} records")
-    redis_client = RedisClient()
-    pdf = batch_df.toPandas()
+    COUNTERS = ('trips', 'revenue', 'fraud_alerts', 'late_trips', 'commands', 'round_trips')
     
-    # Basic metrics
-    trip_count = len(pdf)
-    total_revenue = float(pdf['total_amount'].sum())
-    day_trips = int(pdf[~pdf['is_night']].shape[0])
-    night_trips = int(pdf[pdf['is_night']].shape[0])
-    fraud_df = pdf[pdf['fraud_score'] >= 50]
-    fraud_count = len(fraud_df)
+    def zero(self, value):
+        return {**dict.fromkeys(self.COUNTERS, 0), 'max_event_time': None}
     
-    redis_client.update_metrics({
-        'trip_count': trip_count,
-        'total_revenue': total_revenue,
-        'fraud_count': fraud_count,
-        'day_trips': day_trips,
-        'night_trips': night_trips
+    def addInPlace(self, a, b):
+        merged = {name: a[name] + b[name] for name in self.COUNTERS}
+        times = [t for t in (a['max_event_time'], b['max_event_time']) if t is not None]
+        merged['max_event_time'] = max(times) if times else None
+        return merged
+
+
+rule_table: RuleTable = None
+watermark: EventTimeWatermark = None
+bronze_sink: BronzeSink = None
+alert_archive: BronzeSink = None
+# Zone baselines of the running query, loaded from Redis on its first batch
+zone_baselines: ZoneBaselines = None
+baselines_query: str = None
+
+
+def with_event_time(df, watermark_ts):
+    """Add the event-time window keys of each trip and whether it is ahead of the watermark"""
+    on_time = col("pickup_ts").isNotNull()
+    if watermark_ts is not None:
+        on_time = on_time & (col("pickup_ts") >= lit(watermark_ts))
+    return df.withColumns({
+        "event_day": date_format("pickup_ts", "yyyy-MM-dd"),
+        "event_minute": date_format("pickup_ts", "HH:mm"),
+        "on_time": coalesce(on_time, lit(False))
     })
+
+
+# Every per-batch counter in one aggregation: each grouping set yields a few
+# small rows tagged with the dimension it belongs to. Time-based counters are
+# grouped by event-time day (and hour/minute) of the pickup, leaderboards by
+# its 10-minute slot, origin-destination pairs by pickup hour, boroughs by day
+# (from the zone join); late trips only
+# show up in late_trips and max_event_time. Zone dimensions come back as the
+# PULocationID/DOLocationID columns, and trips missing the zone a dimension
+# needs are left out of it (they have no OD cell, route or zone to count under).
+BATCH_AGGREGATES_SQL = """
+SELECT * FROM (SELECT
+    CASE WHEN grouping(pickup_hour) = 0 AND grouping(PULocationID) = 0 THEN 'od'
+         WHEN grouping(pickup_hour) = 0 THEN 'hour'
+         WHEN grouping(event_minute) = 0 THEN 'minute'
+         WHEN grouping(payment_type) = 0 THEN 'payment_type'
+         WHEN grouping(VendorID) = 0 THEN 'vendor'
+         WHEN grouping(pickup_borough) = 0 THEN 'borough'
+         WHEN grouping(event_day) = 0 THEN 'day'
+         WHEN grouping(PULocationID) = 0 AND grouping(DOLocationID) = 0 THEN 'route'
+         WHEN grouping(PULocationID) = 0 THEN 'pickup_zone'
+         WHEN grouping(DOLocationID) = 0 THEN 'dropoff_zone'
+         ELSE 'total' END AS dim,
+    event_day,
+    event_slot,
+    pickup_hour,
+    PULocationID,
+    DOLocationID,
+    coalesce(cast(pickup_hour AS string), event_minute, cast(payment_type AS string),
+             cast(VendorID AS string), pickup_borough) AS key,
+    count_if(on_time) AS trips,
+    coalesce(sum(total_amount) FILTER (WHERE on_time), 0D) AS revenue,
+    count_if(on_time AND is_night) AS night_trips,
+    count_if(on_time AND fraud_score >= {threshold}) AS fraud_trips,
+    count_if(NOT on_time) AS late_trips,
+    max(pickup_ts) AS max_event_time
+FROM (SELECT *, concat(event_day, 'T', substr(event_minute, 1, 4), '0') AS event_slot FROM {batch})
+GROUP BY GROUPING SETS ((event_day), (event_day, pickup_hour), (event_day, event_minute),
+                        (event_day, payment_type), (event_day, VendorID), (event_day, pickup_borough),
+                        (event_slot, PULocationID), (event_slot, DOLocationID),
+                        (event_slot, PULocationID, DOLocationID),
+                        (event_day, pickup_hour, PULocationID, DOLocationID), ()))
+-- Only fraudulent routes are ranked, so the route rows stay few
+WHERE (dim != 'route' OR fraud_trips > 0)
+  AND (dim NOT IN ('od', 'route', 'pickup_zone') OR PULocationID IS NOT NULL)
+  AND (dim NOT IN ('od', 'route', 'dropoff_zone') OR DOLocationID IS NOT NULL)
+"""
+
+ALERT_COLUMNS = ['trip_id', 'fraud_score', 'fraud_flags', 'PULocationID', 'DOLocationID',
+                 'fare_amount', 'is_night', 'event_day', 'pickup_ts',
+                 'pickup_zone', 'pickup_borough', 'dropoff_zone', 'dropoff_borough']
+
+
+def aggregate_batch(scored_df, threshold: int) -> dict:
+    """Compute all per-batch metrics inside Spark and collect only the aggregate rows"""
+    rows = scored_df.sparkSession.sql(BATCH_AGGREGATES_SQL, batch=scored_df, threshold=int(threshold)).collect()
     
-    # Fraud alerts
-    for _, row in fraud_df.iterrows():
-        alert = {
-            'trip_id': row['trip_id'],
-            'fraud_score': int(row['fraud_score']),
-            'fraud_flags': list(row['fraud_flags']) if row['fraud_flags'] else [],
-            'PULocationID': int(row['PULocationID']) if pd.notna(row['PULocationID']) else 0,
-            'DOLocationID': int(row['DOLocationID']) if pd.notna(row['DOLocationID']) else 0,
-            'fare_amount': float(row['fare_amount']) if pd.notna(row['fare_amount']) else 0,
-            'is_night': bool(row['is_night']),
-            'timestamp': datetime.now().isoformat()
-        }
-        redis_client.add_fraud_alert(alert)
+    metrics = new_batch_metrics()
+    for row in rows:
+        if row.dim == 'total':
+            metrics['trip_count'] = row.trips
+            metrics['total_revenue'] = float(row.revenue)
+            metrics['fraud_count'] = row.fraud_trips
+            metrics['late_trips'] = row.late_trips
+            metrics['max_event_time'] = row.max_event_time
+        elif not row.trips:
+            continue
+        elif row.dim == 'route':
+            add_to_leaderboard(metrics, 'fraud_route', row.event_slot,
+                               f"{row.PULocationID}->{row.DOLocationID}", row.fraud_trips)
+        elif row.dim == 'od':
+            add_to_od_matrix(day_metrics(metrics, row.event_day), row.pickup_hour,
+                             row.PULocationID, row.DOLocationID, row.trips)
+        elif row.dim in ('pickup_zone', 'dropoff_zone'):
+            zone = row.PULocationID if row.dim == 'pickup_zone' else row.DOLocationID
+            add_to_leaderboard(metrics, row.dim, row.event_slot, zone, row.trips)
+            if row.dim == 'pickup_zone' and row.fraud_trips:
+                add_to_leaderboard(metrics, 'fraud_zone', row.event_slot, zone, row.fraud_trips)
+        elif row.key is None and row.dim != 'day':
+            continue
+        else:
+            day = day_metrics(metrics, row.event_day)
+            if row.dim == 'day':
+                day['trip_count'] = row.trips
+                day['total_revenue'] = float(row.revenue)
+                day['fraud_count'] = row.fraud_trips
+                day['night_trips'] = row.night_trips
+                day['day_trips'] = row.trips - row.night_trips
+            elif row.dim == 'hour':
+                day['hourly'][int(row.key)] = (row.trips, float(row.revenue))
+            elif row.dim == 'minute':
+                day['minutely'][row.key] = (row.trips, float(row.revenue))
+            elif row.dim == 'borough':
+                day['borough'][row.key] = (row.trips, float(row.revenue), row.fraud_trips)
+            else:
+                day[row.dim][int(row.key)] = row.trips
+    return metrics
+
+
+# Spark-side helper columns that duplicate trip fields; event_day is the pickup_date partition
+BRONZE_DROP_COLUMNS = ['pickup_ts', 'dropoff_ts', 'event_minute']
+
+
+def write_bronze(scored_df, batch_id, query_id):
+    """Land the scored batch in the bronze table and compact the hours the watermark closed"""
+    trips = scored_df.drop(*BRONZE_DROP_COLUMNS).withColumnRenamed("event_day", "pickup_date")
+    files = bronze_sink.write_batch(trips, batch_id, query_id)
+    merged = bronze_sink.compact_closed(watermark.current())
+    logger.info(f"🪣 Batch {batch_id}: {files} bronze files written"
+                + (f", {merged} small files compacted" if merged else ""))
+
+
+# Alert archive columns; pickup_time is wall-clock (timestamp_ntz) like the partitions
+ARCHIVE_COLUMNS = ["trip_id", "cast(pickup_ts AS timestamp_ntz) AS pickup_time", "PULocationID", "DOLocationID",
+                   "fraud_score", "fraud_flags", "fare_amount", "total_amount", "trip_distance", "is_night",
+                   "on_time", "event_day AS pickup_date", "pickup_hour"]
+
+
+def write_alert_archive(scored_df, batch_id, query_id):
+    """Append the batch's fraud alerts to the archive and compact the hours the watermark closed"""
+    alerts = scored_df.filter(col("fraud_score") >= rule_table.threshold).selectExpr(*ARCHIVE_COLUMNS)
+    files = alert_archive.write_batch(alerts, batch_id, query_id)
+    merged = alert_archive.compact_closed(watermark.current())
+    if files or merged:
+        logger.info(f"🗄️ Batch {batch_id}: {files} alert archive files written"
+                    + (f", {merged} small files compacted" if merged else ""))
+
+
+# Quantile sketch bucket counts of the on-time trips, per event-time day and
+# pickup hour or pickup zone; Spark merges the partitions' counts, Redis the batches'
+SKETCH_SQL = """
+SELECT event_day, pickup_hour, PULocationID, metric, bucket, count(*) AS n
+FROM (SELECT event_day, pickup_hour, PULocationID, metric, {bucket} AS bucket
+      FROM (SELECT event_day, pickup_hour, PULocationID, stack({metrics}) AS (metric, value)
+            FROM {batch} WHERE on_time))
+WHERE bucket IS NOT NULL
+GROUP BY GROUPING SETS ((event_day, pickup_hour, metric, bucket), (event_day, PULocationID, metric, bucket))
+"""
+
+
+def aggregate_sketches(scored_df, metrics: dict):
+    """Add the batch's quantile sketches to the per-day metrics"""
+    stacked = ', '.join(f"'{metric}', cast({column} AS double)" for metric, column in SKETCH_METRICS.items())
+    query = SKETCH_SQL.format(bucket=bucket_sql("value"), metrics=f"{len(SKETCH_METRICS)}, {stacked}",
+                              batch="{batch}")
+    for row in scored_df.sparkSession.sql(query, batch=scored_df).collect():
+        scope, key = ('hour', row.pickup_hour) if row.pickup_hour is not None else ('zone', row.PULocationID)
+        if key is None:
+            continue
+        sketch = day_metrics(metrics, row.event_day)['sketches'].setdefault(f"{scope}:{key}:{row.metric}", {})
+        sketch[row.bucket] = row.n
+
+
+PARTITION_SINK_COLUMNS = ALERT_COLUMNS + ['total_amount', 'pickup_hour', 'payment_type', 'VendorID',
+                                          'event_minute', 'on_time',
+                                          *[column for column in SKETCH_METRICS.values() if column not in ALERT_COLUMNS]]
+
+
+def write_partition(rows, batch_id, query_id, threshold, host, port, sink_stats):
+    """foreachPartition body: pre-aggregate this partition and write it straight to Redis"""
+    partition_id = TaskContext.get().partitionId()
+    metrics, alerts = aggregate_rows(rows, threshold)
+    if not metrics['trip_count'] and not alerts:
+        sink = {'duplicate': False, 'commands': 0, 'round_trips': 0}
+    else:
+        redis_client = RedisClient(host, port)
+        write_batch(redis_client, metrics, alerts)
+        sink = redis_client.flush(dedupe_key=f"sink:{query_id}:{batch_id}:{partition_id}")
+    if not sink['duplicate']:
+        sink_stats.add({'trips': metrics['trip_count'], 'revenue': metrics['total_revenue'],
+                        'fraud_alerts': metrics['fraud_count'], 'late_trips': metrics['late_trips'],
+                        'commands': sink['commands'], 'round_trips': sink['round_trips'],
+                        'max_event_time': metrics['max_event_time']})
+
+
+def process_batch(batch_df, batch_id):
+    global zone_baselines, baselines_query
+    # Scoring happens per batch (not in the streaming plan) so rule edits take
+    # effect on the next trigger without restarting the query
+    rule_table.reload_if_changed()
+    # Stable across restarts from the same checkpoint, so replayed batches dedupe
+    query_id = batch_df.sparkSession.sparkContext.getLocalProperty("sql.streaming.queryId") or "batch"
+    if baselines_query != query_id:
+        zone_baselines = ZoneBaselines(RedisClient().get_consumer_state(baselines_key(query_id)))
+        baselines_query = query_id
+    trips = with_zone_baselines(batch_df, load_baselines(batch_df.sparkSession, zone_baselines))
+    scored_df = with_event_time(score_fraud(trips, rule_table.rules), watermark.current())
     
-    # Hourly stats
-    if 'pickup_hour' in pdf.columns:
-        for hr, group in pdf.groupby('pickup_hour'):
-            if pd.notna(hr):
-                redis_client.update_hourly_stats(int(hr), len(group), float(group['total_amount'].sum()))
+    # The sinks and the baseline update each read the scored batch
+    scored_df = scored_df.persist()
+    try:
+        if bronze_sink is not None:
+            write_bronze(scored_df, batch_id, query_id)
+        if alert_archive is not None:
+            write_alert_archive(scored_df, batch_id, query_id)
+        if SCORED_KAFKA_TOPIC:
+            publish_scored(scored_df, batch_id, query_id)
+        write_redis(scored_df, batch_id, query_id)
+        # Last, so a batch replayed after a failed sink is scored against the same baselines
+        update_baselines(scored_df, batch_id, query_id)
+    finally:
+        scored_df.unpersist()
+
+
+def write_redis(scored_df, batch_id, query_id):
+    if REDIS_SINK_MODE == 'partition':
+        sink_stats = scored_df.sparkSession.sparkContext.accumulator(SinkStatsParam().zero(None), SinkStatsParam())
+        threshold = rule_table.threshold
+        (scored_df
+            .select(*PARTITION_SINK_COLUMNS)
+            .foreachPartition(lambda rows: write_partition(rows, batch_id, query_id, threshold,
+                                                           REDIS_HOST, REDIS_PORT, sink_stats)))
+        stats = sink_stats.value
+        redis_client = RedisClient()
+        redis_client.update_flag_names(fraud_flag_bits(rule_table.rules))
+        if watermark.advance(stats['max_event_time']):
+            redis_client.update_watermark(watermark.max_event_time, watermark.current())
+        redis_client.flush(dedupe_key=f"sink:{query_id}:{batch_id}:driver")
+        if stats['trips'] or stats['late_trips']:
+            logger.info(f"✅ Batch {batch_id}: {stats['trips']} trips, ${stats['revenue']:.2f}, "
+                        f"{stats['fraud_alerts']} fraud alerts, {stats['late_trips']} late "
+                        f"(Redis: {stats['commands']} commands in {stats['round_trips']} round trips from executors)")
+        return
     
-    # Zone stats
-    pickup_zones = pdf['PULocationID'].value_counts().to_dict()
-    dropoff_zones = pdf['DOLocationID'].value_counts().to_dict()
-    redis_client.update_zone_stats(
-        {k: int(v) for k, v in pickup_zones.items() if pd.notna(k)},
-        {k: int(v) for k, v in dropoff_zones.items() if pd.notna(k)}
-    )
+    metrics = aggregate_batch(scored_df, rule_table.threshold)
+    if not metrics['trip_count'] and not metrics['late_trips']:
+        return
+    if metrics['trip_count']:
+        aggregate_sketches(scored_df, metrics)
+    fraud_rows = (scored_df
+        .filter(col("fraud_score") >= rule_table.threshold)
+        .select(*ALERT_COLUMNS)
+        .collect())
     
-    # Payment type stats
-    payment_stats = pdf['payment_type'].value_counts().to_dict()
-    redis_client.update_payment_stats({k: int(v) for k, v in payment_stats.items() if pd.notna(k)})
+    trip_count = metrics['trip_count']
+    total_revenue = metrics['total_revenue']
+    fraud_count = metrics['fraud_count']
+    logger.info(f"📦 Processing batch {batch_id} with {trip_count + metrics['late_trips']} records")
     
-    # Vendor stats
-    vendor_stats = pdf['VendorID'].value_counts().to_dict()
-    redis_client.update_vendor_stats({k: int(v) for k, v in vendor_stats.items() if pd.notna(k)})
+    redis_client = RedisClient()
+    write_batch(redis_client, metrics, group_alerts(fraud_rows))
+    redis_client.update_flag_names(fraud_flag_bits(rule_table.rules))
+    # The watermark update rides in the same apply-once script as the windows
+    # it finalizes, so a replayed batch cannot move it twice
+    if watermark.advance(metrics['max_event_time']):
+        redis_client.update_watermark(watermark.max_event_time, watermark.current())
+    sink = redis_client.flush(dedupe_key=f"sink:{query_id}:{batch_id}:driver")
+    if sink['duplicate']:
+        logger.info(f"⏭️ Batch {batch_id} was already written to Redis, skipped")
+        return
     
-    logger.info(f"✅ Batch {batch_id}: {trip_count} trips, ${total_revenue:.2f}, {fraud_count} fraud alerts")
+    logger.info(f"✅ Batch {batch_id}: {trip_count} trips, ${total_revenue:.2f}, {fraud_count} fraud alerts, "
+                f"{metrics['late_trips']} late "
+                f"(Redis: {sink['commands']} commands, {sink['round_trips']} round trip, {sink['latency_ms']:.1f} ms)")
 
 
-def main():
-    logger.info("🚀 Starting NYC Taxi Fraud Detector...")
-    
-    spark = (SparkSession.builder
-        .appName("NYC Taxi Fraud Detector")
-        .config("spark.jars.packages", "org.apache.spark:spark-sql-kafka-0-10_2.13:4.0.1")
-        .config("spark.sql.streaming.checkpointLocation", "/tmp/checkpoint")
-        .getOrCreate())
-    
-    spark.sparkContext.setLogLevel("WARN")
+def decode_trips(raw_stream, wire_formats=KAFKA_WIRE_FORMATS, fields=CONSUMED_FIELDS):
+    """Decode Kafka values into the given trip columns, whatever their wire format.
+
+    JSON messages start with '{', Avro ones with WIRE_MAGIC and their schema
+    version; each row only runs the decoder its first bytes select. Avro is
+    read with a schema listing just `fields` so the other fields are skipped
+    rather than decoded. Values no decoder accepts are dropped.
+    """
+    value = col("value")
+    consumed = StructType([field for field in trip_schema.fields if field.name in fields])
+    headers, decoders = {}, {}
+    if 'json' in wire_formats:
+        headers['json'] = substring(value, 1, 1) == lit(bytearray(b'{'))
+        decoders['json'] = from_json(value.cast("string"), consumed)
+    if 'avro' in wire_formats:
+        for version in TRIP_WIRE_VERSIONS:
+            writer_schema = load_trip_avro_schema(version)
+            reader_schema = {**writer_schema,
+                             'fields': [f for f in writer_schema['fields'] if f['name'] in fields]}
+            headers[f'avro_v{version}'] = substring(value, 1, 2) == lit(bytearray([WIRE_MAGIC, version]))
+            decoders[f'avro_v{version}'] = from_avro(
+                expr("substring(value, 3)"), json.dumps(writer_schema),
+                {"avroSchema": json.dumps(reader_schema), "mode": "PERMISSIVE"})
+    if not decoders:
+        raise ValueError(f"No known wire format in KAFKA_WIRE_FORMATS={','.join(wire_formats)} (json, avro)")
     
-    raw_stream = (spark.readStream.format("kafka")
+    # Filter on the header alone: a filter on the decoded struct would be pushed
+    # below the projection and decode every message twice
+    decoded = (raw_stream
+        .filter(reduce(lambda a, b: a | b, headers.values()))
+        .select(*[when(headers[name], decoder).alias(name) for name, decoder in decoders.items()]))
+    columns = []
+    for field in consumed.fields:
+        data_type = TimestampType() if field.name in TIMESTAMP_FIELDS else field.dataType
+        columns.append(coalesce(*[col(f"{name}.{field.name}").cast(data_type) for name in decoders])
+                       .alias(field.name))
+    return decoded.select(*columns)
+
+
+def encode_scored_trips(scored_df, batch_id, query_id, wire_format=SCORED_WIRE_FORMAT):
+    """Kafka key/value/headers rows for scored trips, in the same wire formats as the input topic.
+
+    The key is the trip_id, so a repeated record lands on the same partition
+    with the same key and can be dropped by consumers or log compaction.
+    Trips without a trip_id are keyed by a hash of their record. Every record
+    also carries its trip_id and scoring batch as headers.
+    """
+    # Timestamps go out as local date-times, like the API sends them
+    fields = [col(name).cast("timestamp_ntz").alias(name) if name in TIMESTAMP_FIELDS else col(name)
+              for name in SCORED_FIELDS]
+    if wire_format == 'avro':
+        schema = load_trip_avro_schema(SCORED_WIRE_VERSION, "trip_scored")
+        value = concat(lit(bytearray([WIRE_MAGIC, SCORED_WIRE_VERSION])), to_avro(struct(*fields), json.dumps(schema)))
+    elif wire_format == 'json':
+        value = to_json(struct(*fields)).cast("binary")
+    else:
+        raise ValueError(f"Unknown SCORED_WIRE_FORMAT '{wire_format}' (expected json or avro)")
+    headers = array(
+        struct(lit("trip_id").alias("key"), col("trip_id").cast("binary").alias("value")),
+        struct(lit("scored_batch").alias("key"), lit(f"{query_id}:{batch_id}").cast("binary").alias("value")))
+    return scored_df.select(coalesce(col("trip_id"), sha2(value, 256)).alias("key"), value.alias("value"),
+                            headers.alias("headers"))
+
+
+def publish_scored(scored_df, batch_id, query_id):
+    """Publish the scored batch to SCORED_KAFKA_TOPIC, at least once.
+
+    Neither Spark's Kafka sink nor the Python client can write transactionally,
+    so a batch is recorded as published in Redis after the write and a replay
+    of it is skipped. A task retry or a crash between the write and the marker
+    can still repeat records; the repeats are identical and share the trip_id
+    key, so consumers deduplicate on the key (or the topic is compacted).
+    """
+    marker = f"sink:{query_id}:{batch_id}:scored"
+    redis_client = RedisClient()
+    if redis_client.has_marker(marker):
+        logger.info(f"⏭️ Batch {batch_id} was already published to {SCORED_KAFKA_TOPIC}, skipped")
+        return
+    (encode_scored_trips(scored_df, batch_id, query_id)
+        .write
+        .format("kafka")
         .option("kafka.bootstrap.servers", KAFKA_BOOTSTRAP_SERVERS)
-        .option("subscribe", KAFKA_TOPIC)
-        .option("startingOffsets", "latest")
-        .load())
-    
-    parsed_stream = (raw_stream
-        .selectExpr("CAST(value AS STRING) as json_str")
-        .select(from_json(col("json_str"), trip_schema).alias("data"))
-        .select("data.*"))
-    
-    enriched_stream = (parsed_stream
+        .option("topic", SCORED_KAFKA_TOPIC)
+        # Broker-side dedupe of the producer's own retries
+        .option("kafka.enable.idempotence", "true")
+        .option("kafka.acks", "all")
+        .save())
+    redis_client.set_marker(marker)
+
+
+def enrich_trips(parsed_stream):
+    return (parsed_stream
         .withColumn("pickup_ts", col("tpep_pickup_datetime").cast(TimestampType()))
         .withColumn("dropoff_ts", col("tpep_dropoff_datetime").cast(TimestampType()))
         .withColumn("duration_min", (unix_timestamp("dropoff_ts") - unix_timestamp("pickup_ts")) / 60)
@@ -212,105 +584,207 @@ def main():
         .withColumn("is_night", (hour("pickup_ts") >= 22) | (hour("pickup_ts") < 6))
         .withColumn("fare_per_mile", when(col("trip_distance") > 0, col("fare_amount") / col("trip_distance")).otherwise(0))
         .withColumn("tip_pct", when(col("fare_amount") > 0, (col("tip_amount") / col("fare_amount")) * 100).otherwise(0)))
+
+
+def load_zones(spark, path: str = ZONE_LOOKUP_PATH):
+    """The zone lookup CSV as a small DataFrame (read on the driver, so executors need no copy)"""
+    rows = read_zone_lookup(path)
+    schema = StructType([StructField("LocationID", IntegerType(), False)]
+                        + [StructField(name, StringType(), True) for name in ZONE_FIELDS.values()])
+    return spark.createDataFrame(rows, schema)
+
+
+def with_zones(trips, zones):
+    """Attach pickup_/dropoff_ zone, borough and service_zone by broadcast-joining the zone lookup"""
+    for side, key in (("pickup", "PULocationID"), ("dropoff", "DOLocationID")):
+        side_zones = zones.select(col("LocationID").alias(key),
+                                  *[col(name).alias(f"{side}_{name}") for name in ZONE_FIELDS.values()])
+        trips = trips.join(broadcast(side_zones), on=key, how="left")
+    # Borough counters need a key; unmapped or missing zones count as Unknown
+    return trips.fillna(UNKNOWN_ZONE, subset=[f"{side}_{name}" for side in ("pickup", "dropoff")
+                                              for name in ZONE_FIELDS.values()])
+
+
+def load_route_pairs(spark, path: str = ZONE_CENTROIDS_PATH):
+    """Route norms of every known zone pair as a small DataFrame (built on the driver from the centroid matrix)"""
+    schema = StructType([StructField("PULocationID", IntegerType(), False),
+                         StructField("DOLocationID", IntegerType(), False)]
+                        + [StructField(name, DoubleType(), False) for name in ROUTE_NORM_COLUMNS])
+    return spark.createDataFrame(known_route_pairs(load_route_norms(path)), schema)
+
+
+def with_route_norms(trips, route_pairs):
+    """Attach min_route_distance / typical_route_minutes by broadcast-joining the zone-pair norms (0 when unknown)"""
+    return (trips
+        .join(broadcast(route_pairs), on=["PULocationID", "DOLocationID"], how="left")
+        .fillna(0.0, subset=list(ROUTE_NORM_COLUMNS)))
+
+
+def baselines_key(query_id: str) -> str:
+    return f"spark:{query_id}:baselines"
+
+
+def baseline_keys():
+    """Group key columns of a trip's zone baseline, with MISSING_KEY for a missing zone or hour"""
+    return [coalesce(col("PULocationID"), lit(MISSING_KEY)).alias("baseline_zone"),
+            coalesce(col("pickup_hour"), lit(MISSING_KEY)).alias("baseline_hour")]
+
+
+def load_baselines(spark, baselines: ZoneBaselines):
+    """The zone baselines as a small DataFrame: mean and std per metric (std null while too young)"""
+    schema = StructType([StructField("baseline_zone", IntegerType(), False),
+                         StructField("baseline_hour", IntegerType(), False)]
+                        + [StructField(f"{metric}_{stat}", DoubleType(), True)
+                           for metric in BASELINE_METRICS for stat in ("mean", "std")])
+    return spark.createDataFrame(baselines.rows(), schema)
+
+
+def with_zone_baselines(trips, baselines):
+    """Add <metric>_z columns against the per-(PULocationID, hour) baselines by broadcast-joining them (0 when young or missing)"""
+    z_columns = []
+    for metric in BASELINE_METRICS:
+        z = (col(metric) - col(f"{metric}_mean")) / col(f"{metric}_std")
+        z_columns.append(coalesce(nanvl(z, lit(0.0)), lit(0.0)).alias(z_column(metric)))
+    return (trips
+        .select("*", *baseline_keys())
+        .join(broadcast(baselines), on=["baseline_zone", "baseline_hour"], how="left")
+        .select(*[col(name) for name in trips.columns], *z_columns))
+
+
+def batch_moments(scored_df) -> dict:
+    """Count, mean and M2 of each baseline metric per zone/hour group of the batch, from one native aggregate"""
+    aggregates = []
+    for metric in BASELINE_METRICS:
+        value = when(~isnan(col(metric)), col(metric))
+        aggregates += [count(value).alias(f"{metric}_count"), avg(value).alias(f"{metric}_mean"),
+                       (var_pop(value) * count(value)).alias(f"{metric}_m2")]
+    rows = scored_df.groupBy(*baseline_keys()).agg(*aggregates).collect()
+    moments = {}
+    for row in rows:
+        moments[group_key(row.baseline_zone, row.baseline_hour)] = [
+            value for metric in BASELINE_METRICS
+            for value in (row[f"{metric}_count"], row[f"{metric}_mean"] or 0.0, row[f"{metric}_m2"] or 0.0)]
+    return moments
+
+
+def update_baselines(scored_df, batch_id, query_id):
+    """Fold the batch into the zone baselines and save the groups it changed, once per batch"""
+    global zone_baselines
+    redis_client = RedisClient()
+    staged = zone_baselines.merge(batch_moments(scored_df))
+    redis_client.update_consumer_state(baselines_key(query_id), ZoneBaselines.state_fields(staged))
+    sink = redis_client.flush(dedupe_key=f"sink:{query_id}:{batch_id}:baselines")
+    if sink['duplicate']:
+        # Folded in before a restart: the stored baselines already hold this batch
+        zone_baselines = ZoneBaselines(redis_client.get_consumer_state(baselines_key(query_id)))
+    else:
+        zone_baselines.commit(staged)
+
+
+def start_query(spark, max_offsets: int, trigger: dict, starting_options: dict):
+    """Start the detector query; the checkpoint makes every (re)start resume where the last one stopped"""
+    raw_stream = (spark.readStream.format("kafka")
+        .option("kafka.bootstrap.servers", KAFKA_BOOTSTRAP_SERVERS)
+        .option("subscribe", KAFKA_TOPIC)
+        .options(**starting_options)
+        .option("maxOffsetsPerTrigger", max_offsets)
+        .load())
     
-    fraud_result_schema = StructType([
-        StructField("fraud_score", IntegerType(), True),
-        StructField("fraud_flags", ArrayType(StringType()), True)
-    ])
-    
-    @udf(fraud_result_schema)
-    def calculate_fraud_udf(trip_distance, fare_amount, tip_amount, passenger_count,
-                            payment_type, PULocationID, DOLocationID, RatecodeID,
-                            airport_fee, duration_min, speed_mph, is_night):
-        score, flags = 0, []
-        trip_distance = trip_distance or 0
-        fare_amount = fare_amount or 0
-        tip_amount = tip_amount or 0
-        passenger_count = passenger_count or 0
-        payment_type = payment_type or 0
-        PULocationID = PULocationID or 0
-        DOLocationID = DOLocationID or 0
-        RatecodeID = RatecodeID or 1
-        airport_fee = airport_fee or 0
-        duration_min = duration_min or 0
-        speed_mph = speed_mph or 0
-        is_night = is_night or False
-        
-        fare_per_mile = fare_amount / trip_distance if trip_distance > 0 else 0
-        tip_pct = (tip_amount / fare_amount * 100) if fare_amount > 0 else 0
-        
-        if speed_mph > 100:
-            score += 30
-            flags.append("impossible_speed")
-        if speed_mph < 2 and duration_min > 10:
-            score += 25
-            flags.append("stationary_trip")
-        if trip_distance == 0 and fare_amount > 0:
-            score += 20
-            flags.append("zero_distance_with_fare")
-        if fare_per_mile > 10.5:
-            score += 20
-            flags.append("fare_too_high")
-        if fare_amount < 0:
-            score += 15
-            flags.append("negative_fare")
-        if payment_type == 1:
-            if tip_amount > fare_amount:
-                score += 25
-                flags.append("tip_exceeds_fare")
-            if tip_pct > 50:
-                score += 15
-                flags.append("excessive_tip")
-        if PULocationID == DOLocationID and fare_amount > 5:
-            score += 25
-            flags.append("same_location_high_fare")
-        if airport_fee > 0 and PULocationID not in [132, 138]:
-            score += 20
-            flags.append("fake_airport_fee")
-        if passenger_count > 6:
-            score += 15
-            flags.append("too_many_passengers")
-        if passenger_count == 0 and fare_amount > 0:
-            score += 10
-            flags.append("zero_passengers")
-        if is_night:
-            score += 5
-            if payment_type == 2:
-                score += 10
-                flags.append("night_cash_trip")
-            if tip_pct > 30:
-                score += 10
-                flags.append("night_high_tip")
-        if RatecodeID == 2 and PULocationID != 132 and DOLocationID != 132:
-            score += 20
-            flags.append("fake_jfk_rate")
-        if payment_type == 6:
-            score += 20
-            flags.append("voided_trip")
-        if payment_type == 4:
-            score += 10
-            flags.append("disputed_trip")
-        
-        return (min(score, 100), flags)
-    
-    fraud_stream = (enriched_stream
-        .withColumn("fraud_result", calculate_fraud_udf(
-            col("trip_distance"), col("fare_amount"), col("tip_amount"),
-            col("passenger_count"), col("payment_type"), col("PULocationID"),
-            col("DOLocationID"), col("RatecodeID"), col("airport_fee"),
-            col("duration_min"), col("speed_mph"), col("is_night")))
-        .withColumn("fraud_score", col("fraud_result.fraud_score"))
-        .withColumn("fraud_flags", col("fraud_result.fraud_flags"))
-        .drop("fraud_result"))
-    
-    query = (fraud_stream.writeStream
+    # The bronze table keeps whole trip records, not just what the scorer reads
+    fields = trip_schema.fieldNames() if BRONZE_PATH else CONSUMED_FIELDS
+    trips = with_zones(enrich_trips(decode_trips(raw_stream, fields=fields)), load_zones(spark))
+    trips = with_route_norms(trips, load_route_pairs(spark))
+    return (trips.writeStream
+        .queryName("fraud_detector")
         .foreachBatch(process_batch)
         .outputMode("append")
-        .trigger(processingTime="5 seconds")
+        .option("checkpointLocation", CHECKPOINT_DIR)
+        .trigger(**trigger)
         .start())
+
+
+def supervise(query, controller: OffsetCapController, poll_s: float = 5.0):
+    """Wait for the query, feeding its progress to the controller.
+
+    Returns a new cap once the query has been stopped so it can restart with
+    it, or None when the query finished on its own (availableNow catch-up).
+    """
+    last_batch = -1
+    while not query.awaitTermination(poll_s):
+        for progress in query.recentProgress:
+            if progress['batchId'] <= last_batch:
+                continue
+            last_batch = progress['batchId']
+            new_cap = controller.observe(progress)
+            if new_cap is None:
+                continue
+            # Stop between triggers so no half-written batch has to be redone
+            while query.status['isTriggerActive'] and not query.awaitTermination(0.2):
+                pass
+            query.stop()
+            return new_cap
+    return None
+
+
+def run_query(spark, controller: OffsetCapController, trigger: dict, starting_options: dict):
+    """Run the query until it ends, restarting it whenever the controller moves the cap"""
+    while True:
+        query = start_query(spark, controller.cap, trigger, starting_options)
+        logger.info(f"✅ Streaming started (trigger {trigger}, maxOffsetsPerTrigger {controller.cap})")
+        new_cap = supervise(query, controller)
+        if new_cap is None:
+            return
+        controller.apply(new_cap)
+
+
+def main():
+    global rule_table, watermark, bronze_sink, alert_archive
+    logger.info("🚀 Starting NYC Taxi Fraud Detector...")
+    if REDIS_SINK_MODE not in ('driver', 'partition'):
+        raise ValueError(f"Unknown REDIS_SINK_MODE '{REDIS_SINK_MODE}' (expected driver or partition)")
+    if SCORED_WIRE_FORMAT not in ('json', 'avro'):
+        raise ValueError(f"Unknown SCORED_WIRE_FORMAT '{SCORED_WIRE_FORMAT}' (expected json or avro)")
+    rule_table = RuleTable(FRAUD_RULES_FILE)
+    watermark = EventTimeWatermark(parse_delay(EVENT_TIME_WATERMARK))
+    
+    spark = (SparkSession.builder
+        .appName("NYC Taxi Fraud Detector")
+        .config("spark.jars.packages", "org.apache.spark:spark-sql-kafka-0-10_2.13:4.0.1,"
+                                       "org.apache.spark:spark-avro_2.13:4.0.1")
+        .getOrCreate())
+    
+    spark.sparkContext.setLogLevel("WARN")
+    for module in ("fraud_rules.py", "redis_sink.py", "baselines.py", "quantile_sketch.py"):
+        spark.sparkContext.addPyFile(os.path.join(os.path.dirname(os.path.abspath(__file__)), module))
+    logger.info(f"🧮 Fraud scoring engine: {FRAUD_ENGINE}, {len(rule_table.rules)} rules from {FRAUD_RULES_FILE}")
+    logger.info(f"📤 Redis sink mode: {REDIS_SINK_MODE}")
+    logger.info(f"📨 Accepted wire formats: {', '.join(KAFKA_WIRE_FORMATS)}")
+    if SCORED_KAFKA_TOPIC:
+        logger.info(f"📣 Publishing scored trips to {SCORED_KAFKA_TOPIC} ({SCORED_WIRE_FORMAT})")
+    logger.info(f"⏱️ Event-time windows on pickup time, watermark delay {EVENT_TIME_WATERMARK}")
+    if BRONZE_PATH:
+        bronze_sink = BronzeSink(spark, BRONZE_PATH, BRONZE_TARGET_FILE_MB, BRONZE_COMPACT_MIN_FILES)
+        logger.info(f"🪣 Landing scored trips as Parquet in {BRONZE_PATH}")
+    if ALERT_ARCHIVE_PATH:
+        alert_archive = BronzeSink(spark, ALERT_ARCHIVE_PATH, ALERT_ARCHIVE_TARGET_FILE_MB, BRONZE_COMPACT_MIN_FILES,
+                                   sort_columns=ARCHIVE_SORT_COLUMNS, row_group_mb=ALERT_ARCHIVE_ROW_GROUP_MB)
+        logger.info(f"🗄️ Archiving fraud alerts as Parquet in {ALERT_ARCHIVE_PATH}")
+    
+    controller = OffsetCapController(INITIAL_OFFSETS_PER_TRIGGER,
+                                     parse_delay(BATCH_LATENCY_BUDGET).total_seconds(),
+                                     MIN_OFFSETS_PER_TRIGGER, MAX_OFFSETS_PER_TRIGGER)
+    if CATCHUP_FROM:
+        # Starting offsets are only honoured by a query without checkpointed progress
+        if os.path.isdir(os.path.join(CHECKPOINT_DIR, "offsets")):
+            raise ValueError(f"CATCHUP_FROM needs a fresh CHECKPOINT_DIR, {CHECKPOINT_DIR} already has progress")
+        starting_options = catchup_options(CATCHUP_FROM)
+        logger.info(f"⏩ Catching up from {CATCHUP_FROM}")
+        run_query(spark, controller, {"availableNow": True}, starting_options)
+        logger.info("⏩ Catch-up complete, switching to live processing")
+    else:
+        starting_options = {"startingOffsets": "latest"}
     
-    logger.info("✅ Streaming started")
-    query.awaitTermination()
+    run_query(spark, controller, {"processingTime": TRIGGER_INTERVAL}, starting_options)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,245 @@
+"""Fraud rule table and vectorized scoring for NYC Taxi trips
+
+The rules are declared in fraud_rules.json so the same table can be compiled
+into Spark column expressions (see fraud_detector.py) or evaluated over NumPy
+column arrays here. This module has no Spark dependency so it can be shipped
+to executors as-is. It reads no file on import: executors import it from
+SparkFiles, where fraud_rules.json is not shipped, so the scorers take the
+rules the driver parsed as an argument.
+"""
+
+import json
+import logging
+import operator
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FRAUD_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fraud_rules.json')
+FRAUD_THRESHOLD = 50
+MAX_FRAUD_SCORE = 100
+# fraud_flags is an int64 bitmask: each flag owns the bit its rule declares
+MAX_FLAG_BIT = 62
+
+# Scorer inputs and their fallback values. Like the original UDF, a null *or*
+# falsy value is replaced by the fallback (so RatecodeID 0 counts as 1).
+SCORING_INPUTS = {
+    'trip_distance': 0.0,
+    'fare_amount': 0.0,
+    'tip_amount': 0.0,
+    'passenger_count': 0,
+    'payment_type': 0,
+    'PULocationID': 0,
+    'DOLocationID': 0,
+    'RatecodeID': 1,
+    'airport_fee': 0.0,
+    'duration_min': 0.0,
+    'speed_mph': 0.0,
+    'is_night': False,
+    # z-scores against the pickup zone/hour baseline (see baselines.py); 0 until it has history
+    'fare_per_mile_z': 0.0,
+    'speed_mph_z': 0.0,
+    'tip_pct_z': 0.0,
+    # Norms of the pickup/dropoff zone pair (see route_norms.py); 0 when the pair is unknown
+    'min_route_distance': 0.0,
+    'typical_route_minutes': 0.0,
+}
+DERIVED_INPUTS = ('fare_per_mile', 'tip_pct')
+
+COMPARISONS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+SET_OPERATORS = ('in', 'not in')
+
+
+def parse_rules(config: dict) -> list:
+    """Validate a rule file's contents and return (flag, bit, weight, conditions) tuples.
+
+    Each rule is {"flag": name or null, "bit": int, "weight": int, "when": [[column, op, value], ...]};
+    all conditions must hold. A flag of null only adds to the score and a value of
+    {"col": name} compares against another column. A flag sets its bit in the
+    fraud_flags mask; rules sharing a flag share its bit.
+    """
+    known = set(SCORING_INPUTS) | set(DERIVED_INPUTS)
+    rules, bits, flag_bits = [], {}, {}
+    for i, rule in enumerate(config.get('rules', [])):
+        flag, weight, conditions_ = rule.get('flag'), rule.get('weight'), rule.get('when')
+        bit = rule.get('bit')
+        if not isinstance(weight, int) or isinstance(weight, bool):
+            raise ValueError(f"rule {i} ({flag}): weight must be an integer")
+        if flag and (not isinstance(bit, int) or isinstance(bit, bool) or not 0 <= bit <= MAX_FLAG_BIT):
+            raise ValueError(f"rule {i} ({flag}): bit must be an integer from 0 to {MAX_FLAG_BIT}")
+        if flag and bits.setdefault(bit, flag) != flag:
+            raise ValueError(f"rule {i} ({flag}): bit {bit} already belongs to '{bits[bit]}'")
+        if flag and flag_bits.setdefault(flag, bit) != bit:
+            raise ValueError(f"rule {i} ({flag}): flag already uses bit {flag_bits[flag]}")
+        if not conditions_:
+            raise ValueError(f"rule {i} ({flag}): 'when' needs at least one condition")
+        conditions = []
+        for column, op, value in conditions_:
+            if column not in known:
+                raise ValueError(f"rule {i} ({flag}): unknown column '{column}'")
+            if op not in COMPARISONS and op not in SET_OPERATORS:
+                raise ValueError(f"rule {i} ({flag}): unknown operator '{op}'")
+            if isinstance(value, dict) and value.get('col') not in known:
+                raise ValueError(f"rule {i} ({flag}): unknown column '{value.get('col')}'")
+            if (op in SET_OPERATORS) != isinstance(value, list):
+                raise ValueError(f"rule {i} ({flag}): '{op}' and a list value go together")
+            conditions.append((column, op, tuple(value) if isinstance(value, list) else value))
+        rules.append((flag, bit if flag else None, weight, conditions))
+    return rules
+
+
+def load_rules(path: str = FRAUD_RULES_PATH):
+    """Read a rule file, returning (rules, alert_threshold)"""
+    with open(path) as f:
+        config = json.load(f)
+    return parse_rules(config), int(config.get('alert_threshold', FRAUD_THRESHOLD))
+
+
+class RuleTable:
+    """Rule file that is re-read whenever it changes on disk.
+
+    An edit that fails to parse is logged and ignored so a typo never stops the
+    stream; the previous rules stay active until the file is fixed. So is one
+    that moves a flag to another bit or gives its bit to another flag: stored
+    masks and per-bit counters would be decoded wrongly.
+    """
+
+    def __init__(self, path: str = FRAUD_RULES_PATH):
+        self.path = path
+        self.rules, self.threshold = load_rules(path)
+        self.version = 1
+        self._mtime = os.path.getmtime(path)
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            rules, threshold = load_rules(self.path)
+            check_flag_bits(fraud_flag_bits(self.rules), fraud_flag_bits(rules))
+            self.rules, self.threshold = rules, threshold
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"❌ Keeping fraud rules v{self.version}, could not reload {self.path}: {e}")
+            return False
+        self.version += 1
+        logger.info(f"🔄 Loaded fraud rules v{self.version}: {len(self.rules)} rules, "
+                    f"alert threshold {self.threshold}")
+        return True
+
+
+def fraud_flag_bits(rules) -> dict:
+    """bit -> name of the flags a rule table can emit"""
+    return {bit: flag for flag, bit, _, _ in rules if flag}
+
+
+def check_flag_bits(old: dict, new: dict):
+    """Reject a rule table that reassigns a bit or a flag of the one it replaces"""
+    old_bits = {flag: bit for bit, flag in old.items()}
+    for bit, flag in new.items():
+        if old.get(bit, flag) != flag or old_bits.get(flag, bit) != bit:
+            raise ValueError(f"flag '{flag}' on bit {bit} conflicts with the running rules; "
+                             f"flags keep their bit, new flags need an unused one")
+
+
+def decode_flags(mask: int, flag_bits: dict) -> list:
+    """Flag names set in a fraud_flags mask, in bit order"""
+    return [flag_bits.get(bit, f"bit_{bit}") for bit in range(MAX_FLAG_BIT + 1) if mask >> bit & 1]
+
+
+def score_record(values: dict, rules):
+    """Score a single trip given as a dict; used by the row-at-a-time 'udf' engine"""
+    v = {name: values.get(name) or fallback for name, fallback in SCORING_INPUTS.items()}
+    v['fare_per_mile'] = v['fare_amount'] / v['trip_distance'] if v['trip_distance'] > 0 else 0
+    v['tip_pct'] = v['tip_amount'] / v['fare_amount'] * 100 if v['fare_amount'] > 0 else 0
+
+    score, flags = 0, 0
+    for flag, bit, weight, conditions in rules:
+        for column, op, value in conditions:
+            if isinstance(value, dict):
+                value = v[value['col']]
+            if op == 'in':
+                holds = v[column] in value
+            elif op == 'not in':
+                holds = v[column] not in value
+            else:
+                holds = COMPARISONS[op](v[column], value)
+            if not holds:
+                break
+        else:
+            score += weight
+            if flag:
+                flags |= 1 << bit
+    return (min(score, MAX_FRAUD_SCORE), flags)
+
+
+def prepare_arrays(columns) -> dict:
+    """Fill scorer inputs from a mapping of column arrays/Series and add derived columns.
+
+    Nulls arrive from Arrow as NaN (or None for booleans), so they are treated
+    like the UDF treats None: replaced by the input's fallback value.
+    """
+    arrays = {}
+    for name, fallback in SCORING_INPUTS.items():
+        if isinstance(fallback, bool):
+            values = np.asarray(columns[name])
+            if values.dtype == object:
+                values = np.array([v is not None and v == v and bool(v) for v in values], dtype=bool)
+            arrays[name] = values.astype(bool)
+            continue
+        values = np.asarray(columns[name], dtype=np.float64)
+        values = np.where(np.isnan(values), fallback, values)
+        if fallback:
+            values = np.where(values == 0, fallback, values)
+        arrays[name] = values
+
+    distance, fare, tip = arrays['trip_distance'], arrays['fare_amount'], arrays['tip_amount']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arrays['fare_per_mile'] = np.where(distance > 0, fare / np.where(distance > 0, distance, 1), 0.0)
+        arrays['tip_pct'] = np.where(fare > 0, tip / np.where(fare > 0, fare, 1) * 100, 0.0)
+    return arrays
+
+
+def rule_mask(arrays: dict, conditions) -> np.ndarray:
+    """Boolean mask of rows matching every condition of a rule"""
+    n = len(next(iter(arrays.values())))
+    mask = np.ones(n, dtype=bool)
+    for column, op, value in conditions:
+        left = arrays[column]
+        if isinstance(value, dict):
+            value = arrays[value['col']]
+        if op == 'in':
+            mask &= np.isin(left, value)
+        elif op == 'not in':
+            mask &= ~np.isin(left, value)
+        else:
+            mask &= COMPARISONS[op](left, value)
+    return mask
+
+
+def score_arrays(columns, rules):
+    """Score a batch of trips given as column arrays.
+
+    Returns (scores, flags): an int32 array of scores and an int64 array of
+    fraud_flags masks.
+    """
+    arrays = prepare_arrays(columns)
+    n = len(arrays['fare_amount'])
+    scores = np.zeros(n, dtype=np.int32)
+    flags = np.zeros(n, dtype=np.int64)
+    for flag, bit, weight, conditions in rules:
+        mask = rule_mask(arrays, conditions)
+        scores += np.int32(weight) * mask
+        if flag:
+            flags |= mask.astype(np.int64) << np.int64(bit)
+    np.minimum(scores, MAX_FRAUD_SCORE, out=scores)
+    return scores, flags
@@ -0,0 +1,326 @@
+"""Lightweight Fraud Detector: the streaming job on one asyncio process, without Spark
+
+For small deployments and edge sites. It consumes the same Kafka topic, in
+the same wire formats, scores trips with the same rule table (score_arrays
+over NumPy columns) and writes the same Redis keys through the same sink code
+as the Spark job's partition mode, so the dashboard cannot tell them apart.
+It starts in about a second and fits in a couple of hundred MB.
+
+The Kafka client's poll() blocks, so it runs in a worker thread through
+asyncio.to_thread, and the next poll is already in flight while the current
+batch is scored and written. A batch is whatever one poll returns: at most
+LITE_MAX_BATCH records, waiting at most LITE_MAX_WAIT_MS for the first one,
+which keeps end-to-end latency well under a second.
+
+Progress lives in Redis, not in Kafka's committed offsets: each batch's next
+offsets (lite:{group}:offsets) and the zone baselines it changed
+(lite:{group}:baselines) go out in the same apply-once script as its metrics,
+and the consumer seeks to the stored offsets whenever partitions are
+assigned, so a crash or restart neither loses nor double counts a batch.
+Baselines are kept in memory, so run one instance per LITE_GROUP_ID.
+
+Not covered (use the Spark job): the bronze table, the alert archive and the
+scored trip topic.
+
+    python lite_detector.py
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+import numpy as np
+import pandas as pd
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+
+from baselines import ZoneBaselines
+from fraud_rules import FRAUD_RULES_PATH, SCORING_INPUTS, RuleTable, fraud_flag_bits, score_arrays
+from quantile_sketch import SKETCH_METRICS
+from redis_sink import RedisClient, aggregate_rows, write_batch
+from route_norms import load_route_norms, route_norms
+from stream_control import EventTimeWatermark, parse_delay
+from trip_events import (
+    CONSUMED_FIELDS, TIMESTAMP_FIELDS, TRIP_WIRE_VERSIONS, UNKNOWN_ZONE, WIRE_MAGIC, ZONE_FIELDS,
+    AvroTripDecoder, load_trip_avro_schema, read_zone_lookup
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
+KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'nyc.taxi.trips.raw')
+# Wire formats accepted on the topic; each message says which one it uses
+KAFKA_WIRE_FORMATS = os.getenv('KAFKA_WIRE_FORMATS', 'json,avro').split(',')
+# Declarative rule file, re-read between batches when it changes
+FRAUD_RULES_FILE = os.getenv('FRAUD_RULES_PATH', FRAUD_RULES_PATH)
+# How far behind the latest pickup a trip may arrive and still update its windows.
+# Trips are sent when they end, so this covers the longest trip plus delivery delays.
+EVENT_TIME_WATERMARK = os.getenv('EVENT_TIME_WATERMARK', '3 hours')
+# Kafka consumer group, also the prefix of the offsets and baselines kept in Redis
+LITE_GROUP_ID = os.getenv('LITE_GROUP_ID', 'fraud-detector-lite')
+LITE_MAX_BATCH = int(os.getenv('LITE_MAX_BATCH', 5000))
+LITE_MAX_WAIT_MS = int(os.getenv('LITE_MAX_WAIT_MS', 100))
+
+# Integer trip fields: kept as Python ints (or None) for the sink, like Spark's IntegerType
+INTEGER_FIELDS = [field['name'] for field in load_trip_avro_schema(TRIP_WIRE_VERSIONS[-1])['fields']
+                  if field['name'] in CONSUMED_FIELDS and field['type'][1] in ('int', 'long')]
+# Columns aggregate_rows and build_alert read, as fraud_detector.PARTITION_SINK_COLUMNS
+ALERT_COLUMNS = ['trip_id', 'fraud_score', 'fraud_flags', 'PULocationID', 'DOLocationID',
+                 'fare_amount', 'is_night', 'event_day', 'pickup_ts',
+                 'pickup_zone', 'pickup_borough', 'dropoff_zone', 'dropoff_borough']
+SINK_COLUMNS = ALERT_COLUMNS + ['total_amount', 'pickup_hour', 'payment_type', 'VendorID', 'event_minute', 'on_time',
+                                *[column for column in SKETCH_METRICS.values() if column not in ALERT_COLUMNS]]
+INTEGER_SINK_COLUMNS = set(INTEGER_FIELDS) | {'pickup_hour'}
+
+
+def offsets_key(group_id: str) -> str:
+    return f"lite:{group_id}:offsets"
+
+
+def baselines_key(group_id: str) -> str:
+    return f"lite:{group_id}:baselines"
+
+
+def decode_json(value: bytes) -> dict:
+    # Like from_json in PERMISSIVE mode, a malformed message becomes an all-null trip
+    try:
+        trip = json.loads(value)
+    except ValueError:
+        return {}
+    return trip if isinstance(trip, dict) else {}
+
+
+def make_decoders(wire_formats=KAFKA_WIRE_FORMATS) -> dict:
+    """Message header -> decoder, for the accepted wire formats"""
+    decoders = {}
+    if 'json' in wire_formats:
+        decoders[b'{'] = decode_json
+    if 'avro' in wire_formats:
+        for version in TRIP_WIRE_VERSIONS:
+            avro = AvroTripDecoder(version)
+
+            def decode_avro(value: bytes, avro=avro) -> dict:
+                try:
+                    return avro(value)
+                except (IndexError, UnicodeDecodeError, OverflowError):
+                    return {}
+            decoders[bytes([WIRE_MAGIC, version])] = decode_avro
+    if not decoders:
+        raise ValueError(f"No known wire format in KAFKA_WIRE_FORMATS={','.join(wire_formats)} (json, avro)")
+    return decoders
+
+
+def decode_trips(values, decoders: dict) -> pd.DataFrame:
+    """Kafka values as a frame of the consumed trip fields; values no decoder accepts are dropped"""
+    trips = []
+    for value in values:
+        decode = decoders.get(value[:1]) or decoders.get(value[:2])
+        if decode is not None:
+            trips.append(decode(value))
+    df = pd.DataFrame.from_records(trips, columns=CONSUMED_FIELDS)
+    for name in CONSUMED_FIELDS:
+        if name in TIMESTAMP_FIELDS:
+            df[name] = pd.to_datetime(df[name], errors='coerce', format='ISO8601')
+        elif name != 'trip_id':
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype(np.float64)
+    return df
+
+
+def enrich_trips(df: pd.DataFrame) -> pd.DataFrame:
+    """The derived columns of fraud_detector.enrich_trips, over pandas columns"""
+    pickup, dropoff = df['tpep_pickup_datetime'], df['tpep_dropoff_datetime']
+    distance, fare = df['trip_distance'].to_numpy(), df['fare_amount'].to_numpy()
+    # Whole seconds, like unix_timestamp()
+    duration = ((dropoff.dt.floor('s') - pickup.dt.floor('s')).dt.total_seconds() / 60).to_numpy()
+    hours = pickup.dt.hour.to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return df.assign(
+            pickup_ts=pickup,
+            duration_min=duration,
+            speed_mph=np.where(duration > 0, distance / duration * 60, 0.0),
+            pickup_hour=hours,
+            is_night=(hours >= 22) | (hours < 6),
+            fare_per_mile=np.where(distance > 0, fare / distance, 0.0),
+            tip_pct=np.where(fare > 0, df['tip_amount'].to_numpy() / fare * 100, 0.0))
+
+
+def with_zones(df: pd.DataFrame, zones: list) -> pd.DataFrame:
+    """Attach pickup_/dropoff_ zone, borough and service_zone from the zone lookup rows"""
+    columns = {}
+    for i, name in enumerate(ZONE_FIELDS.values()):
+        names = {row[0]: row[i + 1] for row in zones}
+        for side, key in (("pickup", "PULocationID"), ("dropoff", "DOLocationID")):
+            columns[f"{side}_{name}"] = df[key].map(names).fillna(UNKNOWN_ZONE)
+    return df.assign(**columns)
+
+
+def with_event_time(df: pd.DataFrame, watermark_ts) -> pd.DataFrame:
+    pickup = df['pickup_ts']
+    on_time = pickup.notna()
+    if watermark_ts is not None:
+        on_time &= pickup >= pd.Timestamp(watermark_ts)
+    return df.assign(event_day=pickup.dt.strftime('%Y-%m-%d'), event_minute=pickup.dt.strftime('%H:%M'),
+                     on_time=on_time)
+
+
+def sink_rows(df: pd.DataFrame) -> list:
+    """Scored trips as the row dicts aggregate_rows reads, with None for nulls and Python scalars"""
+    columns = {}
+    for name in SINK_COLUMNS:
+        series = df[name]
+        if name == 'pickup_ts':
+            values = [None if ts is pd.NaT else ts.to_pydatetime() for ts in series]
+        elif name in INTEGER_SINK_COLUMNS:
+            values = series.astype('Int64').astype(object).where(series.notna(), None).tolist()
+        else:
+            values = series.astype(object).where(series.notna(), None).tolist()
+        columns[name] = values
+    return [dict(zip(SINK_COLUMNS, row)) for row in zip(*columns.values())]
+
+
+class LiteDetector:
+    """Scores consumed batches and writes them, with their offsets, to Redis"""
+
+    def __init__(self, consumer, rule_table: RuleTable, watermark: EventTimeWatermark,
+                 group_id: str = LITE_GROUP_ID, wire_formats=KAFKA_WIRE_FORMATS):
+        self.consumer = consumer
+        self.rule_table = rule_table
+        self.watermark = watermark
+        self.group_id = group_id
+        self.decoders = make_decoders(wire_formats)
+        self.zones = read_zone_lookup()
+        self.route_norms = load_route_norms()
+        self.baselines = ZoneBaselines(RedisClient().get_consumer_state(baselines_key(group_id)))
+        # (topic, partition) -> next offset to process, including the batch in flight
+        self.positions = {}
+        self.batches = 0
+
+    def score(self, values) -> tuple:
+        """(scored frame, staged baseline groups) for a batch of Kafka values"""
+        trips = enrich_trips(decode_trips(values, self.decoders))
+        trips, staged = self.baselines.score(trips)
+        trips = with_zones(trips, self.zones)
+        trips = trips.assign(**route_norms(trips['PULocationID'], trips['DOLocationID'], self.route_norms))
+        scores, flags = score_arrays({name: trips[name] for name in SCORING_INPUTS}, self.rule_table.rules)
+        trips = trips.assign(fraud_score=scores, fraud_flags=flags)
+        return with_event_time(trips, self.watermark.current()), staged
+
+    def take(self, records: list) -> list:
+        """Drop records already taken, e.g. re-fetched after a rebalance, and advance the positions"""
+        fresh = []
+        for record in records:
+            key = (record.topic, record.partition)
+            if record.offset >= self.positions.get(key, -1):
+                fresh.append(record)
+                self.positions[key] = record.offset + 1
+        return fresh
+
+    def process(self, records: list) -> dict:
+        """Score one batch of Kafka records and write it to Redis in one round trip"""
+        start = time.perf_counter()
+        self.rule_table.reload_if_changed()
+        scored, staged = self.score([record.value for record in records])
+        threshold = self.rule_table.threshold
+        metrics, alerts = aggregate_rows(sink_rows(scored), threshold)
+
+        offsets = {}
+        for record in records:
+            key = f"{record.topic}:{record.partition}"
+            offsets[key] = max(offsets.get(key, 0), record.offset + 1)
+        redis_client = RedisClient()
+        write_batch(redis_client, metrics, alerts)
+        redis_client.update_flag_names(fraud_flag_bits(self.rule_table.rules))
+        if self.watermark.advance(metrics['max_event_time']):
+            redis_client.update_watermark(self.watermark.max_event_time, self.watermark.current())
+        redis_client.update_consumer_state(baselines_key(self.group_id), ZoneBaselines.state_fields(staged))
+        redis_client.update_consumer_state(offsets_key(self.group_id), offsets)
+        sink = redis_client.flush()
+        self.baselines.commit(staged)
+
+        self.batches += 1
+        if metrics['trip_count'] or metrics['late_trips']:
+            logger.info(f"✅ Batch {self.batches}: {metrics['trip_count']} trips, ${metrics['total_revenue']:.2f}, "
+                        f"{metrics['fraud_count']} fraud alerts, {metrics['late_trips']} late "
+                        f"(Redis: {sink['commands']} commands in {sink['latency_ms']:.1f} ms, "
+                        f"batch {(time.perf_counter() - start) * 1000:.0f} ms)")
+        return metrics
+
+    def poll(self) -> list:
+        batches = self.consumer.poll(timeout_ms=LITE_MAX_WAIT_MS, max_records=LITE_MAX_BATCH)
+        return [record for records in batches.values() for record in records]
+
+    async def run(self, stop: asyncio.Event):
+        """Process batches until `stop` is set, fetching the next batch while the current one is written"""
+        fetch = asyncio.create_task(asyncio.to_thread(self.poll))
+        try:
+            while not stop.is_set():
+                records = await fetch
+                fetch = asyncio.create_task(asyncio.to_thread(self.poll))
+                records = self.take(records)
+                if records:
+                    await asyncio.to_thread(self.process, records)
+        finally:
+            # The consumer is only closed once no poll is using it
+            await asyncio.gather(fetch, return_exceptions=True)
+
+
+class RedisOffsets(ConsumerRebalanceListener):
+    """Seeks newly assigned partitions to the offsets the sink stored in Redis"""
+
+    def __init__(self, group_id: str):
+        self.key = offsets_key(group_id)
+        self.consumer = None
+
+    def on_partitions_revoked(self, revoked):
+        pass
+
+    def on_partitions_assigned(self, assigned):
+        stored = RedisClient().get_consumer_state(self.key)
+        for partition in assigned:
+            offset = stored.get(f"{partition.topic}:{partition.partition}")
+            # Partitions never processed start from auto_offset_reset (latest)
+            if offset is not None:
+                self.consumer.seek(partition, int(offset))
+
+
+async def serve(detector: LiteDetector):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await detector.run(stop)
+
+
+def main():
+    logger.info("🚀 Starting NYC Taxi Fraud Detector (lite engine)...")
+    rule_table = RuleTable(FRAUD_RULES_FILE)
+    watermark = EventTimeWatermark(parse_delay(EVENT_TIME_WATERMARK))
+    listener = RedisOffsets(LITE_GROUP_ID)
+    consumer = KafkaConsumer(
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        group_id=LITE_GROUP_ID,
+        # Offsets are stored in Redis with the batches they produced
+        enable_auto_commit=False,
+        auto_offset_reset='latest',
+        max_poll_records=LITE_MAX_BATCH,
+        fetch_max_wait_ms=LITE_MAX_WAIT_MS)
+    listener.consumer = consumer
+    consumer.subscribe([KAFKA_TOPIC], listener=listener)
+    detector = LiteDetector(consumer, rule_table, watermark)
+    logger.info(f"🧮 {len(rule_table.rules)} rules from {FRAUD_RULES_FILE}, consumer group {LITE_GROUP_ID}")
+    logger.info(f"📨 Accepted wire formats: {', '.join(KAFKA_WIRE_FORMATS)}")
+    logger.info(f"⏱️ Event-time windows on pickup time, watermark delay {EVENT_TIME_WATERMARK}")
+    logger.info(f"✅ Consuming {KAFKA_TOPIC}, batches of up to {LITE_MAX_BATCH} records "
+                f"every {LITE_MAX_WAIT_MS} ms at most")
+    try:
+        asyncio.run(serve(detector))
+    finally:
+        consumer.close()
+        logger.info("👋 Lite detector stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Mergeable quantile sketches for trip metrics
+
+A sketch is a DDSketch-style log histogram: a value x > 0 falls in bucket
+ceil(log_gamma(x)) with gamma = (1 + a) / (1 - a), so every bucket spans a
+relative width of 2a and any quantile read back is within relative accuracy a
+of the true one. Merging two sketches is adding their bucket counts, which is
+what makes them work with Redis: batches (and executor partitions) add their
+counts with HINCRBY and the windows stay incremental. Negative values use
+'-<bucket>' keys and values closer to 0 than MIN_VALUE count in bucket '0'.
+
+Kept free of Spark imports so it can be shipped to executors; the Spark job
+computes the same buckets with bucket_sql().
+"""
+
+import math
+import os
+
+# Relative accuracy of every quantile read from a sketch
+RELATIVE_ACCURACY = float(os.getenv('SKETCH_RELATIVE_ACCURACY', 0.02))
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1e-3
+# Sketched metric -> trip column
+SKETCH_METRICS = {
+    'fare': 'fare_amount',
+    'distance': 'trip_distance',
+    'duration': 'duration_min',
+    'speed': 'speed_mph'
+}
+
+
+def bucket_of(value):
+    """Bucket key of a value, or None for a missing one"""
+    if value is None or math.isnan(value):
+        return None
+    magnitude = abs(value)
+    if magnitude < MIN_VALUE:
+        return '0'
+    index = math.ceil(math.log(magnitude) / math.log(GAMMA))
+    return f"-{index}" if value < 0 else str(index)
+
+
+def bucket_sql(column: str) -> str:
+    """Spark SQL expression for bucket_of(column)"""
+    return (f"CASE WHEN {column} IS NULL OR isnan({column}) THEN NULL "
+            f"WHEN abs({column}) < {MIN_VALUE} THEN '0' "
+            f"ELSE concat(IF({column} < 0, '-', ''), "
+            f"cast(ceil(ln(abs({column})) / {math.log(GAMMA)!r}) AS string)) END")
+
+
+def add_value(sketch: dict, value):
+    bucket = bucket_of(value)
+    if bucket is not None:
+        sketch[bucket] = sketch.get(bucket, 0) + 1
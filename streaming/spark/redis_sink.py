@@ -0,0 +1,539 @@
+"""Redis sink shared by the driver and executor write paths
+
+Kept free of Spark imports so it can be shipped to executors, where the
+module-level connection pool then lives for the whole Python worker.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import redis
+
+from quantile_sketch import RELATIVE_ACCURACY, MIN_VALUE, SKETCH_METRICS, add_value
+
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+# How long a written (query, batch, partition) is remembered for retried tasks
+SINK_MARKER_TTL = 24 * 3600
+# Hash holding the latest pickup time seen and the event-time watermark
+EVENT_TIME_KEY = "metrics:event_time"
+# Hash describing the quantile sketch buckets, for readers to decode them
+SKETCH_CONFIG_KEY = "sketch:config"
+# Hash bit -> flag name of the fraud_flags masks in alerts and fraud:flags:{day}
+FLAG_NAMES_KEY = "fraud:flag_names"
+# Bits a fraud_flags mask (int64) can use
+FLAG_BITS = 63
+
+# Fraud alerts are stored once, as JSON under fraud:alert:{trip_id}, and
+# indexed by sorted sets scored by pickup time (epoch seconds): all alerts,
+# and per pickup zone, flag bit and score band (scores 70-79 are band 7)
+ALERT_TTL = 7 * 24 * 3600
+ALERT_SCORE_BAND = 10
+# Every alert is also appended to a capped stream, which live views tail from
+# their last entry id instead of re-reading the indexes
+ALERT_STREAM_KEY = "fraud:alerts:stream"
+ALERT_STREAM_MAXLEN = 10000
+
+# Leaderboards: Space-Saving top-K sketches in sorted sets, bounded per board
+# and bucketed by pickup event time into 10-minute slots and days, plus an
+# all-time sketch. Readers union the buckets of the window they show.
+LEADERBOARD_CAPACITY = {
+    # 265 taxi zones fit entirely, so zone boards are exact
+    'pickup_zone': 300, 'dropoff_zone': 300, 'fraud_zone': 300,
+    'fraud_route': int(os.getenv('ROUTE_LEADERBOARD_CAPACITY', 1000))
+}
+LEADERBOARD_SLOT_TTL = 3 * 3600
+LEADERBOARD_DAY_TTL = 8 * 24 * 3600
+
+# Origin-destination matrices: one dense OD_ZONES x OD_ZONES grid of int32
+# counters per event-time pickup hour and day (plus one all-time grid), kept
+# in a Redis string as BITFIELD cells, so cell (pickup, dropoff) is the
+# big-endian int32 at offset ((pickup - 1) * OD_ZONES + dropoff - 1) * 4
+OD_ZONES = 265
+OD_HOUR_TTL = 2 * 24 * 3600
+OD_DAY_TTL = 8 * 24 * 3600
+# Cells per BITFIELD command, to stay within Lua's unpack() limit
+OD_CELLS_PER_COMMAND = 1000
+# Arguments a queued command may have: the script passes each command through
+# unpack(), which fails at about 8000 values (LUAI_MAXCSTACK)
+MAX_COMMAND_ARGS = 5000
+# Members (ZADD, TOPK.INCRBY) or fields (HSET) per command, well within it
+MEMBERS_PER_COMMAND = 1000
+
+# Applies a batch's commands, only if its marker key (KEYS[1], optional) is
+# new, so a retried task or replayed batch cannot double count. Arguments
+# travel as strings so that INCRBYFLOAT amounts are not truncated by Lua
+# number conversion.
+#
+# Redis does not roll back a script that fails partway, so every command is
+# checked before the first write and the marker is the last write: a batch
+# the script rejects changes nothing, and one it fails on is left unmarked for
+# the retry instead of being skipped as a duplicate.
+#
+# TOPK.INCRBY key capacity ttl member count [member count ...] is a
+# pseudo-command for the leaderboards: a member already tracked is
+# incremented, a new one is added while there is room, and otherwise it takes
+# over the smallest member's slot and count (Space-Saving), so counts are
+# upper bounds that are exact for members that never got evicted.
+APPLY_ONCE_SCRIPT = """
+if #KEYS == 1 and redis.call('EXISTS', KEYS[1]) == 1 then
+    return -1
+end
+local commands = cjson.decode(ARGV[2])
+local max_args = tonumber(ARGV[3])
+for i, command in ipairs(commands) do
+    if type(command) ~= 'table' or #command < 2 or #command > max_args then
+        return redis.error_reply('command ' .. i .. ': expected 2 to ' .. max_args .. ' arguments')
+    end
+    if command[1] == 'TOPK.INCRBY' then
+        if #command % 2 == 1 or not tonumber(command[3]) or not tonumber(command[4]) then
+            return redis.error_reply('command ' .. i .. ': TOPK.INCRBY key capacity ttl [member count ...]')
+        end
+        for j = 6, #command, 2 do
+            if not tonumber(command[j]) then
+                return redis.error_reply('command ' .. i .. ': TOPK.INCRBY count is not a number')
+            end
+        end
+    end
+end
+local function topk_incrby(key, capacity, ttl, command)
+    for i = 5, #command, 2 do
+        local member, count = command[i], tonumber(command[i + 1])
+        if redis.call('ZSCORE', key, member) then
+            redis.call('ZINCRBY', key, count, member)
+        elseif redis.call('ZCARD', key) < capacity then
+            redis.call('ZADD', key, count, member)
+        else
+            local smallest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+            redis.call('ZREM', key, smallest[1])
+            redis.call('ZADD', key, tonumber(smallest[2]) + count, member)
+        end
+    end
+    if ttl > 0 then
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+for _, command in ipairs(commands) do
+    if command[1] == 'TOPK.INCRBY' then
+        topk_incrby(command[2], tonumber(command[3]), tonumber(command[4]), command)
+    else
+        redis.call(unpack(command))
+    end
+end
+if #KEYS == 1 then
+    redis.call('SET', KEYS[1], '1', 'EX', ARGV[1])
+end
+return #commands
+"""
+
+_connection_pools = {}
+
+
+def get_connection_pool(host=REDIS_HOST, port=REDIS_PORT) -> redis.ConnectionPool:
+    """One Redis connection pool per process, reused by every micro-batch"""
+    if (host, port) not in _connection_pools:
+        _connection_pools[(host, port)] = redis.ConnectionPool(host=host, port=port, decode_responses=True)
+    return _connection_pools[(host, port)]
+
+
+class RedisClient:
+    """Queues a micro-batch's Redis updates and sends them in one round trip"""
+    
+    def __init__(self, host=REDIS_HOST, port=REDIS_PORT):
+        self.client = redis.Redis(connection_pool=get_connection_pool(host, port))
+        self.pipe = self.client.pipeline(transaction=False)
+    
+    def update_metrics(self, day: str, metrics: dict):
+        """Fold trip totals into the event-time day window"""
+        pipe = self.pipe
+        
+        if 'trip_count' in metrics:
+            pipe.incrby(f"metrics:{day}:trips", int(metrics['trip_count']))
+        if 'total_revenue' in metrics:
+            pipe.incrbyfloat(f"metrics:{day}:revenue", float(metrics['total_revenue']))
+        if 'fraud_count' in metrics:
+            pipe.incrby(f"metrics:{day}:fraud_alerts", int(metrics['fraud_count']))
+        if 'day_trips' in metrics:
+            pipe.incrby(f"metrics:{day}:day_trips", int(metrics['day_trips']))
+        if 'night_trips' in metrics:
+            pipe.incrby(f"metrics:{day}:night_trips", int(metrics['night_trips']))
+        
+        for key in ['trips', 'revenue', 'fraud_alerts', 'day_trips', 'night_trips']:
+            pipe.expire(f"metrics:{day}:{key}", 7 * 24 * 3600)
+    
+    def add_fraud_alerts(self, day: str, alerts: list):
+        """Store a batch of alerts by id, index and stream them, and count their flags per bit"""
+        if not alerts:
+            return
+        pipe = self.pipe
+        indexes = {}
+        for alert in alerts:
+            body = json.dumps(alert)
+            pipe.set(f"fraud:alert:{alert['trip_id']}", body, ex=ALERT_TTL)
+            pipe.xadd(ALERT_STREAM_KEY, {'alert': body}, maxlen=ALERT_STREAM_MAXLEN, approximate=True)
+            for index in alert_indexes(alert):
+                indexes.setdefault(index, {})[alert['trip_id']] = alert_time(alert)
+        for index, members in indexes.items():
+            key = f"fraud:idx:{index}"
+            for chunk in chunked(list(members.items())):
+                pipe.zadd(key, dict(chunk))
+            # Alerts past the retention drop out of the indexes their bodies expired from
+            pipe.zremrangebyscore(key, '-inf', f"({max(members.values()) - ALERT_TTL}")
+            pipe.expire(key, ALERT_TTL)
+        flag_counts = count_flag_bits([alert['fraud_flags'] for alert in alerts])
+        for bit, count in flag_counts.items():
+            pipe.hincrby(f"fraud:flags:{day}", bit, count)
+        if flag_counts:
+            pipe.expire(f"fraud:flags:{day}", 7 * 24 * 3600)
+    
+    def update_flag_names(self, flag_bits: dict):
+        """Publish the bit -> name mapping readers decode fraud_flags masks with"""
+        self._hset(FLAG_NAMES_KEY, flag_bits)
+    
+    def update_hourly_stats(self, day: str, hourly: dict):
+        """hourly maps hour -> (trip count, revenue)"""
+        self._update_windows(f"metrics:{day}:hourly", hourly)
+    
+    def update_minute_stats(self, day: str, minutely: dict):
+        """minutely maps 'HH:MM' -> (trip count, revenue)"""
+        self._update_windows(f"metrics:{day}:minutely", minutely)
+    
+    def update_borough_stats(self, day: str, boroughs: dict):
+        """boroughs maps pickup borough -> (trip count, revenue, fraud alerts)"""
+        self._update_windows(f"metrics:{day}:borough",
+                             {borough: (count, revenue) for borough, (count, revenue, _) in boroughs.items()})
+        fraud = {borough: alerts for borough, (_, _, alerts) in boroughs.items() if alerts}
+        pipe = self.pipe
+        for borough, alerts in fraud.items():
+            pipe.hincrby(f"metrics:{day}:borough:fraud_alerts", borough, alerts)
+        if fraud:
+            pipe.expire(f"metrics:{day}:borough:fraud_alerts", 7 * 24 * 3600)
+    
+    def _update_windows(self, prefix: str, windows: dict):
+        if not windows:
+            return
+        pipe = self.pipe
+        for window, (count, revenue) in windows.items():
+            pipe.hincrby(f"{prefix}:trips", str(window), count)
+            pipe.hincrbyfloat(f"{prefix}:revenue", str(window), revenue)
+        pipe.expire(f"{prefix}:trips", 7 * 24 * 3600)
+        pipe.expire(f"{prefix}:revenue", 7 * 24 * 3600)
+    
+    def update_sketches(self, day: str, sketches: dict):
+        """sketches maps 'hour:<H>:<metric>' / 'zone:<id>:<metric>' -> bucket -> count"""
+        if not sketches:
+            return
+        pipe = self.pipe
+        for name, buckets in sketches.items():
+            key = f"sketch:{day}:{name}"
+            for bucket, count in buckets.items():
+                pipe.hincrby(key, bucket, count)
+            pipe.expire(key, 7 * 24 * 3600)
+        pipe.hset(SKETCH_CONFIG_KEY, mapping={'relative_accuracy': RELATIVE_ACCURACY, 'min_value': MIN_VALUE})
+    
+    def update_od_matrix(self, day: str, od: dict):
+        """od maps pickup hour -> (pickup zone, dropoff zone) -> count"""
+        total = {}
+        for hour, counts in od.items():
+            self._od_incrby(f"od:{day}:{hour}", counts, OD_HOUR_TTL)
+            _merge_counts(total, counts)
+        self._od_incrby(f"od:{day}", total, OD_DAY_TTL)
+        self._od_incrby("od:all", total, 0)
+    
+    def _od_incrby(self, key: str, counts: dict, ttl: int):
+        by_cell = {}
+        for (pickup, dropoff), count in counts.items():
+            cell = od_cell(pickup, dropoff)
+            if cell is not None:
+                by_cell[cell] = by_cell.get(cell, 0) + count
+        cells = sorted(by_cell)
+        for start in range(0, len(cells), OD_CELLS_PER_COMMAND):
+            args = [arg for cell in cells[start:start + OD_CELLS_PER_COMMAND]
+                    for arg in ('INCRBY', 'i32', f"#{cell}", by_cell[cell])]
+            self.pipe.execute_command('BITFIELD', key, 'OVERFLOW', 'SAT', *args)
+        if cells and ttl:
+            self.pipe.expire(key, ttl)
+    
+    def update_leaderboards(self, leaderboards: dict):
+        """leaderboards maps board -> slot ('YYYY-MM-DDTHH:M0' or None) -> member -> count"""
+        for board, slots in leaderboards.items():
+            days, total = {}, {}
+            for slot, counts in slots.items():
+                if slot is not None:
+                    self._topk_incrby(f"topk:{board}:slot:{slot}", board, LEADERBOARD_SLOT_TTL, counts)
+                    _merge_counts(days.setdefault(slot[:10], {}), counts)
+                _merge_counts(total, counts)
+            for day, counts in days.items():
+                self._topk_incrby(f"topk:{board}:day:{day}", board, LEADERBOARD_DAY_TTL, counts)
+            self._topk_incrby(f"topk:{board}:all", board, 0, total)
+    
+    def _topk_incrby(self, key: str, board: str, ttl: int, counts: dict):
+        if not counts:
+            return
+        # Largest first, so a batch's own heavy hitters are the last to be evicted
+        for chunk in chunked(sorted(counts.items(), key=lambda item: -item[1])):
+            pairs = [arg for member, count in chunk for arg in (str(member), count)]
+            self.pipe.execute_command('TOPK.INCRBY', key, LEADERBOARD_CAPACITY[board], ttl, *pairs)
+    
+    def update_payment_stats(self, day: str, payment_types: dict):
+        """Update payment type statistics"""
+        pipe = self.pipe
+        for ptype, count in payment_types.items():
+            pipe.hincrby(f"stats:{day}:payment_types", str(ptype), count)
+        pipe.expire(f"stats:{day}:payment_types", 7 * 24 * 3600)
+    
+    def update_vendor_stats(self, day: str, vendors: dict):
+        """Update vendor statistics"""
+        pipe = self.pipe
+        for vendor, count in vendors.items():
+            pipe.hincrby(f"stats:{day}:vendors", str(vendor), count)
+        pipe.expire(f"stats:{day}:vendors", 7 * 24 * 3600)
+    
+    def update_watermark(self, max_event_time: datetime, watermark: datetime):
+        """Publish the event-time watermark: windows ending before it are final"""
+        self.pipe.hset(EVENT_TIME_KEY, mapping={
+            'max_event_time': max_event_time.isoformat(),
+            'watermark': watermark.isoformat()
+        })
+    
+    def get_max_event_time(self):
+        """Latest pickup time seen by a previous run, or None"""
+        value = self.client.hget(EVENT_TIME_KEY, 'max_event_time')
+        return datetime.fromisoformat(value) if value else None
+    
+    def update_consumer_state(self, key: str, fields: dict):
+        """Queue consumer progress (offsets, baselines) so it is written atomically with its batch"""
+        self._hset(key, fields)
+    
+    def _hset(self, key: str, fields: dict):
+        for chunk in chunked(list(fields.items())):
+            self.pipe.hset(key, mapping=dict(chunk))
+    
+    def get_consumer_state(self, key: str) -> dict:
+        return self.client.hgetall(key)
+    
+    def has_marker(self, dedupe_key: str) -> bool:
+        """Whether a sink already recorded `dedupe_key` as written"""
+        return bool(self.client.exists(dedupe_key))
+    
+    def set_marker(self, dedupe_key: str):
+        """Record a write that happened outside Redis, for the same time as flush() markers"""
+        self.client.set(dedupe_key, '1', ex=SINK_MARKER_TTL)
+    
+    def flush(self, dedupe_key: str = None) -> dict:
+        """Send every queued command in a single round trip and report what it cost.
+
+        With a dedupe_key the commands run as one server-side script that skips
+        them if the key was already written (duplicate=True in the report), and
+        writes the key only once they are all applied. A command with more than
+        MAX_COMMAND_ARGS arguments fails the flush before anything is written.
+        """
+        # redis-py passes some keywords (MAXLEN, ~) as bytes
+        commands = [[arg.decode() if isinstance(arg, bytes) else str(arg) for arg in args]
+                    for args, _ in self.pipe.command_stack]
+        start = time.perf_counter()
+        duplicate = False
+        if commands:
+            # Always through the script: it also implements TOPK.INCRBY
+            keys = [dedupe_key] if dedupe_key else []
+            try:
+                applied = self.client.eval(APPLY_ONCE_SCRIPT, len(keys), *keys, SINK_MARKER_TTL,
+                                           json.dumps(commands), MAX_COMMAND_ARGS)
+            finally:
+                self.pipe.reset()
+            duplicate = applied == -1
+        return {
+            'commands': len(commands),
+            'round_trips': 1 if commands else 0,
+            'latency_ms': (time.perf_counter() - start) * 1000,
+            'duplicate': duplicate
+        }
+
+
+def new_batch_metrics() -> dict:
+    """Empty metrics layout shared by the driver and partition aggregations.
+
+    Everything time-based is grouped by the event-time day of the pickup under
+    'days'; leaderboard counts by 10-minute event-time slot under 'leaderboards'.
+    """
+    return {'trip_count': 0, 'total_revenue': 0.0, 'fraud_count': 0, 'late_trips': 0,
+            'max_event_time': None, 'days': {},
+            'leaderboards': {board: {} for board in LEADERBOARD_CAPACITY}}
+
+
+def chunked(items: list, size: int = MEMBERS_PER_COMMAND):
+    """Consecutive slices of at most size items, one per queued command"""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def event_slot(day, minute):
+    """10-minute leaderboard slot of an event-time day and 'HH:MM' minute"""
+    return f"{day}T{minute[:4]}0" if day and minute else None
+
+
+def add_to_leaderboard(metrics: dict, board: str, slot, member, count: int = 1):
+    counts = metrics['leaderboards'][board].setdefault(slot, {})
+    counts[member] = counts.get(member, 0) + count
+
+
+def od_cell(pickup, dropoff):
+    """Cell index of a (pickup, dropoff) zone pair in an OD matrix, None outside it"""
+    if pickup is None or dropoff is None or not (1 <= pickup <= OD_ZONES and 1 <= dropoff <= OD_ZONES):
+        return None
+    return (pickup - 1) * OD_ZONES + dropoff - 1
+
+
+def add_to_od_matrix(day: dict, hour, pickup, dropoff, count: int = 1):
+    counts = day['od'].setdefault(hour, {})
+    counts[(pickup, dropoff)] = counts.get((pickup, dropoff), 0) + count
+
+
+def count_flag_bits(masks) -> dict:
+    """bit -> number of fraud_flags masks with it set"""
+    masks = np.asarray(masks, dtype=np.int64)
+    if not masks.size:
+        return {}
+    counts = (masks[:, None] >> np.arange(FLAG_BITS, dtype=np.int64) & 1).sum(axis=0)
+    return {int(bit): int(counts[bit]) for bit in np.flatnonzero(counts)}
+
+
+def _merge_counts(target: dict, counts: dict):
+    for member, count in counts.items():
+        target[member] = target.get(member, 0) + count
+
+
+def day_metrics(metrics: dict, day: str) -> dict:
+    """The per-day entry of a batch's metrics, created on first use"""
+    if day not in metrics['days']:
+        metrics['days'][day] = {'trip_count': 0, 'total_revenue': 0.0, 'fraud_count': 0,
+                                'night_trips': 0, 'day_trips': 0, 'hourly': {}, 'minutely': {},
+                                'payment_type': {}, 'vendor': {}, 'sketches': {}, 'od': {}, 'borough': {}}
+    return metrics['days'][day]
+
+
+def write_batch(redis_client: RedisClient, metrics: dict, alerts: dict):
+    """Queue a batch's windowed metrics and its fraud alerts (grouped by day) on a RedisClient"""
+    for day, window in metrics['days'].items():
+        redis_client.update_metrics(day, {
+            'trip_count': window['trip_count'],
+            'total_revenue': window['total_revenue'],
+            'fraud_count': window['fraud_count'],
+            'day_trips': window['day_trips'],
+            'night_trips': window['night_trips']
+        })
+        redis_client.update_hourly_stats(day, window['hourly'])
+        redis_client.update_minute_stats(day, window['minutely'])
+        redis_client.update_payment_stats(day, window['payment_type'])
+        redis_client.update_vendor_stats(day, window['vendor'])
+        redis_client.update_sketches(day, window['sketches'])
+        redis_client.update_od_matrix(day, window['od'])
+        redis_client.update_borough_stats(day, window['borough'])
+    for day, day_alerts in alerts.items():
+        redis_client.add_fraud_alerts(day, day_alerts)
+    redis_client.update_leaderboards(metrics['leaderboards'])
+
+
+def build_alert(row, timestamp: str) -> dict:
+    return {
+        'trip_id': row['trip_id'],
+        'pickup_time': row['pickup_ts'].isoformat() if row['pickup_ts'] else None,
+        'fraud_score': int(row['fraud_score']),
+        'fraud_flags': int(row['fraud_flags'] or 0),
+        'PULocationID': int(row['PULocationID'] or 0),
+        'DOLocationID': int(row['DOLocationID'] or 0),
+        'pickup_zone': row['pickup_zone'],
+        'pickup_borough': row['pickup_borough'],
+        'dropoff_zone': row['dropoff_zone'],
+        'dropoff_borough': row['dropoff_borough'],
+        'fare_amount': float(row['fare_amount'] or 0),
+        'is_night': bool(row['is_night']),
+        'timestamp': timestamp
+    }
+
+
+def alert_time(alert: dict) -> float:
+    """Index score of an alert: its pickup time, or when it was raised for trips without one"""
+    return datetime.fromisoformat(alert['pickup_time'] or alert['timestamp']).timestamp()
+
+
+def alert_indexes(alert: dict) -> list:
+    """Index names (under fraud:idx:) an alert is listed in"""
+    flags = alert['fraud_flags']
+    return (['all', f"zone:{alert['PULocationID']}", f"band:{alert['fraud_score'] // ALERT_SCORE_BAND}"]
+            + [f"flag:{bit}" for bit in range(FLAG_BITS) if flags >> bit & 1])
+
+
+def group_alerts(rows) -> dict:
+    """Build alerts from scored rows, grouped by the pickup's event day.
+
+    Late trips still raise alerts; trips without a pickup time fall back to
+    the processing day.
+    """
+    now = datetime.now()
+    timestamp, today = now.isoformat(), now.strftime("%Y-%m-%d")
+    alerts = {}
+    for row in rows:
+        alerts.setdefault(row['event_day'] or today, []).append(build_alert(row, timestamp))
+    return alerts
+
+
+def aggregate_rows(rows, threshold: int):
+    """Pre-aggregate an iterator of scored rows into (metrics, alerts).
+
+    Produces the same metrics layout as the driver-side Spark aggregation so
+    both sink modes share write_batch. Rows that are not on_time (behind the
+    watermark or without a pickup time) only count as late.
+    """
+    metrics = new_batch_metrics()
+    fraud_rows = []
+    counters = (('payment_type', 'payment_type'), ('vendor', 'VendorID'))
+    for row in rows:
+        if row['fraud_score'] >= threshold:
+            fraud_rows.append(row)
+        if row['pickup_ts'] is not None and (metrics['max_event_time'] is None
+                                             or row['pickup_ts'] > metrics['max_event_time']):
+            metrics['max_event_time'] = row['pickup_ts']
+        if not row['on_time']:
+            metrics['late_trips'] += 1
+            continue
+        
+        amount = row['total_amount'] or 0.0
+        day = day_metrics(metrics, row['event_day'])
+        for target in (metrics, day):
+            target['trip_count'] += 1
+            target['total_revenue'] += amount
+            if row['fraud_score'] >= threshold:
+                target['fraud_count'] += 1
+        if row['is_night']:
+            day['night_trips'] += 1
+        else:
+            day['day_trips'] += 1
+        for windows, key in ((day['hourly'], row['pickup_hour']), (day['minutely'], row['event_minute'])):
+            count, revenue = windows.get(key, (0, 0.0))
+            windows[key] = (count + 1, revenue + amount)
+        count, revenue, fraud = day['borough'].get(row['pickup_borough'], (0, 0.0, 0))
+        day['borough'][row['pickup_borough']] = (count + 1, revenue + amount,
+                                                 fraud + (row['fraud_score'] >= threshold))
+        for name, column in counters:
+            if row[column] is not None:
+                day[name][row[column]] = day[name].get(row[column], 0) + 1
+        for metric, column in SKETCH_METRICS.items():
+            for scope, key in (('hour', row['pickup_hour']), ('zone', row['PULocationID'])):
+                if key is not None:
+                    add_value(day['sketches'].setdefault(f"{scope}:{key}:{metric}", {}), row[column])
+        slot = event_slot(row['event_day'], row['event_minute'])
+        pickup, dropoff = row['PULocationID'], row['DOLocationID']
+        if row['pickup_hour'] is not None and od_cell(pickup, dropoff) is not None:
+            add_to_od_matrix(day, row['pickup_hour'], pickup, dropoff)
+        for board, member in (('pickup_zone', pickup), ('dropoff_zone', dropoff)):
+            if member is not None:
+                add_to_leaderboard(metrics, board, slot, member)
+        if row['fraud_score'] >= threshold:
+            if pickup is not None:
+                add_to_leaderboard(metrics, 'fraud_zone', slot, pickup)
+            if pickup is not None and dropoff is not None:
+                add_to_leaderboard(metrics, 'fraud_route', slot, f"{pickup}->{dropoff}")
+    return metrics, group_alerts(fraud_rows)
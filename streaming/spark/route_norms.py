@@ -0,0 +1,92 @@
+"""Zone-pair route norms: minimum plausible distance and typical duration
+
+Built once from zone centroids (zone_centroids.csv: LocationID, latitude,
+longitude, radius_miles, generated from the TLC shapefile by
+build_zone_centroids.py) into two dense float32 matrices indexed directly by
+[PULocationID, DOLocationID], so a lookup is plain array indexing with no
+per-trip geometry:
+
+- min_route_distance: the great-circle distance between the centroids less
+  each zone's radius (centroid to farthest boundary point). A taxi cannot
+  legitimately cover less road than that, wherever in the two zones the trip
+  started and ended; neighbouring zones get 0.
+- typical_route_minutes: the great-circle distance stretched by
+  ROUTE_DETOUR_FACTOR and driven at TYPICAL_SPEED_MPH.
+
+Pairs involving a zone without a centroid (264/265, or an id outside
+1..OD_ZONES) are 0, which the rules treat as unknown. Like fraud_rules.py this
+module has no Spark dependency.
+"""
+
+import csv
+import os
+
+import numpy as np
+
+from redis_sink import OD_ZONES
+
+ZONE_CENTROIDS_PATH = os.getenv('ZONE_CENTROIDS_PATH',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zone_centroids.csv'))
+ROUTE_DETOUR_FACTOR = 1.3
+TYPICAL_SPEED_MPH = 12.0
+EARTH_RADIUS_MILES = 3958.8
+ROUTE_NORM_COLUMNS = ('min_route_distance', 'typical_route_minutes')
+
+_route_norms = {}
+
+
+def load_centroids(path: str = ZONE_CENTROIDS_PATH) -> dict:
+    """LocationID -> (latitude, longitude, radius_miles)"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; generate it with python build_zone_centroids.py")
+    with open(path, newline='') as f:
+        return {int(row['LocationID']): (float(row['latitude']), float(row['longitude']), float(row['radius_miles']))
+                for row in csv.DictReader(f)}
+
+
+def build_route_norms(centroids: dict):
+    """(min_route_distance, typical_route_minutes) matrices of shape (OD_ZONES + 1, OD_ZONES + 1)"""
+    latitude = np.full(OD_ZONES + 1, np.nan)
+    longitude = np.full(OD_ZONES + 1, np.nan)
+    radius = np.full(OD_ZONES + 1, np.nan)
+    for zone, (lat, lon, miles) in centroids.items():
+        if 1 <= zone <= OD_ZONES:
+            latitude[zone], longitude[zone], radius[zone] = lat, lon, miles
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    # Haversine over every pair at once
+    a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2
+         + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+    miles = 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+    min_distance = np.nan_to_num(np.maximum(miles - radius[:, None] - radius[None, :], 0.0))
+    typical_minutes = np.nan_to_num(miles * ROUTE_DETOUR_FACTOR / TYPICAL_SPEED_MPH * 60)
+    return min_distance.astype(np.float32), typical_minutes.astype(np.float32)
+
+
+def load_route_norms(path: str = ZONE_CENTROIDS_PATH):
+    """The route norm matrices for a centroid file, built on first use and cached per process"""
+    if path not in _route_norms:
+        _route_norms[path] = build_route_norms(load_centroids(path))
+    return _route_norms[path]
+
+
+def route_norms(pickup, dropoff, norms=None) -> dict:
+    """min_route_distance / typical_route_minutes arrays for arrays of zone ids (NaN ids -> 0)"""
+    min_distance, typical_minutes = norms if norms is not None else load_route_norms()
+    pickup = np.nan_to_num(np.asarray(pickup, dtype=np.float64)).astype(np.int64)
+    dropoff = np.nan_to_num(np.asarray(dropoff, dtype=np.float64)).astype(np.int64)
+    # Out-of-range ids land on row/column 0, which is all zeros (unknown)
+    pickup = np.where((pickup >= 1) & (pickup <= OD_ZONES), pickup, 0)
+    dropoff = np.where((dropoff >= 1) & (dropoff <= OD_ZONES), dropoff, 0)
+    return {'min_route_distance': min_distance[pickup, dropoff].astype(np.float64),
+            'typical_route_minutes': typical_minutes[pickup, dropoff].astype(np.float64)}
+
+
+def known_route_pairs(norms=None) -> list:
+    """(PULocationID, DOLocationID, min_route_distance, typical_route_minutes) for every known pair.
+
+    Same-zone pairs are 0 and left out, like pairs without centroids.
+    """
+    min_distance, typical_minutes = norms if norms is not None else load_route_norms()
+    pickup, dropoff = np.nonzero(typical_minutes)
+    return [(int(pu), int(do), float(min_distance[pu, do]), float(typical_minutes[pu, do]))
+            for pu, do in zip(pickup, dropoff)]
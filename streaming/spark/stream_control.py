@@ -0,0 +1,137 @@
+"""Backpressure control, catch-up settings and the event-time watermark
+
+Kept free of Spark imports: the controller works on the progress dicts that
+StreamingQuery.recentProgress returns, so it can be reasoned about (and
+replayed) without a running query, and the lite detector shares the rest.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+
+from redis_sink import RedisClient
+
+logger = logging.getLogger(__name__)
+
+# Aim below the budget so a slightly slower batch still fits
+BUDGET_HEADROOM = 0.8
+# A batch that read at least this share of the cap was limited by it (backlog)
+SATURATION = 0.9
+
+
+class OffsetCapController:
+    """Adjusts maxOffsetsPerTrigger so micro-batches stay within a latency budget.
+
+    Every progress report gives the rows a batch read and how long the trigger
+    took; the smoothed throughput times the budget is the cap that just fits.
+    The cap only grows while batches are hitting it, i.e. while there is a
+    backlog, and only moves by more than `tolerance` so the query (which has
+    to restart to pick up a new cap) is not bounced for small changes.
+    """
+
+    def __init__(self, cap: int, budget_s: float, min_cap: int, max_cap: int,
+                 smoothing: float = 0.5, tolerance: float = 0.25, min_batches: int = 3):
+        if not 0 < min_cap <= max_cap:
+            raise ValueError(f"Invalid offsets per trigger range {min_cap}..{max_cap}")
+        self.cap = max(min_cap, min(cap, max_cap))
+        self.budget_s = budget_s
+        self.min_cap = min_cap
+        self.max_cap = max_cap
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.min_batches = min_batches
+        self.rate = None
+        self._batches = 0
+
+    def observe(self, progress: dict):
+        """Feed one progress report; returns a new cap when the query should restart with it"""
+        rows = progress.get('numInputRows') or 0
+        duration_s = (progress.get('durationMs') or {}).get('triggerExecution', 0) / 1000
+        if not rows or duration_s <= 0:
+            return None
+
+        rate = rows / duration_s
+        self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        self._batches += 1
+        if self._batches < self.min_batches:
+            return None
+
+        target = max(self.min_cap, min(int(self.rate * self.budget_s * BUDGET_HEADROOM), self.max_cap))
+        saturated = rows >= self.cap * SATURATION
+        if target > self.cap and not saturated:
+            return None
+        if abs(target - self.cap) <= self.tolerance * self.cap:
+            return None
+        logger.info(f"🎚️ maxOffsetsPerTrigger {self.cap} -> {target} "
+                    f"(last batch {rows} rows in {duration_s:.1f}s, ~{self.rate:,.0f} rows/s, "
+                    f"budget {self.budget_s:.1f}s)")
+        return target
+
+    def apply(self, cap: int):
+        """Record that the query now runs with `cap`; the next decision needs fresh batches"""
+        self.cap = cap
+        self._batches = 0
+
+
+def catchup_options(start: str) -> dict:
+    """Kafka source options that replay from `start`.
+
+    `start` is "earliest", a JSON offsets spec such as
+    {"nyc.taxi.trips.raw": {"0": 1200}}, or an ISO timestamp
+    (e.g. 2026-01-15T08:00:00) resolved to the first offset at or after it.
+    """
+    start = start.strip()
+    if start == 'earliest':
+        return {'startingOffsets': 'earliest'}
+    if start.startswith('{'):
+        json.loads(start)
+        return {'startingOffsets': start}
+    try:
+        timestamp = datetime.fromisoformat(start)
+    except ValueError:
+        raise ValueError(f"Invalid CATCHUP_FROM '{start}' (expected earliest, JSON offsets or an ISO timestamp)") from None
+    return {
+        'startingTimestamp': str(int(timestamp.timestamp() * 1000)),
+        # Partitions with nothing newer than the timestamp start at the end
+        'startingOffsetsByTimestampStrategy': 'latest'
+    }
+
+
+def parse_delay(text: str) -> timedelta:
+    """Parse a Spark-style delay such as '10 minutes' or '30 seconds'"""
+    try:
+        amount, unit = text.split()
+        unit = unit.lower().rstrip('s') + 's'
+        if unit not in ('seconds', 'minutes', 'hours', 'days'):
+            raise ValueError(unit)
+        return timedelta(**{unit: float(amount)})
+    except ValueError:
+        raise ValueError(f"Invalid delay '{text}' (expected e.g. '10 minutes')") from None
+
+
+class EventTimeWatermark:
+    """Event-time watermark: the latest pickup seen minus a fixed delay.
+
+    As with Spark's withWatermark, it only moves forward and is advanced after
+    a batch, so each batch is judged against what the earlier batches saw.
+    Trips older than the watermark are late and leave every window untouched,
+    which makes the windows ending before it final. The latest pickup is kept
+    in Redis so a restarted job resumes from it.
+    """
+
+    def __init__(self, delay: timedelta):
+        self.delay = delay
+        self.max_event_time = None
+        self._loaded = False
+
+    def current(self):
+        if not self._loaded:
+            self.max_event_time = RedisClient().get_max_event_time()
+            self._loaded = True
+        return self.max_event_time - self.delay if self.max_event_time else None
+
+    def advance(self, max_event_time) -> bool:
+        if max_event_time is None or (self.max_event_time and max_event_time <= self.max_event_time):
+            return False
+        self.max_event_time = max_event_time
+        return True
@@ -0,0 +1,138 @@
+"""Every scoring engine against the original calculate_fraud_udf
+
+The trips are random, but each input is drawn from values sitting on the
+rules' thresholds (speed 100 and 2, 10.5 $/mi, 50% and 30% tips, 6
+passengers, ...) as well as nulls, zeros and negatives, so the fallbacks and
+every strict comparison are exercised.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark_scoring import reference_score_trip
+from fraud_rules import SCORING_INPUTS, decode_flags, fraud_flag_bits, load_rules, score_arrays, score_record
+
+RULES, _ = load_rules()
+FLAG_BITS = fraud_flag_bits(RULES)
+ROWS = 20_000
+
+# (fare_amount, trip_distance) pairs on the fare_per_mile, tip and zero-distance boundaries
+FARE_DISTANCE = [(21.0, 2.0), (21.01, 2.0), (20.99, 2.0), (10.0, 0.0), (0.0, 0.0), (-5.0, 1.0),
+                 (5.0, 0.3), (5.01, 0.3), (20.0, 1.905), (60.0, 12.0)]
+TIP_AMOUNT = [0.0, 6.0, 10.0, 10.01, 20.0, 21.0, 40.0]
+SPEED_DURATION = [(100.0, 5.0), (100.01, 5.0), (2.0, 11.0), (1.99, 10.0), (1.99, 10.01), (0.0, 0.0),
+                  (25.0, -2.0), (18.0, 30.0)]
+ZONES = [0, 132, 138, 161, 230]
+
+
+def random_trips(seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    fare, distance = np.array(FARE_DISTANCE)[rng.integers(0, len(FARE_DISTANCE), ROWS)].T
+    speed, duration = np.array(SPEED_DURATION)[rng.integers(0, len(SPEED_DURATION), ROWS)].T
+    df = pd.DataFrame({
+        'trip_distance': distance,
+        'fare_amount': fare,
+        'tip_amount': rng.choice(TIP_AMOUNT, ROWS),
+        'passenger_count': rng.integers(0, 9, ROWS),
+        'payment_type': rng.integers(0, 7, ROWS),
+        'PULocationID': rng.choice(ZONES, ROWS),
+        'DOLocationID': rng.choice(ZONES, ROWS),
+        'RatecodeID': rng.integers(0, 4, ROWS),
+        'airport_fee': rng.choice([0.0, 0.0, 1.75, -1.75], ROWS),
+        'duration_min': duration,
+        'speed_mph': speed,
+        'is_night': rng.random(ROWS) < 0.4,
+        'fare_per_mile_z': rng.choice([-3.0, 0.0, 3.0, 3.01, 4.0, 4.01], ROWS),
+        'speed_mph_z': rng.choice([0.0, 4.0, 4.01, 9.0], ROWS),
+        'tip_pct_z': rng.choice([0.0, 4.0, 4.01, 9.0], ROWS),
+        'typical_route_minutes': rng.choice([0.0, 14.5], ROWS),
+    })
+    # Equal to the trip's distance on a share of rows, so the strict '<' is tested too
+    df['min_route_distance'] = np.where(rng.random(ROWS) < 0.3, df['trip_distance'],
+                                        rng.choice([0.0, 0.5, 1.2, 3.0], ROWS))
+
+    for name in SCORING_INPUTS:
+        nulls = rng.random(ROWS) < 0.05
+        if df[name].dtype == bool:
+            df[name] = df[name].astype(object)
+        elif df[name].dtype.kind == 'i':
+            df[name] = df[name].astype('Int64')
+        df.loc[nulls, name] = None
+    return df[list(SCORING_INPUTS)]
+
+
+def records(df: pd.DataFrame) -> list:
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def reference(df: pd.DataFrame):
+    """Scores and flag names (in bit order) of the original UDF plus the appended rules"""
+    bit_order = {flag: bit for bit, flag in FLAG_BITS.items()}
+    results = [reference_score_trip(record) for record in records(df)]
+    return [score for score, _ in results], [sorted(flags, key=bit_order.get) for _, flags in results]
+
+
+def assert_matches(df: pd.DataFrame, scores, flags):
+    expected_scores, expected_flags = reference(df)
+    for i, (score, mask) in enumerate(zip(scores, flags)):
+        actual = (int(score), decode_flags(int(mask), FLAG_BITS))
+        assert actual == (expected_scores[i], expected_flags[i]), f"row {i}: {records(df.iloc[[i]])[0]}"
+
+
+@pytest.fixture(params=[1, 2, 3])
+def trips(request) -> pd.DataFrame:
+    return random_trips(request.param)
+
+
+def test_reference_hits_every_rule(trips):
+    _, flags = reference(trips)
+    assert {flag for row in flags for flag in row} == set(FLAG_BITS.values())
+
+
+def test_score_record(trips):
+    results = [score_record(record, RULES) for record in records(trips)]
+    assert_matches(trips, [score for score, _ in results], [mask for _, mask in results])
+
+
+def test_score_arrays(trips):
+    scores, flags = score_arrays({name: trips[name] for name in SCORING_INPUTS}, RULES)
+    assert scores.dtype == np.int32 and flags.dtype == np.int64
+    assert_matches(trips, scores, flags)
+
+
+@pytest.fixture(scope='module')
+def spark():
+    pytest.importorskip('pyspark')
+    if not (os.getenv('JAVA_HOME') or shutil.which('java')):
+        pytest.skip('Spark needs a Java runtime')
+    from pyspark.sql import SparkSession
+
+    session = (SparkSession.builder
+        .master('local[2]')
+        .appName('Scoring Parity')
+        .config('spark.sql.execution.arrow.pyspark.enabled', 'true')
+        .config('spark.sql.shuffle.partitions', '2')
+        .getOrCreate())
+    yield session
+    session.stop()
+
+
+@pytest.mark.parametrize('engine', ['native', 'pandas', 'udf'])
+def test_spark_engines(spark, engine):
+    from pyspark.sql.types import StructType, StructField, DoubleType, IntegerType, BooleanType
+    import fraud_detector
+
+    schema = StructType([
+        StructField(name, BooleanType() if isinstance(fallback, bool)
+                    else DoubleType() if isinstance(fallback, float) else IntegerType(), True)
+        for name, fallback in SCORING_INPUTS.items()
+    ])
+    df = random_trips(4)
+    rows = [tuple(record.values()) for record in records(df)]
+    scored = fraud_detector.score_fraud(spark.createDataFrame(rows, schema), RULES, engine)
+    result = scored.select('fraud_score', 'fraud_flags').collect()
+    assert_matches(df, [r.fraud_score for r in result], [r.fraud_flags for r in result])
@@ -0,0 +1,102 @@
+"""Trip event layout shared by the Spark and lite detectors
+
+What a raw trip message looks like on nyc.taxi.trips.raw (JSON, or Avro
+behind a WIRE_MAGIC + version header, see schemas/), which of its fields the
+detectors read, and the zone lookup they enrich it with. No Spark dependency.
+"""
+
+import csv
+import json
+import os
+import struct
+from datetime import datetime, timedelta
+
+TRIP_SCHEMA_DIR = os.getenv('TRIP_SCHEMA_DIR',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'schemas'))
+# TLC zone dimension, joined onto every trip for names and boroughs
+ZONE_LOOKUP_PATH = os.getenv('ZONE_LOOKUP_PATH',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dashboard', 'data',
+                                          'taxi_zone_lookup.csv'))
+
+# Avro messages start with WIRE_MAGIC and the schema version (see schemas/)
+WIRE_MAGIC = 0xC3
+TRIP_WIRE_VERSIONS = (1,)
+
+# The only trip fields the detector reads; everything else is skipped when decoding
+CONSUMED_FIELDS = [
+    "trip_id", "VendorID", "tpep_pickup_datetime", "tpep_dropoff_datetime", "passenger_count",
+    "trip_distance", "RatecodeID", "PULocationID", "DOLocationID", "payment_type",
+    "fare_amount", "tip_amount", "total_amount", "airport_fee"
+]
+TIMESTAMP_FIELDS = ("tpep_pickup_datetime", "tpep_dropoff_datetime")
+# Zone attributes attached per side, as pickup_<name> / dropoff_<name>
+ZONE_FIELDS = {"Zone": "zone", "Borough": "borough", "service_zone": "service_zone"}
+UNKNOWN_ZONE = "Unknown"
+
+_EPOCH = datetime(1970, 1, 1)
+_unpack_double = struct.Struct('<d').unpack_from
+
+
+def load_trip_avro_schema(version: int, name: str = "trip_event") -> dict:
+    with open(os.path.join(TRIP_SCHEMA_DIR, f"{name}.v{version}.avsc")) as f:
+        return json.load(f)
+
+
+def read_zone_lookup(path: str = ZONE_LOOKUP_PATH) -> list:
+    """(LocationID, zone, borough, service_zone) rows of the zone lookup CSV"""
+    with open(path, newline='') as f:
+        return [(int(row['LocationID']), *[row[field] for field in ZONE_FIELDS]) for row in csv.DictReader(f)]
+
+
+def _read_long(data: bytes, pos: int):
+    """Avro int/long at pos: zig-zag encoded base-128 varint; returns (value, next pos)"""
+    shift = n = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return (n >> 1) ^ -(n & 1), pos
+        shift += 7
+
+
+class AvroTripDecoder:
+    """Decodes header + Avro datum of a flat ["null", primitive] trip record into a dict.
+
+    The counterpart of the API's AvroTripEncoder: fields are read in writer
+    schema order and only those in `fields` are kept. Timestamps come back as
+    datetimes.
+    """
+
+    def __init__(self, version: int, fields=CONSUMED_FIELDS):
+        self.header = bytes([WIRE_MAGIC, version])
+        self.fields = []
+        wanted = set(fields)
+        for field in load_trip_avro_schema(version)['fields']:
+            branch = field['type'][1] if isinstance(field['type'], list) else None
+            kind = branch.get('logicalType') if isinstance(branch, dict) else branch
+            if field['type'][0] != 'null' or kind not in ('int', 'long', 'double', 'string', 'local-timestamp-micros'):
+                raise ValueError(f"Unsupported type for trip field '{field['name']}': {field['type']}")
+            self.fields.append((field['name'], kind, field['name'] in wanted))
+
+    def __call__(self, data: bytes) -> dict:
+        trip, pos = {}, len(self.header)
+        for name, kind, keep in self.fields:
+            branch = data[pos]
+            pos += 1
+            if branch == 0:
+                value = None
+            elif kind == 'double':
+                value = _unpack_double(data, pos)[0]
+                pos += 8
+            elif kind == 'string':
+                size, pos = _read_long(data, pos)
+                value = data[pos:pos + size].decode('utf-8')
+                pos += size
+            else:
+                value, pos = _read_long(data, pos)
+                if kind == 'local-timestamp-micros':
+                    value = _EPOCH + timedelta(microseconds=value)
+            if keep:
+                trip[name] = value
+        return trip